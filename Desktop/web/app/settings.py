@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -18,6 +19,43 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
 
+# Варианты изображений строятся в пуле процессов; синхронно - для тестов
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANTS_EAGER = False
+# Файл без ссылок удаляется, только если он не менялся дольше этого срока (в секундах):
+# одинаковая загрузка могла переиспользовать его, но еще не закоммитить свою запись
+MEDIA_GRACE_PERIOD = 3600
+
+# Фоновые выгрузки: каталог с готовыми файлами и размер пула потоков
+EXPORT_CACHE_DIR = BASE_DIR / "export_cache"
+EXPORT_JOB_WORKERS = 2
+# Выполнять выгрузки синхронно (для тестов)
+EXPORT_JOBS_EAGER = False
+
+# Кэш хранит версии данных (transportation/versions.py), ответы API, таблицы
+# HTML-страниц, карты мест и пользователей сессий. При нескольких процессах он
+# должен быть общим, иначе изменение данных в одном воркере не сбросит кэш в
+# других: REDIS_URL включает Redis, без него кэш локален для процесса и годится
+# только для одного процесса (runserver, тесты).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Время жизни закэшированных ответов API (инвалидация идет по версиям данных)
+API_CACHE_TIMEOUT = 300
+# Время жизни закэшированных таблиц HTML-страниц (transportation/views.py)
+HTML_CACHE_TIMEOUT = 300
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -27,6 +65,26 @@ SECRET_KEY = 'django-insecure-n&e4s$$$jct*1i3x)^$1^p3dkd9@mth2mum@8+67kt%@%^wu0c
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Писать в лог превышение бюджета SQL-запросов вьюсетов (transportation/budgets.py)
+QUERY_BUDGET_LOGGING = DEBUG
+
+# Профилирование запросов (transportation/profiling.py): заголовок Server-Timing
+# и журнал запросов дольше порога (None - не писать) с самыми долгими SQL
+PROFILING_SERVER_TIMING = DEBUG
+PROFILING_SLOW_REQUEST_MS = 1000
+PROFILING_SLOW_TOP_QUERIES = 5
+
+# Пользователь с профилем кэшируется (transportation/auth.py); таймаут ограничивает,
+# сколько действует изменение в обход сигналов, например QuerySet.update(is_active=False)
+AUTHENTICATION_BACKENDS = ["transportation.auth.CachedModelBackend"]
+AUTH_PRINCIPAL_CACHE_TIMEOUT = 60
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+# Время действия подтверждения OTP, сек.
+OTP_CLAIM_TTL = 300
+
+# Адреса, с которых доступен /metrics (transportation/metrics.py)
+METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")
+
 ALLOWED_HOSTS = []
 
 
@@ -48,6 +106,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'transportation.metrics.MetricsMiddleware',
+    'transportation.profiling.ProfilingMiddleware',
+    'transportation.db.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', 
@@ -99,6 +160,12 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # Медленные запросы и превышения бюджетов SQL
+        'transportation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -110,9 +177,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Постоянные соединения с проверкой перед повторным использованием
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Запись сразу берет блокировку, вместо SQLITE_BUSY при повышении блокировки
+            'transaction_mode': 'IMMEDIATE',
+            # Ожидание блокировки задает busy_timeout в SQLITE_PRAGMAS
+        },
     }
 }
 
+# Реплика для чтения: копия базы, обновляемая командой sync_replica
+# (включается переменной окружения DB_REPLICA_PATH)
+if os.environ.get('DB_REPLICA_PATH'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DB_REPLICA_PATH'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['transportation.db.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает с основной базы (дольше интервала запуска sync_replica)
+DB_PRIMARY_PIN_SECONDS = 300
+
+# Прагмы для каждого нового соединения SQLite (transportation/db.py)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -164,4 +262,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Курсорная пагинация включается параметрами ?cursor= или ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'transportation.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
@@ -7,6 +7,8 @@ from rest_framework.routers import DefaultRouter
 from transportation.api import ClientViewSet, FlightViewSet, SecuredModelViewSet, TicketViewSet, BaggageViewSet, AirplaneViewSet, UserViewSet
 
 from transportation import views 
+from transportation.async_api import async_urlpatterns
+from transportation.metrics import metrics_view
 
 router = DefaultRouter()
 router.register("clients", ClientViewSet, basename="clients")
@@ -24,5 +26,8 @@ urlpatterns = [
     path('baggage/', views.ShowBaggagesView.as_view(), name='show_baggages'),
     path('airplane/', views.ShowAirplanesView.as_view(), name='show_airplanes'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    # Асинхронные list/retrieve/stats, выигрыш дают под ASGI (app/asgi.py)
+    path('api/async/', include(async_urlpatterns(router))),
     path('api/', include(router.urls)),
 ] + static (settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
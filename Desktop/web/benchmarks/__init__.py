@@ -0,0 +1,44 @@
+import os
+import statistics
+
+
+def setup_django(db_path):
+    """Настраивает Django на отдельную базу SQLite, не трогая db.sqlite3"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+    import django
+    from django.conf import settings
+
+    settings.DEBUG = False
+    # Число запросов бенчмарки считают сами, журнал превышений бюджета только мешает выводу
+    settings.QUERY_BUDGET_LOGGING = False
+    # Логгер django из настроек проекта печатает каждый SQL-запрос
+    settings.LOGGING = {'version': 1, 'disable_existing_loggers': False}
+    settings.DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': str(db_path),
+        }
+    }
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def summarize_ms(durations):
+    """p50/p95/max в миллисекундах для списка длительностей в секундах"""
+    values = sorted(d * 1000 for d in durations)
+    return {
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'max_ms': round(values[-1], 3),
+    }
@@ -0,0 +1,307 @@
+"""Бенчмарк эндпоинтов API: задержка (p50/p95), число SQL-запросов и пиковая память.
+
+Запуск из каталога проекта:
+    python -m benchmarks.api --scale 1000 --iterations 20
+    python -m benchmarks.api --scale 1000 --compare benchmarks/results/<прошлый>.json
+
+Данные генерируются командой generate_data во временной базе. Результаты
+сохраняются в JSON (по умолчанию benchmarks/results/<commit>.json), чтобы
+сравнивать их между коммитами.
+"""
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+
+from benchmarks import setup_django, summarize_ms
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# SecuredModelViewSet не задает queryset и обслуживает только OTP-действия
+IGNORED_ROUTES = {'auth-list', 'auth-detail'}
+
+
+class Scenario:
+    def __init__(self, name, method, url, data=None, route=None, expected=(200,), setup=None):
+        self.name = name
+        # setup вызывается перед каждым запросом вне замера (после очистки кэша)
+        self.setup = setup
+        self.method = method
+        self.url = url
+        self.data = data
+        self.route = route
+        self.expected = expected
+
+    def __call__(self, client):
+        data = self.data() if callable(self.data) else self.data
+        url = self.url() if callable(self.url) else self.url
+        response = getattr(client, self.method)(url, data, format='json')
+        if response.status_code not in self.expected:
+            raise RuntimeError(f"{self.name}: {response.status_code} {getattr(response, 'content', b'')[:200]}")
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+
+def build_scenarios(ids, password):
+    from itertools import count
+
+    import pyotp
+    from django.contrib.auth.models import User
+
+    serial = count()
+
+    def otp_key():
+        user = User.objects.get(pk=ids['user'])
+        return {'key': pyotp.TOTP(user.profile.otp_key).now()}
+
+    export_job = {}
+
+    def start_export_job(client):
+        # Каждый замер создает новую задачу: ее статус хранится в базе (ExportJob)
+        response = Scenario('job', 'post', '/api/clients/export/jobs/', {'type': 'csv'}, expected=(202,))(client)
+        export_job['id'] = response.json()['id']
+
+    def export_job_url(suffix=''):
+        return f"/api/clients/export/jobs/{export_job['id']}/{suffix}"
+
+    duplicates = {}
+
+    def make_duplicates(client):
+        from transportation.models import Client
+
+        # Слияние удаляет дубликат, поэтому перед каждым замером создаем пару заново
+        duplicates['target'], duplicates['source'] = (
+            Client.objects.create(name='Дубликат Клиент', email='dup@example.com', phone='+7 900 000 00 00',
+                                  user_id=ids['user']).id
+            for _ in range(2)
+        )
+
+    scenarios = [
+        Scenario('user-register', 'post', '/api/user/register/',
+                 lambda: {'username': f'bench{next(serial)}', 'password': password}, route='user-register'),
+        Scenario('user-login', 'post', '/api/user/login/', {'username': 'bench', 'password': password}, route='user-login'),
+        Scenario('user-info', 'post', '/api/user/info/', route='user-get-info'),
+        Scenario('user-logout', 'post', '/api/user/logout/', route='user-logout'),
+        Scenario('otp-login', 'post', '/api/auth/otp-login/', otp_key, route='auth-otp-login'),
+        Scenario('otp-status', 'get', '/api/auth/otp-status/', route='auth-otp-status'),
+        Scenario('otp-qr-code', 'get', '/api/auth/otp-qr-code/', route='auth-generate-qr-code'),
+    ]
+
+    payloads = {
+        'clients': lambda: {'name': f'Клиент {next(serial)}', 'email': 'bench@example.com', 'phone': '123'},
+        'flights': lambda: {'flight_number': 'BN1', 'departure': 'Москва', 'destination': 'Казань',
+                            'departure_time': '2025-05-01T10:00:00Z', 'arrival_time': '2025-05-01T12:00:00Z'},
+        'tickets': lambda: {'client': ids['client'], 'flight': ids['flight'], 'seat_number': '1A'},
+        'baggage': lambda: {'ticket': ids['ticket'], 'weight': '10.00', 'baggage_type': 'Сумка'},
+        'airplanes': lambda: {'tail_number': f'BN-{next(serial)}', 'model': 'Bench', 'capacity': 100,
+                              'flight': ids['flight']},
+    }
+    detail_ids = {'clients': 'client', 'flights': 'flight', 'tickets': 'ticket', 'baggage': 'baggage',
+                  'airplanes': 'airplane'}
+
+    for basename, payload in payloads.items():
+        scenarios += [
+            Scenario(f'{basename}-list', 'get', f'/api/{basename}/', route=f'{basename}-list'),
+            Scenario(f'{basename}-list-page', 'get', f'/api/{basename}/?page_size=50', route=f'{basename}-list'),
+            Scenario(f'{basename}-retrieve', 'get', f'/api/{basename}/{ids[detail_ids[basename]]}/',
+                     route=f'{basename}-detail'),
+            Scenario(f'{basename}-create', 'post', f'/api/{basename}/', payload, route=f'{basename}-list',
+                     expected=(201,)),
+            Scenario(f'{basename}-stats', 'get', f'/api/{basename}/stats/', route=f'{basename}-get-stats'),
+        ]
+
+    scenarios += [
+        Scenario('clients-export-excel', 'get', '/api/clients/export/', route='clients-export-clients'),
+        Scenario('clients-export-csv', 'get', '/api/clients/export/?type=csv', route='clients-export-clients'),
+        Scenario('clients-export-job', 'post', '/api/clients/export/jobs/', {'type': 'csv'},
+                 route='clients-create-export-job', expected=(202,)),
+        Scenario('clients-export-job-status', 'get', lambda: export_job_url(), route='clients-export-job-status',
+                 setup=start_export_job),
+        Scenario('clients-export-job-download', 'get', lambda: export_job_url('download/'),
+                 route='clients-download-export-job', setup=start_export_job),
+        Scenario('tickets-bulk-update', 'patch', '/api/tickets/bulk/',
+                 lambda: [{'id': pk, 'seat_number': '2B'} for pk in ids['tickets']], route='tickets-bulk-update'),
+        Scenario('baggage-bulk-update', 'patch', '/api/baggage/bulk/',
+                 lambda: [{'id': pk, 'baggage_type': 'Чемодан'} for pk in ids['baggage_list']],
+                 route='baggage-bulk-update'),
+        Scenario('flights-export', 'get', '/api/flights/export/', route='flights-export-flights'),
+        Scenario('tickets-export', 'get', '/api/tickets/export/', route='tickets-export-tickets'),
+        Scenario('baggage-export', 'get', '/api/baggage/export/', route='baggage-export-baggage'),
+        Scenario('airplanes-export', 'get', '/api/airplanes/export/', route='airplanes-export-airplanes'),
+        Scenario('flights-search', 'get', '/api/flights/search/?departure_after=2025-03-01T00:00:00Z'
+                 '&departure_before=2025-03-08T00:00:00Z', route='flights-search'),
+        Scenario('flights-seats', 'get', f"/api/flights/{ids['flight']}/seats/", route='flights-seats'),
+        Scenario('clients-search', 'get', '/api/clients/search/?q=ан', route='clients-search'),
+        Scenario('clients-duplicates', 'get', '/api/clients/duplicates/', route='clients-duplicates'),
+        Scenario('clients-merge', 'post', '/api/clients/merge/',
+                 lambda: {'target': duplicates['target'], 'sources': [duplicates['source']]},
+                 route='clients-merge', setup=make_duplicates),
+    ]
+    return scenarios
+
+
+def uncovered_routes(scenarios):
+    """Маршруты роутера из app/urls.py, которые бенчмарк не вызывает"""
+    from app.urls import router
+
+    covered = {scenario.route for scenario in scenarios}
+    names = {pattern.name for pattern in router.urls if pattern.name and pattern.name != 'api-root'}
+    return sorted(names - covered - IGNORED_ROUTES)
+
+
+def measure(client, scenario, iterations, warm_cache):
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    durations, queries = [], []
+    for _ in range(iterations):
+        if not warm_cache:
+            cache.clear()
+        if scenario.setup:
+            scenario.setup(client)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            scenario(client)
+            durations.append(time.perf_counter() - started)
+        queries.append(len(captured))
+
+    # Память меряем отдельным прогоном: tracemalloc сильно замедляет код
+    if not warm_cache:
+        cache.clear()
+    if scenario.setup:
+        scenario.setup(client)
+    tracemalloc.start()
+    scenario(client)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {**summarize_ms(durations), 'queries': max(queries), 'peak_kb': round(peak / 1024, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text())['endpoints']
+    print(f"\nСравнение с {baseline_path}:")
+    regressions = 0
+    for name, current in results['endpoints'].items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        marks = []
+        if current['queries'] > previous['queries']:
+            marks.append(f"запросов {previous['queries']} -> {current['queries']}")
+        if current['p95_ms'] > previous['p95_ms'] * 1.2 and current['p95_ms'] - previous['p95_ms'] > 1:
+            marks.append(f"p95 {previous['p95_ms']} -> {current['p95_ms']} мс")
+        if marks:
+            regressions += 1
+            print(f"  РЕГРЕССИЯ {name}: " + ", ".join(marks))
+    if not regressions:
+        print("  регрессий не найдено")
+    return regressions
+
+
+def seed(scale, seed_value):
+    from django.core.management import call_command
+
+    call_command(
+        'generate_data',
+        clients=scale, flights=max(scale // 10, 1), airplanes=max(scale // 20, 1),
+        tickets=scale, baggage=max(scale // 10, 1), users=0, seed=seed_value, workers=0,
+        stdout=StringIO(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='число клиентов и билетов')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--warm-cache', action='store_true', help='не очищать кэш ответов между запросами')
+    parser.add_argument('--only', help='мерить только сценарии, имя которых содержит строку')
+    parser.add_argument('--output', help='файл результатов JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(Path(tmp) / 'bench.sqlite3')
+
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+
+        from transportation.models import Airplane, Baggage, Client, Flight, Ticket
+
+        settings.ALLOWED_HOSTS = ['testserver']
+        settings.EXPORT_CACHE_DIR = Path(tmp) / 'export_cache'
+        settings.EXPORT_JOBS_EAGER = True
+
+        started = time.perf_counter()
+        seed(args.scale, args.seed)
+        print(f"Данные сгенерированы за {time.perf_counter() - started:.1f} с (scale={args.scale})")
+
+        password = 'bench-password'
+        user = User.objects.create_superuser(username='bench', password=password)
+        ids = {
+            'user': user.id,
+            'client': Client.objects.order_by('id').values_list('id', flat=True).first(),
+            'flight': Flight.objects.order_by('id').values_list('id', flat=True).first(),
+            'ticket': Ticket.objects.order_by('id').values_list('id', flat=True).first(),
+            'baggage': Baggage.objects.order_by('id').values_list('id', flat=True).first(),
+            'airplane': Airplane.objects.order_by('id').values_list('id', flat=True).first(),
+            'tickets': list(Ticket.objects.order_by('id').values_list('id', flat=True)[:50]),
+            'baggage_list': list(Baggage.objects.order_by('id').values_list('id', flat=True)[:50]),
+        }
+
+        client = APIClient()
+        client.force_authenticate(user)
+
+        scenarios = build_scenarios(ids, password)
+        missing = uncovered_routes(scenarios)
+        if args.only:
+            scenarios = [s for s in scenarios if args.only in s.name]
+
+        endpoints = {}
+        for scenario in scenarios:
+            endpoints[scenario.name] = measure(client, scenario, args.iterations, args.warm_cache)
+            data = endpoints[scenario.name]
+            print(f"{scenario.name:28} p50={data['p50_ms']:9.3f} мс  p95={data['p95_ms']:9.3f} мс  "
+                  f"запросов={data['queries']:4}  память={data['peak_kb']:9.1f} КБ")
+
+    results = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'scale': args.scale,
+        'iterations': args.iterations,
+        'warm_cache': args.warm_cache,
+        'uncovered_routes': missing,
+        'endpoints': endpoints,
+    }
+    if missing:
+        print(f"\nНе покрыты бенчмарком: {', '.join(missing)}")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"\nРезультаты сохранены в {output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,225 @@
+"""Пропускная способность при параллельных запросах: WSGI (app/wsgi.py) против ASGI (app/asgi.py).
+
+Запуск из каталога проекта:
+    python -m benchmarks.concurrency --scale 1000 --requests 400 --concurrency 32 --threads 8
+    python -m benchmarks.concurrency --db-latency-ms 5
+
+Приложения вызываются в процессе, без сетевого сервера, чтобы сравнивать
+только обработку запросов:
+  wsgi       синхронный API, пул из --threads потоков, как у WSGI-сервера;
+  asgi       асинхронный API (/api/async/...) в цикле событий;
+  asgi-sync  синхронный API под ASGI (Django выполняет его в потоках).
+--concurrency клиентов шлют запросы друг за другом; задержка считается с момента
+отправки, то есть включает ожидание свободного потока. --db-latency-ms добавляет
+паузу к каждому SQL-запросу и имитирует сетевую базу данных.
+
+На SQLite режим wsgi быстрее обоих ASGI-режимов во всех сценариях: асинхронный
+ORM Django выполняет запросы в одном общем потоке (thread_sensitive), а WSGI -
+в --threads потоках. Например, при --scale 300 --concurrency 32 --db-latency-ms 5
+retrieve дает 105-130 зап/с под wsgi и около 77 зап/с под asgi.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from benchmarks import setup_django, summarize_ms
+from benchmarks.api import seed
+
+MODES = ('wsgi', 'asgi', 'asgi-sync')
+
+
+def endpoints(client_id):
+    return {
+        'list': 'clients/?page_size=50',
+        'retrieve': f'clients/{client_id}/',
+        'stats': 'clients/stats/',
+    }
+
+
+def add_db_latency(seconds):
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    connection_created.connect(install, weak=False)
+    for connection in connections.all(initialized_only=True):
+        install(None, connection)
+
+
+def wsgi_environ(url, cookie):
+    path, _, query = url.partition('?')
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver', 'HTTP_COOKIE': cookie, 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(url, cookie):
+    path, _, query = url.partition('?')
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+
+
+def run_wsgi(application, url, cookie, requests, concurrency, threads):
+    remaining = iter(range(requests))
+    lock = threading.Lock()
+    durations, errors = [], 0
+
+    def call():
+        status = []
+        result = application(wsgi_environ(url, cookie), lambda s, headers, exc_info=None: status.append(s))
+        try:
+            for _ in result:
+                pass
+        finally:
+            result.close()
+        return int(status[0][:3])
+
+    # Клиентов больше, чем потоков сервера: лишние ждут в очереди, как у WSGI-сервера
+    with ThreadPoolExecutor(max_workers=threads) as server:
+        def client():
+            nonlocal errors
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                started = time.perf_counter()
+                code = server.submit(call).result()
+                with lock:
+                    durations.append(time.perf_counter() - started)
+                    errors += code != 200
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            for future in [clients.submit(client) for _ in range(concurrency)]:
+                future.result()
+        return time.perf_counter() - started, durations, errors
+
+
+async def call_asgi(application, scope):
+    disconnected = asyncio.Event()
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    try:
+        await application(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status
+
+
+async def run_asgi(application, url, cookie, requests, concurrency):
+    remaining = iter(range(requests))
+    durations, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        while next(remaining, None) is not None:
+            started = time.perf_counter()
+            code = await call_asgi(application, asgi_scope(url, cookie))
+            durations.append(time.perf_counter() - started)
+            errors += code != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - started, durations, errors
+
+
+def measure(mode, url, cookie, args):
+    if mode == 'wsgi':
+        from app.wsgi import application
+        elapsed, durations, errors = run_wsgi(
+            application, f'/api/{url}', cookie, args.requests, args.concurrency, args.threads)
+    else:
+        from app.asgi import application
+        prefix = '/api/async/' if mode == 'asgi' else '/api/'
+        elapsed, durations, errors = asyncio.run(
+            run_asgi(application, f'{prefix}{url}', cookie, args.requests, args.concurrency))
+    return {'rps': round(len(durations) / elapsed, 1), **summarize_ms(durations), 'errors': errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='число клиентов и билетов')
+    parser.add_argument('--requests', type=int, default=400, help='запросов на каждый эндпоинт и режим')
+    parser.add_argument('--concurrency', type=int, default=32, help='одновременных клиентов')
+    parser.add_argument('--threads', type=int, default=8, help='потоков WSGI-сервера')
+    parser.add_argument('--db-latency-ms', type=float, default=0, help='пауза на каждый SQL-запрос')
+    parser.add_argument('--warm-cache', action='store_true', help='не отключать кэш ответов')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='файл результатов JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(Path(tmp) / 'bench.sqlite3')
+
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from django.test import Client as HTTPClient
+
+        from transportation.models import Client
+
+        settings.ALLOWED_HOSTS = ['testserver']
+        if not args.warm_cache:
+            # Ответы list/retrieve иначе отдавались бы из кэша после первого запроса
+            settings.API_CACHE_TIMEOUT = 0
+
+        seed(args.scale, args.seed)
+        user = User.objects.create_superuser(username='bench', password='bench-password')
+        http = HTTPClient()
+        http.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={http.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        if args.db_latency_ms:
+            add_db_latency(args.db_latency_ms / 1000)
+
+        client_id = Client.objects.order_by('id').values_list('id', flat=True).first()
+        results = {}
+        for name, url in endpoints(client_id).items():
+            for mode in MODES:
+                data = results[f'{name}/{mode}'] = measure(mode, url, cookie, args)
+                print(f"{name:9} {mode:10} {data['rps']:9.1f} зап/с  p50={data['p50_ms']:9.3f} мс  "
+                      f"p95={data['p95_ms']:9.3f} мс  ошибок={data['errors']}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({'args': vars(args), 'results': results}, ensure_ascii=False, indent=2))
+        print(f"\nРезультаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
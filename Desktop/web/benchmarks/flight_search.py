@@ -0,0 +1,178 @@
+"""Бенчмарк поиска рейсов (/api/flights/search/) на большой таблице.
+
+Запуск из каталога проекта:
+    python -m benchmarks.flight_search --flights 1000000 --users 100
+
+Рейсы распределены между --users пользователями. Запросы идут через
+эндпоинт: обычный пользователь (каждый запрос добавляет user_id = X) и
+суперпользователь (поиск по всем рейсам). Для каждого сценария печатается
+план SQL-запроса, который выполняет представление.
+База создается во временном файле (или в --db), db.sqlite3 не используется.
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks import setup_django, summarize_ms
+
+CITIES = [f"Город-{i}" for i in range(200)]
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def seed_users(count):
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+
+    password = make_password('bench-password')
+    users = [User(username=f'bench{i}', password=password) for i in range(count)]
+    User.objects.bulk_create(users)
+    return [user.id for user in User.objects.filter(username__startswith='bench').order_by('id')]
+
+
+def seed_flights(count, seed, user_ids, batch_size=20000):
+    from django.db import connection, transaction
+
+    rng = random.Random(seed)
+    sql = (
+        'INSERT INTO transportation_flight '
+        '(flight_number, departure, destination, departure_time, arrival_time, user_id) '
+        'VALUES (%s, %s, %s, %s, %s, %s)'
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(0, count, batch_size):
+            rows = []
+            for i in range(offset, min(offset + batch_size, count)):
+                departure_time = START + timedelta(minutes=rng.randrange(365 * 24 * 60))
+                rows.append((
+                    f"FL{i}",
+                    rng.choice(CITIES),
+                    rng.choice(CITIES),
+                    departure_time.isoformat(),
+                    (departure_time + timedelta(hours=rng.randint(1, 12))).isoformat(),
+                    rng.choice(user_ids),
+                ))
+            cursor.executemany(sql, rows)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def scenarios(rng):
+    day = START + timedelta(days=rng.randrange(360))
+    return {
+        'route_and_range': dict(
+            origin=rng.choice(CITIES), destination=rng.choice(CITIES),
+            departure_after=day, departure_before=day + timedelta(days=7),
+        ),
+        'destination_and_range': dict(
+            destination=rng.choice(CITIES),
+            departure_after=day, departure_before=day + timedelta(days=1),
+        ),
+        'range_only': dict(departure_after=day, departure_before=day + timedelta(hours=6)),
+        # Широкий интервал: общий индекс по времени просматривает рейсы всех пользователей
+        'wide_range': dict(departure_after=day, departure_before=day + timedelta(days=30)),
+    }
+
+
+def query_string(params, limit):
+    return {
+        **{key: value.isoformat() if isinstance(value, datetime) else value for key, value in params.items()},
+        'limit': limit,
+    }
+
+
+def run(iterations, limit, seed, users):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    rng = random.Random(seed)
+    clients = {}
+    for role, user in users.items():
+        clients[role] = APIClient()
+        clients[role].force_authenticate(user)
+
+    timings, sql_timings, plans = {}, {}, {}
+    for _ in range(iterations):
+        for name, params in scenarios(rng).items():
+            for role, client in clients.items():
+                key = f'{name}/{role}'
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = client.get('/api/flights/search/', query_string(params, limit))
+                    timings.setdefault(key, []).append(time.perf_counter() - started)
+                assert response.status_code == 200, response.content
+
+                # Тот же SQL, что выполнило представление, отдельно от сериализации и HTTP
+                sql = queries.captured_queries[-1]['sql']
+                with connection.cursor() as cursor:
+                    started = time.perf_counter()
+                    cursor.execute(sql)
+                    cursor.fetchall()
+                    sql_timings.setdefault(key, []).append(time.perf_counter() - started)
+                    if key not in plans:
+                        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                        plans[key] = ' / '.join(row[-1] for row in cursor.fetchall())
+    return {
+        name: {
+            **summarize_ms(values),
+            'sql': summarize_ms(sql_timings[name]),
+            'plan': plans[name],
+        }
+        for name, values in timings.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--flights', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100, help='между сколькими пользователями делятся рейсы')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='файл SQLite; по умолчанию временный')
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error('--users должно быть не меньше 1')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(args.db) if args.db else Path(tmp) / 'bench.sqlite3'
+        fresh = not db_path.exists()
+        setup_django(db_path)
+
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from transportation.models import Flight
+
+        settings.ALLOWED_HOSTS = ['testserver']
+        user_ids = seed_users(args.users) if fresh else \
+            list(User.objects.filter(username__startswith='bench').order_by('id').values_list('id', flat=True))
+        if fresh or Flight.objects.count() < args.flights:
+            started = time.perf_counter()
+            seed_flights(args.flights - Flight.objects.count(), args.seed, user_ids)
+            print(f"Сгенерировано рейсов: {args.flights} за {time.perf_counter() - started:.1f} с")
+
+        users = {
+            'user': User.objects.get(pk=user_ids[0]),
+            'superuser': User.objects.filter(is_superuser=True).first()
+            or User.objects.create_superuser(username='bench-admin', password='bench-password'),
+        }
+        results = {
+            'flights': args.flights, 'users': args.users, 'limit': args.limit,
+            'scenarios': run(args.iterations, args.limit, args.seed, users),
+        }
+
+    for name, data in results['scenarios'].items():
+        print(f"{name:34} p50={data['p50_ms']:8.3f} мс  p95={data['p95_ms']:8.3f} мс  max={data['max_ms']:8.3f} мс"
+              f"  (SQL p50={data['sql']['p50_ms']:7.3f} мс  p95={data['sql']['p95_ms']:7.3f} мс)")
+        print(f"{'':34} {data['plan']}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
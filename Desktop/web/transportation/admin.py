@@ -1,10 +1,19 @@
 from django.contrib import admin
 from transportation.models import Client, Flight, Ticket, Baggage, Airplane
+from transportation.search import search_client_ids
 
 # Register your models here.
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
     list_display = ['name', 'email', 'phone']
+    search_fields = ['name', 'email', 'phone']
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по полнотекстовому индексу вместо icontains по всей таблице
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pk__in=search_client_ids(search_term, limit=self.search_limit)), False
 
 @admin.register(Flight)
 class FlightAdmin(admin.ModelAdmin):
@@ -2,10 +2,9 @@ from rest_framework.viewsets import GenericViewSet
 from django.contrib.auth.models import User
 from rest_framework import mixins
 from transportation.models import Client, Flight, Ticket, Baggage, Airplane, UserProfile
-from transportation.serializers import ClientSerializer, FlightSerializer, TicketSerializer, BaggageSerializer, AirplaneSerializer,  UserLoginSerializer
+from transportation.serializers import ClientSerializer, FlightSerializer, TicketSerializer, BaggageSerializer, AirplaneSerializer,  UserLoginSerializer, FlightSearchSerializer, ClientSearchSerializer, DuplicatesQuerySerializer, ClientMergeSerializer, BULK_MAX_ITEMS, sparse_fields_kwargs
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Count, Avg, Max, Min
 from rest_framework.permissions import IsAuthenticated, BasePermission
 from django.core.cache import cache
 from django.contrib.auth import authenticate, login
@@ -13,19 +12,30 @@ import pyotp
 from rest_framework import serializers, viewsets, status
 from django.contrib.auth import authenticate, login, logout
 from django.views.decorators.csrf import csrf_exempt 
-import os
 from django.http import FileResponse
-from openpyxl import Workbook  # для Excel
-from docx import Document  # для Word
 from rest_framework.permissions import BasePermission
 from django.core.cache import cache
 from django.http import HttpResponse
-import qrcode
 from io import BytesIO
 from rest_framework.viewsets import ModelViewSet
+from transportation.eager import eager_load
+from transportation.caching import VersionedCacheMixin
+from transportation.budgets import QueryBudgetMixin
+from transportation.stats import get_model_stats
+from transportation.seats import get_seat_map
+from transportation.search import search_client_ids, search_flights
+from transportation.dedup import duplicates_report, merge_clients
+from transportation.exports import EXTENSIONS, export_response, write_clients_docx
+from transportation.jobs import artifact_path, get_job, submit_export_job
+from transportation.auth import OTP_CLAIM_COOKIE, has_otp_claim, issue_otp_claim
+from transportation.qr import get_qr_png, qr_digest
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.conf import settings
+from rest_framework.reverse import reverse
 # Миксин для фильтрации данных по пользователю
 class UserFilteredViewSet(GenericViewSet):
-    def get_queryset(self):
+    def get_user_queryset(self):
         user = self.request.user
         if user.is_superuser:
             # Для суперпользователя показываем все
@@ -34,16 +44,89 @@ class UserFilteredViewSet(GenericViewSet):
             # Для обычного пользователя фильтруем по его user_id
             return self.queryset.filter(user=user)
 
+    def get_serializer(self, *args, **kwargs):
+        # ?fields= и ?expand= обрезают сериализатор, а с ним и план жадной загрузки
+        kwargs = {**sparse_fields_kwargs(self.request), **kwargs}
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        # Подгружаем связи, нужные сериализатору, чтобы избежать N+1 запросов
+        return eager_load(self.get_user_queryset(), self.get_serializer())
+
+
+# Миксин потоковой выгрузки в CSV/XLSX с учетом фильтрации по пользователю
+class StreamingExportMixin:
+    export_columns = ()
+    export_filename = "export"
+    export_title = "Лист1"
+
+    def stream_export(self, request):
+        file_type = request.query_params.get("type", "excel")
+        return export_response(
+            self.get_user_queryset().order_by("id"),
+            self.export_columns,
+            file_type,
+            self.export_filename,
+            title=self.export_title,
+        )
+
+# Миксин массового создания (POST списком) и частичного обновления (PATCH .../bulk/)
+class BulkCreateUpdateMixin:
+    def bulk_response(self, objects, status_code):
+        # Повторно читаем объекты с жадной загрузкой, чтобы ответ собирался без N+1
+        queryset = self.get_queryset().filter(pk__in=[obj.pk for obj in objects]).order_by("id")
+        return Response(self.get_serializer(queryset, many=True).data, status=status_code)
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data, many=True, max_length=BULK_MAX_ITEMS)
+        serializer.is_valid(raise_exception=True)
+        objects = serializer.save()
+        return self.bulk_response(objects, status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=["PATCH"], url_path="bulk")
+    def bulk_update(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Ожидается список объектов с полем id'}, status=400)
+
+        ids = []
+        for item in request.data:
+            try:
+                ids.append(int(item['id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        # Обновлять можно только свои записи
+        instances = list(self.get_user_queryset().filter(pk__in=ids))
+        serializer = self.get_serializer(instances, data=request.data, many=True, partial=True, max_length=BULK_MAX_ITEMS)
+        serializer.is_valid(raise_exception=True)
+        objects = serializer.save()
+        return self.bulk_response(objects, status.HTTP_200_OK)
+
+
 class ClientViewSet(
+    QueryBudgetMixin,
+    VersionedCacheMixin,
     mixins.CreateModelMixin,
     mixins.UpdateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
+    StreamingExportMixin,
     UserFilteredViewSet
 ):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
+    # Максимум SQL-запросов на действие, проверяется в QueryBudgetTestCase
+    query_budgets = {
+        'list': 2, 'retrieve': 2, 'create': 5, 'update': 4, 'partial_update': 4, 'destroy': 14,
+        'get_stats': 1, 'export_clients': 1, 'create_export_job': 9, 'search': 4,
+        'duplicates': 1, 'merge': 12,
+    }
+    export_columns = (("name", "ФИО"), ("email", "Email"), ("phone", "Телефон"))
+    export_filename = "clients"
+    export_title = "Клиенты"
     def update(self, request, *args, **kwargs):
         try:
             instance = self.get_object()
@@ -55,134 +138,272 @@ class ClientViewSet(
             return Response({'detail': str(e)}, status=500)
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request, *args, **kwargs):
-        stats = Client.objects.aggregate(
-            count=Count("id"),
-            avg=Avg("id"),
-            max=Max("id"),
-            min=Min("id"),
+        return Response(get_model_stats(Client, request.user))
+
+    @action(detail=False, methods=["GET"], url_path="search")
+    def search(self, request, *args, **kwargs):
+        # Полнотекстовый поиск по ФИО, email и телефону: ?q=иван петр (слова ищутся по префиксу)
+        params = ClientSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        user = request.user
+        ids = search_client_ids(
+            params.validated_data["q"],
+            user_id=None if user.is_superuser else user.id,
+            limit=params.validated_data["limit"],
         )
-        return Response(stats)
+        found = self.get_queryset().in_bulk(ids)
+        return Response(self.get_serializer([found[pk] for pk in ids if pk in found], many=True).data)
+
+    @action(detail=False, methods=["GET"], url_path="duplicates")
+    def duplicates(self, request, *args, **kwargs):
+        # Группы похожих клиентов: ?threshold=0.6&limit=50
+        params = DuplicatesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        scope = "all" if request.user.is_superuser else request.user.id
+        return Response(duplicates_report(self.get_user_queryset(), scope=scope, **params.validated_data))
+
+    @action(detail=False, methods=["POST"], url_path="merge")
+    def merge(self, request, *args, **kwargs):
+        # {"target": id, "sources": [id, ...]}: билеты дубликатов переходят к target, дубликаты удаляются
+        params = ClientMergeSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        target_id, source_ids = params.validated_data["target"], params.validated_data["sources"]
+        clients = self.get_user_queryset().in_bulk([target_id, *source_ids])
+        missing = [pk for pk in [target_id, *source_ids] if pk not in clients]
+        if missing:
+            return Response({'detail': f'Клиенты не найдены: {missing}'}, status=404)
+
+        try:
+            moved = merge_clients(clients[target_id], [clients[pk] for pk in source_ids])
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        data = self.get_serializer(self.get_queryset().get(pk=target_id)).data
+        return Response({'client': data, 'moved_tickets': moved, 'removed': source_ids})
 
     @action(detail=False, methods=["GET"], url_path="export")
     def export_clients(self, request, *args, **kwargs):
-        file_type = request.query_params.get("type", "excel")  # Тип файла: excel или word
-
-        if file_type == "word":
-            document = Document()
-            document.add_heading('Список клиентов', level=1)
-
-            for client in Client.objects.all():
-                document.add_paragraph(f"ФИО: {client.name}")
-                document.add_paragraph(f"Email: {client.email}")
-                document.add_paragraph(f"Телефон: {client.phone}")
-                document.add_paragraph("-" * 40)
-
-            file_path = "clients.docx"
-            document.save(file_path)
-
-        else:  # По умолчанию Excel
-            workbook = Workbook()
-            sheet = workbook.active
-            sheet.title = "Клиенты"
-            sheet.append(["ФИО", "Email", "Телефон"])
+        file_type = request.query_params.get("type", "excel")  # Тип файла: excel, csv или word
 
-            for client in Client.objects.all():
-                sheet.append([client.name, client.email, client.phone])
+        if file_type != "word":
+            # Excel и CSV формируются потоково, без промежуточного файла
+            return self.stream_export(request)
 
-            file_path = "clients.xlsx"
-            workbook.save(file_path)
-
-        response = FileResponse(open(file_path, 'rb'), as_attachment=True)
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
+        # Документ сохраняется в память, а не в общий файл в рабочей директории
+        buffer = BytesIO()
+        write_clients_docx(self.get_user_queryset().order_by("id"), buffer)
+        buffer.seek(0)
 
-        return response
+        return FileResponse(buffer, as_attachment=True, filename="clients.docx")
+
+    def export_job_data(self, request, job):
+        data = {'id': job['id'], 'type': job['type'], 'status': job['status']}
+        if job['status'] == 'done':
+            data['download'] = reverse('clients-download-export-job', kwargs={'job_id': job['id']}, request=request)
+        if job['status'] == 'failed':
+            data['error'] = job.get('error')
+        return data
+
+    def get_export_job(self, request, job_id):
+        job = get_job(job_id)
+        if job is None or job['user_id'] != request.user.id:
+            return None
+        return job
+
+    @action(detail=False, methods=["POST"], url_path="export/jobs")
+    def create_export_job(self, request, *args, **kwargs):
+        file_type = request.data.get("type", "excel")
+        if file_type not in EXTENSIONS:
+            return Response({'detail': f'Неизвестный формат: {file_type}'}, status=400)
+
+        job = submit_export_job(request.user, file_type, self.export_columns, self.export_title)
+        return Response(self.export_job_data(request, job), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=["GET"], url_path=r"export/jobs/(?P<job_id>[0-9a-f]{32})")
+    def export_job_status(self, request, job_id=None, *args, **kwargs):
+        job = self.get_export_job(request, job_id)
+        if job is None:
+            return Response({'detail': 'Задача не найдена'}, status=404)
+        return Response(self.export_job_data(request, job))
+
+    @action(detail=False, methods=["GET"], url_path=r"export/jobs/(?P<job_id>[0-9a-f]{32})/download")
+    def download_export_job(self, request, job_id=None, *args, **kwargs):
+        job = self.get_export_job(request, job_id)
+        if job is None:
+            return Response({'detail': 'Задача не найдена'}, status=404)
+        if job['status'] != 'done':
+            return Response(self.export_job_data(request, job), status=409)
+
+        path = artifact_path(job['digest'], job['type'])
+        if not path.exists():
+            return Response({'detail': 'Файл выгрузки удален, создайте задачу заново'}, status=410)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f"clients.{EXTENSIONS[job['type']]}")
         
 class FlightViewSet(
+    QueryBudgetMixin,
+    VersionedCacheMixin,
     mixins.CreateModelMixin,
     mixins.UpdateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
+    StreamingExportMixin,
     UserFilteredViewSet
 ):
     queryset = Flight.objects.all()
     serializer_class = FlightSerializer
+    query_budgets = {
+        'list': 1, 'retrieve': 1, 'create': 3, 'update': 2, 'partial_update': 2, 'destroy': 16,
+        'get_stats': 1, 'export_flights': 1, 'search': 1, 'seats': 3,
+    }
+    cursor_ordering = ('departure_time', 'id')
+    export_columns = (
+        ("flight_number", "Номер рейса"),
+        ("departure", "Пункт отправления"),
+        ("destination", "Пункт назначения"),
+        ("departure_time", "Время отправления"),
+        ("arrival_time", "Время прибытия"),
+    )
+    export_filename = "flights"
+    export_title = "Рейсы"
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request, *args, **kwargs):
-        stats = Flight.objects.aggregate(
-            count=Count("id"),
-            avg=Avg("id"),
-            max=Max("id"),
-            min=Min("id"),
-        )
-        return Response(stats)
+        return Response(get_model_stats(Flight, request.user))
+
+    @action(detail=False, methods=["GET"], url_path="export")
+    def export_flights(self, request, *args, **kwargs):
+        return self.stream_export(request)
+
+    @action(detail=True, methods=["GET"], url_path="seats")
+    def seats(self, request, *args, **kwargs):
+        flight = self.get_object()
+        seat_map = get_seat_map(flight.id)
+
+        seat = request.query_params.get("seat")
+        if seat:
+            # Проверка одного места: ?seat=12C
+            return Response({"flight": flight.id, "seat": seat, "available": seat_map.is_available(seat)})
+        return Response({"flight": flight.id, **seat_map.as_dict()})
+
+    @action(detail=False, methods=["GET"], url_path="search")
+    def search(self, request, *args, **kwargs):
+        params = FlightSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = params.validated_data
+
+        queryset = search_flights(self.get_queryset(), **query)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset[:query["limit"]], many=True).data)
 
 
 class TicketViewSet(
+    QueryBudgetMixin,
+    VersionedCacheMixin,
+    BulkCreateUpdateMixin,
     mixins.CreateModelMixin,
     mixins.UpdateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
+    StreamingExportMixin,
     UserFilteredViewSet
 ):
     queryset = Ticket.objects.all()
     serializer_class = TicketSerializer
+    query_budgets = {
+        'list': 2, 'retrieve': 2, 'create': 6, 'update': 6, 'partial_update': 3, 'destroy': 9,
+        'get_stats': 1, 'export_tickets': 1, 'bulk_update': 3,
+    }
+    cursor_ordering = ('purchase_date', 'id')
+    export_columns = (
+        ("client__name", "Клиент"),
+        ("flight__flight_number", "Номер рейса"),
+        ("seat_number", "Номер места"),
+        ("purchase_date", "Дата покупки"),
+    )
+    export_filename = "tickets"
+    export_title = "Билеты"
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request, *args, **kwargs):
-        stats = Ticket.objects.aggregate(
-            count=Count("id"),
-            avg=Avg("id"),
-            max=Max("id"),
-            min=Min("id"),
-        )
-        return Response(stats)
+        return Response(get_model_stats(Ticket, request.user))
+
+    @action(detail=False, methods=["GET"], url_path="export")
+    def export_tickets(self, request, *args, **kwargs):
+        return self.stream_export(request)
 
 
 class BaggageViewSet(
+    QueryBudgetMixin,
+    VersionedCacheMixin,
+    BulkCreateUpdateMixin,
     mixins.CreateModelMixin,
     mixins.UpdateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
+    StreamingExportMixin,
     UserFilteredViewSet
 ):
     queryset = Baggage.objects.all()
     serializer_class = BaggageSerializer
+    query_budgets = {
+        'list': 2, 'retrieve': 2, 'create': 7, 'update': 7, 'partial_update': 3, 'destroy': 5,
+        'get_stats': 1, 'export_baggage': 1, 'bulk_update': 3,
+    }
+    export_columns = (
+        ("ticket__seat_number", "Билет"),
+        ("weight", "Вес (кг)"),
+        ("baggage_type", "Тип багажа"),
+    )
+    export_filename = "baggage"
+    export_title = "Багаж"
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request, *args, **kwargs):
-        stats = Baggage.objects.aggregate(
-            count=Count("id"),
-            avg=Avg("id"),
-            max=Max("id"),
-            min=Min("id"),
-        )
-        return Response(stats)
+        return Response(get_model_stats(Baggage, request.user))
+
+    @action(detail=False, methods=["GET"], url_path="export")
+    def export_baggage(self, request, *args, **kwargs):
+        return self.stream_export(request)
 
 
 class AirplaneViewSet(
+    QueryBudgetMixin,
+    VersionedCacheMixin,
     mixins.CreateModelMixin,
     mixins.UpdateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
+    StreamingExportMixin,
     UserFilteredViewSet
 ):
     queryset = Airplane.objects.all()
     serializer_class = AirplaneSerializer
+    query_budgets = {
+        'list': 1, 'retrieve': 1, 'create': 5, 'update': 4, 'partial_update': 2, 'destroy': 4,
+        'get_stats': 1, 'export_airplanes': 1,
+    }
+    export_columns = (
+        ("tail_number", "Бортовой номер"),
+        ("model", "Модель"),
+        ("capacity", "Вместимость"),
+        ("flight__flight_number", "Рейс"),
+    )
+    export_filename = "airplanes"
+    export_title = "Самолеты"
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request, *args, **kwargs):
-        stats = Airplane.objects.aggregate(
-            count=Count("id"),
-            avg=Avg("id"),
-            max=Max("id"),
-            min=Min("id"),
-        )
-        return Response(stats)
+        return Response(get_model_stats(Airplane, request.user))
+
+    @action(detail=False, methods=["GET"], url_path="export")
+    def export_airplanes(self, request, *args, **kwargs):
+        return self.stream_export(request)
   
 class UserViewSet(viewsets.GenericViewSet):
     serializer_class = UserLoginSerializer
@@ -221,7 +442,9 @@ class UserViewSet(viewsets.GenericViewSet):
     @action(url_path="logout", methods=["POST"], detail=False)
     def logout(self, request, *args, **kwargs):
         logout(request)
-        return Response({"detail": "Logout successful"})
+        response = Response({"detail": "Logout successful"})
+        response.delete_cookie(OTP_CLAIM_COOKIE)
+        return response
 
     @action(url_path="register", methods=["POST"], detail=False)
     def register(self, request, *args, **kwargs):
@@ -247,9 +470,9 @@ class SecuredModelViewSet(ModelViewSet):
         key = serializers.CharField()
 
     class OTPRequired(BasePermission):
-        """Проверка действующего OTP-токена"""
+        """Проверка действующего OTP-токена (подписанного, без обращения к кэшу)"""
         def has_permission(self, request, view):
-            return bool(cache.get(f'otp_good_{request.user.id}', False))
+            return has_otp_claim(request, request.user)
 
     @action(detail=False, methods=['POST'], url_path='otp-login', serializer_class=OTPSerializer)
     def otp_login(self, request, *args, **kwargs):
@@ -258,17 +481,18 @@ class SecuredModelViewSet(ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        success = False
-        if totp.verify(serializer.validated_data['key']):
-            cache.set(f'otp_good_{request.user.id}', True, timeout=300)  # Время жизни OTP (300 сек.)
-            success = True
+        if not totp.verify(serializer.validated_data['key']):
+            return Response({'success': False}, status=status.HTTP_200_OK)
 
-        return Response({'success': success}, status=status.HTTP_200_OK)
+        # Подтверждение действует OTP_CLAIM_TTL секунд; клиенты без cookie передают его в X-OTP-Claim
+        claim = issue_otp_claim(request, request.user)
+        response = Response({'success': True, 'otp_claim': claim}, status=status.HTTP_200_OK)
+        response.set_cookie(OTP_CLAIM_COOKIE, claim, max_age=settings.OTP_CLAIM_TTL, httponly=True, samesite='Lax')
+        return response
 
     @action(detail=False, methods=['GET'], url_path='otp-status')
     def otp_status(self, request, *args, **kwargs):
-        otp_good = cache.get(f'otp_good_{request.user.id}', False)
-        return Response({'otp_good': otp_good}, status=status.HTTP_200_OK)
+        return Response({'otp_good': has_otp_claim(request, request.user)}, status=status.HTTP_200_OK)
 
     def get_permissions(self):
         """Добавляем проверку на OTP для редактирования."""
@@ -284,18 +508,14 @@ class SecuredModelViewSet(ModelViewSet):
             return Response({"error": "Профиль пользователя не настроен."}, status=400)
 
 
-        # Создание OTP URI
-        totp = pyotp.TOTP(request.user.profile.otp_key)
-        otp_uri = totp.provisioning_uri(
-            name=request.user.username,
-            issuer_name="Travel"
-        )
-
-        # Создание QR-кода
-        qr = qrcode.make(otp_uri)
-        buffer = BytesIO()
-        qr.save(buffer, format="PNG")
-        buffer.seek(0)
-
-        # Возврат QR-кода в формате изображения
-        return HttpResponse(buffer, content_type="image/png")
+        # Картинка кэшируется по хэшу ключа; браузер перепроверяет ее по ETag и получает 304
+        digest = qr_digest(request.user)
+        etag = f'"{digest}"'
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(get_qr_png(request.user, digest), content_type="image/png")
+        response["ETag"] = etag
+        # Код содержит секрет: только приватный кэш и обязательная перепроверка
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
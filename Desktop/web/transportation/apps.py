@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TransportationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transportation'
+
+    def ready(self):
+        # Подключаем сигналы, поддерживающие статистику, карты мест, кэш пользователей,
+        # варианты изображений, поиск клиентов, настройку соединений с БД и профилирование SQL;
+        # checks регистрирует проверки развертывания
+        from transportation import auth, checks, db, images, profiling, search, seats, stats  # noqa: F401
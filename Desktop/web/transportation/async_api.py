@@ -0,0 +1,118 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import path
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from transportation.api import UserFilteredViewSet
+from transportation.caching import aresponse_cache_key
+from transportation.db import primary_reads
+from transportation.eager import eager_load
+from transportation.metrics import count_cache
+from transportation.serializers import sparse_fields_kwargs
+from transportation.stats import aget_model_stats
+
+# Асинхронные list/retrieve/stats для вьюсетов из transportation/api.py
+# (/api/async/<префикс>/...). Под ASGI (app/asgi.py) запрос не занимает поток
+# воркера, пока ждет БД: чтения идут через асинхронный ORM. Queryset,
+# сериализатор, пагинация и фильтр по пользователю берутся у вьюсета, поэтому
+# ответы совпадают с синхронным API. Связи подгружаются eager_load заранее,
+# и сериализация идет в цикле событий без обращений к БД.
+# Быстрее синхронного API этот путь не становится: асинхронный ORM Django
+# выполняет все запросы в одном общем потоке, и на SQLite пул потоков WSGI
+# обрабатывает больше запросов в секунду (benchmarks/concurrency.py). Он нужен,
+# чтобы при развертывании под ASGI запросы к API не блокировали цикл событий.
+
+
+class AsyncViewSetView(View):
+    viewset = None
+    action = "list"
+    http_method_names = ["get", "head", "options"]
+
+    async def get(self, request, pk=None):
+        self.api_request = Request(
+            request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        )
+        try:
+            # Аутентификаторы DRF синхронные (сессия, Basic, токен)
+            user = await sync_to_async(lambda: self.api_request.user)()
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            data = await getattr(self, self.action)(user, pk)
+        except exceptions.APIException as exc:
+            # Как в DRF: первой идет сессия без WWW-Authenticate, поэтому 403, а не 401
+            status = 403 if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)) \
+                else exc.status_code
+            return self.render({"detail": exc.detail}, status)
+        return self.render(data)
+
+    def render(self, data, status=200):
+        return HttpResponse(JSONRenderer().render(data), status=status, content_type="application/json")
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs = {**sparse_fields_kwargs(self.api_request), **kwargs}
+        return self.viewset.serializer_class(*args, context={"request": self.api_request}, **kwargs)
+
+    def get_queryset(self, user):
+        queryset = self.viewset.queryset.all()
+        if not user.is_superuser:
+            queryset = queryset.filter(user=user)
+        return eager_load(queryset, self.get_serializer())
+
+    async def cached(self, handler, user, pk):
+        # Кэш ответов как в VersionedCacheMixin. При нескольких воркерах это Redis, то есть
+        # сетевые обращения, поэтому ключ, версии данных и сам ответ читаются асинхронным API кэша
+        key = await aresponse_cache_key(self.api_request, self.get_serializer())
+        data = await cache.aget(key)
+        count_cache("response", data is not None)
+        if data is None:
+            with primary_reads():
+                data = await handler(user, pk)
+            await cache.aset(key, data, timeout=settings.API_CACHE_TIMEOUT)
+        return data
+
+    async def list(self, user, pk):
+        return await self.cached(self.load_list, user, pk)
+
+    async def load_list(self, user, pk):
+        queryset = self.get_queryset(user)
+        paginator = self.viewset.pagination_class()
+        if paginator.is_requested(self.api_request):
+            page = await sync_to_async(paginator.paginate_queryset)(queryset, self.api_request, self.viewset)
+            return paginator.get_paginated_response(self.get_serializer(page, many=True).data).data
+        objects = [obj async for obj in queryset]
+        return self.get_serializer(objects, many=True).data
+
+    async def retrieve(self, user, pk):
+        return await self.cached(self.load_object, user, pk)
+
+    async def load_object(self, user, pk):
+        obj = await self.get_queryset(user).filter(pk=pk).afirst()
+        if obj is None:
+            raise exceptions.NotFound()
+        return self.get_serializer(obj).data
+
+    async def stats(self, user, pk):
+        return await aget_model_stats(self.viewset.queryset.model, user)
+
+
+def async_urlpatterns(router):
+    """Маршруты /api/async/ для вьюсетов роутера, отдающих данные пользователя"""
+    patterns = []
+    for prefix, viewset, basename in router.registry:
+        if not issubclass(viewset, UserFilteredViewSet):
+            continue
+        patterns += [
+            path(f"{prefix}/", AsyncViewSetView.as_view(viewset=viewset, action="list"),
+                 name=f"async-{basename}-list"),
+            path(f"{prefix}/stats/", AsyncViewSetView.as_view(viewset=viewset, action="stats"),
+                 name=f"async-{basename}-stats"),
+            path(f"{prefix}/<int:pk>/", AsyncViewSetView.as_view(viewset=viewset, action="retrieve"),
+                 name=f"async-{basename}-detail"),
+        ]
+    return patterns
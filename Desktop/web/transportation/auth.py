@@ -0,0 +1,107 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core import signing
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from transportation.models import UserProfile
+
+UserModel = get_user_model()
+
+# Быстрый путь аутентификации.
+# Пользователь вместе с профилем кэшируется на AUTH_PRINCIPAL_CACHE_TIMEOUT,
+# поэтому запрос с сессией обычно не обращается к таблицам пользователей. Кэш
+# сбрасывается при сохранении или удалении пользователя и профиля; изменения
+# в обход сигналов (QuerySet.update) вступают в силу не позже чем через таймаут.
+# Подтверждение OTP - подписанный токен (cookie или заголовок X-OTP-Claim),
+# который проверяется без обращений к кэшу и БД. Токен привязан к хэшу пароля
+# и к сессии, в которой выдан: смена пароля и выход из сессии его отзывают.
+
+OTP_CLAIM_COOKIE = "otp_claim"
+OTP_CLAIM_HEADER = "HTTP_X_OTP_CLAIM"
+OTP_CLAIM_SALT = "transportation.otp"
+
+
+def _principal_key(user_id):
+    return f"auth_principal_{user_id}"
+
+
+def load_principal(user_id):
+    key = _principal_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = UserModel._default_manager.select_related("profile").filter(pk=user_id).first()
+        if user is None:
+            return None
+        cache.set(key, user, timeout=settings.AUTH_PRINCIPAL_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_principal(user_id):
+    cache.delete(_principal_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            # Профиль загружаем сразу, он нужен при входе и проверке OTP
+            user = UserModel._default_manager.select_related("profile").get(**{UserModel.USERNAME_FIELD: username})
+        except UserModel.DoesNotExist:
+            # Хэшируем пароль, чтобы время ответа не выдавало отсутствие пользователя
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        user = load_principal(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+
+def _session_digest(request):
+    # Сам ключ сессии в токен не попадает: подписанное значение читается клиентом
+    session = getattr(request, "session", None)
+    session_key = session.session_key if session is not None else None
+    return hashlib.sha256(session_key.encode()).hexdigest()[:16] if session_key else ""
+
+
+def _claim_subject(request, user):
+    # Хэш сессии пользователя меняется со сменой пароля, ключ сессии - при выходе
+    return f"{user.pk}:{user.get_session_auth_hash()}:{_session_digest(request)}"
+
+
+def issue_otp_claim(request, user):
+    return signing.TimestampSigner(salt=OTP_CLAIM_SALT).sign(_claim_subject(request, user))
+
+
+def has_otp_claim(request, user):
+    claim = request.META.get(OTP_CLAIM_HEADER) or request.COOKIES.get(OTP_CLAIM_COOKIE)
+    if not claim or not user.is_authenticated:
+        return False
+    try:
+        subject = signing.TimestampSigner(salt=OTP_CLAIM_SALT).unsign(claim, max_age=settings.OTP_CLAIM_TTL)
+    except signing.BadSignature:
+        return False
+    return subject == _claim_subject(request, user)
+
+
+def _invalidate_user(sender, instance, **kwargs):
+    invalidate_principal(instance.pk)
+
+
+def _invalidate_profile(sender, instance, **kwargs):
+    invalidate_principal(instance.user_id)
+
+
+post_save.connect(_invalidate_user, sender=UserModel, dispatch_uid="auth_principal_user_save")
+post_delete.connect(_invalidate_user, sender=UserModel, dispatch_uid="auth_principal_user_delete")
+post_save.connect(_invalidate_profile, sender=UserProfile, dispatch_uid="auth_principal_profile_save")
+post_delete.connect(_invalidate_profile, sender=UserProfile, dispatch_uid="auth_principal_profile_delete")
@@ -0,0 +1,51 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("transportation.budgets")
+
+
+# Бюджет SQL-запросов на действие вьюсета: query_budgets = {"list": 3, ...}.
+# Бюджеты проверяются тестами (QueryBudgetTestCase), а при включенной настройке
+# QUERY_BUDGET_LOGGING превышение пишется в лог во время работы.
+# Бюджет задается для холодного кэша ответов и не должен зависеть от числа строк
+# (destroy зависит только от числа каскадно удаляемых моделей, см. stats.batched_removals).
+# Строки статистики создаются вместе с пользователем, поэтому первая запись
+# нового пользователя укладывается в тот же бюджет, что и последующие.
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMixin:
+    query_budgets = {}
+
+    def get_query_budget(self):
+        return self.query_budgets.get(getattr(self, "action", None))
+
+    def dispatch(self, request, *args, **kwargs):
+        if not getattr(settings, "QUERY_BUDGET_LOGGING", False):
+            return super().dispatch(request, *args, **kwargs)
+
+        # Запросы потоковых ответов (выгрузок) выполняются уже после dispatch и здесь не считаются
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            # Считаем запросы ко всем базам: чтения могут уйти на реплику (transportation/db.py)
+            for alias_connection in connections.all():
+                stack.enter_context(alias_connection.execute_wrapper(counter))
+            response = super().dispatch(request, *args, **kwargs)
+
+        budget = self.get_query_budget()
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                "Превышен бюджет запросов %s.%s: %d > %d (%s %s)",
+                type(self).__name__, self.action, counter.count, budget, request.method, request.path,
+            )
+        return response
@@ -0,0 +1,32 @@
+from transportation.models import Client, Ticket
+from transportation.search import index_clients
+from transportation.seats import invalidate_seat_map
+from transportation.stats import record_many_added
+from transportation.versions import bump_data_version
+
+# bulk_create/bulk_update не отправляют post_save, поэтому всё, что обычно
+# делают сигналы (версии данных, статистика, карты мест, поисковый индекс),
+# выполняется здесь. Хуки вызываются внутри транзакции записи: статистика и
+# индекс меняются вместе с данными, а версии и карты мест сбрасываются еще раз
+# после COMMIT (transaction.on_commit в bump_data_version и invalidate_seat_map).
+
+
+def after_bulk_create(model, objects):
+    bump_data_version(model)
+    record_many_added(model, objects)
+    if model is Client:
+        index_clients(objects)
+    if model is Ticket:
+        invalidate_seat_map(*(obj.flight_id for obj in objects))
+
+
+def after_bulk_update(model, objects):
+    bump_data_version(model)
+    if model is Client:
+        index_clients(objects)
+    if model is Ticket:
+        flight_ids = [obj.flight_id for obj in objects]
+        flight_ids += [getattr(obj, "_seat_flight_id", None) for obj in objects]
+        invalidate_seat_map(*flight_ids)
+        for obj in objects:
+            obj._seat_flight_id = obj.flight_id
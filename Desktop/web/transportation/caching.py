@@ -0,0 +1,61 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from transportation.db import primary_reads
+from transportation.eager import get_serializer_models
+from transportation.metrics import count_cache
+from transportation.versions import aget_data_versions, get_data_versions
+
+
+# Кэш ответов list/retrieve. Ключ включает пользователя, путь, параметры
+# запроса и версии всех моделей, попадающих в ответ сериализатора, поэтому
+# любое сохранение или удаление делает старые записи недостижимыми.
+# При промахе данные читаются с основной базы: реплика может отставать от версии.
+
+def response_cache_key(request, serializer):
+    models = get_serializer_models(serializer)
+    return _response_cache_key(request, models, get_data_versions(models))
+
+
+async def aresponse_cache_key(request, serializer):
+    models = get_serializer_models(serializer)
+    return _response_cache_key(request, models, await aget_data_versions(models))
+
+
+def _response_cache_key(request, models, versions):
+    version_part = ",".join(
+        f"{model._meta.label_lower}={versions[model]}"
+        for model in sorted(models, key=lambda m: m._meta.label_lower)
+    )
+    params = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.lists()))
+    raw = f"{request.user.pk}|{request.path}|{params}|{version_part}"
+    return "response_" + hashlib.sha256(raw.encode()).hexdigest()
+
+
+class VersionedCacheMixin:
+    cache_actions = ('list', 'retrieve')
+
+    def get_response_cache_key(self, request):
+        return response_cache_key(request, self.get_serializer())
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        count_cache("response", data is not None)
+        if data is not None:
+            return Response(data)
+
+        with primary_reads():
+            response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=settings.API_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
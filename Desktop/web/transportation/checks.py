@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Кэши с версиями данных работают правильно только тогда, когда кэш общий для
+# всех процессов. Локальный кэш процесса допустим для разработки и тестов.
+
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            "Кэш по умолчанию локален для процесса: изменение данных в одном воркере "
+            "не сбросит закэшированные ответы в остальных.",
+            hint="Задайте REDIS_URL или другой общий бэкенд CACHES при запуске нескольких процессов.",
+            id="transportation.W001",
+        )
+    ]
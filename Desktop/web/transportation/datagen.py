@@ -0,0 +1,96 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from faker import Faker
+
+# Генераторы тестовых данных для команды generate_data. Модуль не импортирует
+# Django, поэтому функции можно выполнять в отдельных процессах. Каждая порция
+# строится из собственного seed, так что результат не зависит от числа процессов.
+# Вместо ссылок на объекты порции содержат индексы (клиента, рейса, ...),
+# которые команда переводит в id уже после вставки. offset сдвигает номера
+# рейсов и бортов за уже существующие, чтобы повторный запуск не давал дублей.
+
+BAGGAGE_TYPES = ["Ручная кладь", "Чемодан", "Спортинвентарь", "Музыкальный инструмент", "Сумка", "Рюкзак", "Спортивная сумка"]
+SEAT_LETTERS = "ABCDEF"
+# Фиксированная точка отсчета, чтобы данные зависели только от seed
+YEAR_START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+_fakers = {}
+
+
+def _faker(seed):
+    # Создание Faker дорогое, поэтому в каждом процессе он один
+    fake = _fakers.get("ru_RU")
+    if fake is None:
+        fake = _fakers["ru_RU"] = Faker(["ru_RU"])
+    fake.seed_instance(seed)
+    return fake
+
+
+def chunk_seed(seed, entity, start):
+    return f"{seed}:{entity}:{start}"
+
+
+def _rng(seed):
+    return random.Random(seed)
+
+
+def _user(rng, users_count):
+    return rng.randrange(users_count) if users_count else None
+
+
+def _moment(rng):
+    return YEAR_START + timedelta(seconds=rng.randrange(365 * 24 * 60 * 60))
+
+
+def make_clients(seed, start, count, users_count):
+    fake, rng = _faker(seed), _rng(seed)
+    return [
+        (fake.name(), fake.email(), fake.phone_number(), _user(rng, users_count))
+        for _ in range(count)
+    ]
+
+
+def make_flights(seed, start, count, users_count, offset=0):
+    fake, rng = _faker(seed), _rng(seed)
+    rows = []
+    for index in range(offset + start, offset + start + count):
+        departure_time = _moment(rng)
+        rows.append((
+            f"FL-{index:07d}",
+            fake.city(),
+            fake.city(),
+            departure_time,
+            departure_time + timedelta(minutes=rng.randint(45, 12 * 60)),
+            _user(rng, users_count),
+        ))
+    return rows
+
+
+def make_airplanes(seed, start, count, users_count, flights_count, offset=0):
+    fake, rng = _faker(seed), _rng(seed)
+    return [
+        (f"TN-{index:07d}", fake.word(), rng.randint(50, 300), rng.randrange(flights_count), _user(rng, users_count))
+        for index in range(offset + start, offset + start + count)
+    ]
+
+
+def make_tickets(seed, start, count, users_count, clients_count, flights_count):
+    rng = _rng(seed)
+    return [
+        (
+            rng.randrange(clients_count),
+            rng.randrange(flights_count),
+            f"{rng.randint(1, 50)}{rng.choice(SEAT_LETTERS)}",
+            _user(rng, users_count),
+        )
+        for _ in range(count)
+    ]
+
+
+def make_baggage(seed, start, count, users_count, tickets_count):
+    rng = _rng(seed)
+    return [
+        (rng.randrange(tickets_count), round(rng.uniform(5.0, 30.0), 2), rng.choice(BAGGAGE_TYPES), _user(rng, users_count))
+        for _ in range(count)
+    ]
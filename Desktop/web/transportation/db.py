@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Настройка соединений SQLite и маршрутизация чтения на реплику.
+# Прагмы из SQLITE_PRAGMAS применяются к каждому новому соединению (WAL
+# позволяет читать во время записи). Чтение идет на алиас "replica", если он
+# настроен, запись - на "default". После первой записи в запросе и внутри
+# транзакции чтение закрепляется за основной базой, чтобы видеть свои изменения.
+# Реплика обновляется не сразу, поэтому после записи PrimaryPinMiddleware ставит
+# клиенту cookie, и его следующие запросы еще DB_PRIMARY_PIN_SECONDS читают с
+# основной базы. Заполнение кэшей с версией данных в ключе тоже читает с
+# основной базы (primary_reads): иначе старые данные реплики закэшировались бы
+# под новой версией.
+
+PRIMARY = "default"
+REPLICA = "replica"
+
+# Модели, которые пишутся в фоне и читаются сразу после записи: реплике они не нужны
+PRIMARY_ONLY_MODELS = {"transportation.exportjob"}
+
+PIN_COOKIE = "db_primary"
+
+_pinned = ContextVar("db_pinned_to_primary", default=False)
+_wrote = ContextVar("db_wrote_to_primary", default=False)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    # Напрямую через sqlite3: настройка соединения не должна попадать в счетчики и профиль запросов
+    for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+connection_created.connect(apply_sqlite_pragmas, dispatch_uid="db_sqlite_pragmas")
+
+
+def unpin(**kwargs):
+    _pinned.set(False)
+    _wrote.set(False)
+
+
+# Каждый запрос начинает с чтения с реплики
+request_started.connect(unpin, dispatch_uid="db_unpin_request")
+
+
+@contextmanager
+def primary_reads():
+    """Чтение внутри блока идет с основной базы"""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.pin(request)
+        return self.finish(self.get_response(request))
+
+    async def __acall__(self, request):
+        self.pin(request)
+        return self.finish(await self.get_response(request))
+
+    def pin(self, request):
+        if PIN_COOKIE in request.COOKIES:
+            _pinned.set(True)
+
+    def finish(self, response):
+        # Срок продлевается только записью, а не чтением с закрепленной базы
+        if _wrote.get():
+            response.set_cookie(PIN_COOKIE, "1", max_age=settings.DB_PRIMARY_PIN_SECONDS, httponly=True, samesite="Lax")
+        return response
+
+
+class PrimaryReplicaRouter:
+    def has_replica(self):
+        return REPLICA in connections.settings
+
+    def db_for_read(self, model, **hints):
+        if not self.has_replica() or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return PRIMARY
+        if _pinned.get() or _wrote.get() or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия основной базы, связи между их объектами допустимы
+        return {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
@@ -0,0 +1,226 @@
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from transportation.db import primary_reads
+from transportation.models import Client, Ticket
+from transportation.versions import bump_data_version, get_data_version
+
+# Поиск дубликатов клиентов. Телефон и email приводятся к каноническому виду,
+# ФИО - к отсортированным словам (порядок "Фамилия Имя" / "Имя Фамилия" не важен).
+# Сравниваются не все пары, а только попавшие в общий блок индекса: совпадающий
+# телефон, email или ФИО, либо несколько общих триграмм ФИО. Блоки триграмм
+# больше MAX_BLOCK_SIZE (частые сочетания вроде "ова") отбрасываются. В точных
+# блоках такого размера (общий email-заглушка, тестовый телефон, частое ФИО)
+# запись сравнивается только с NEIGHBOR_WINDOW соседями в порядке сортировки
+# по остальным ключам, поэтому число сравнений растет почти линейно. Пары с
+# оценкой не ниже порога объединяются в группы.
+
+MAX_BLOCK_SIZE = 100
+NEIGHBOR_WINDOW = 10
+MIN_SHARED_NGRAMS = 3
+# Вклад сигналов в оценку пары: похожесть ФИО, совпадение телефона и email
+WEIGHTS = {"name": 0.5, "phone": 0.25, "email": 0.25}
+DEFAULT_THRESHOLD = 0.6
+
+_NON_LETTERS = re.compile(r"[\W\d_]+")
+
+
+def normalize_phone(phone):
+    """+7 (912) 345-67-89, 8 912 345 6789 и 9123456789 -> 79123456789"""
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = "7" + digits
+    return digits if len(digits) >= 7 else ""
+
+
+def normalize_email(email):
+    """Регистр и пробелы не важны, метка после + в имени ящика отбрасывается"""
+    email = (email or "").strip().lower()
+    local, at, domain = email.partition("@")
+    if not at or not local or not domain:
+        return ""
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def normalize_name(name):
+    words = _NON_LETTERS.sub(" ", (name or "").lower().replace("ё", "е")).split()
+    return " ".join(sorted(words))
+
+
+def name_ngrams(name, size=3):
+    grams = set()
+    for word in name.split():
+        padded = f"#{word}#"
+        grams.update(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return grams
+
+
+class Record:
+    __slots__ = ("id", "name", "email", "phone", "key_name", "key_email", "key_phone", "ngrams")
+
+    def __init__(self, id, name, email, phone):
+        self.id, self.name, self.email, self.phone = id, name, email, phone
+        self.key_name = normalize_name(name)
+        self.key_email = normalize_email(email)
+        self.key_phone = normalize_phone(phone)
+        self.ngrams = name_ngrams(self.key_name)
+
+    def as_dict(self):
+        return {"id": self.id, "name": self.name, "email": self.email, "phone": self.phone}
+
+
+def candidate_pairs(records):
+    """Пары (id, id) для сравнения, найденные по блокирующему индексу"""
+    exact = defaultdict(list)
+    ngram_blocks = defaultdict(list)
+    for record in records:
+        for prefix, key in (("p", record.key_phone), ("e", record.key_email), ("n", record.key_name)):
+            if key:
+                exact[(prefix, key)].append(record)
+        for gram in record.ngrams:
+            ngram_blocks[gram].append(record.id)
+
+    pairs = set()
+    for block in exact.values():
+        if len(block) <= MAX_BLOCK_SIZE:
+            ids = [record.id for record in block]
+            pairs.update((a, b) for i, a in enumerate(ids) for b in ids[i + 1:])
+            continue
+        # Сортированное соседство: похожие по остальным ключам записи оказываются рядом,
+        # а группа из одинаковых записей собирается цепочкой соседних пар
+        block.sort(key=lambda r: (r.key_name, r.key_email, r.key_phone, r.id))
+        for i, record in enumerate(block):
+            pairs.update(tuple(sorted((record.id, other.id))) for other in block[i + 1:i + 1 + NEIGHBOR_WINDOW])
+
+    shared = Counter()
+    for ids in ngram_blocks.values():
+        if 1 < len(ids) <= MAX_BLOCK_SIZE:
+            shared.update((a, b) for i, a in enumerate(ids) for b in ids[i + 1:])
+    pairs.update(pair for pair, count in shared.items() if count >= MIN_SHARED_NGRAMS)
+    return pairs
+
+
+def score_pair(a, b):
+    """(оценка 0..1, совпавшие признаки)"""
+    reasons = []
+    union = a.ngrams | b.ngrams
+    name_similarity = len(a.ngrams & b.ngrams) / len(union) if union else 0.0
+    score = WEIGHTS["name"] * name_similarity
+    if name_similarity == 1.0:
+        reasons.append("name")
+    if a.key_phone and a.key_phone == b.key_phone:
+        score += WEIGHTS["phone"]
+        reasons.append("phone")
+    if a.key_email and a.key_email == b.key_email:
+        score += WEIGHTS["email"]
+        reasons.append("email")
+    return round(score, 3), reasons
+
+
+def find_duplicate_groups(rows, threshold=DEFAULT_THRESHOLD):
+    """rows: [(id, name, email, phone)]. Возвращает (группы, число сравненных пар)"""
+    records = {row[0]: Record(*row) for row in rows}
+    pairs = candidate_pairs(records.values())
+
+    parent = {}
+
+    def find(pk):
+        while parent.get(pk, pk) != pk:
+            pk = parent[pk]
+        return pk
+
+    matches = []
+    for a, b in pairs:
+        score, reasons = score_pair(records[a], records[b])
+        if score >= threshold:
+            low, high = sorted((a, b))
+            matches.append({"a": low, "b": high, "score": score, "reasons": reasons})
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = defaultdict(lambda: {"clients": set(), "pairs": []})
+    for match in matches:
+        group = groups[find(match["a"])]
+        group["clients"].update((match["a"], match["b"]))
+        group["pairs"].append(match)
+
+    result = []
+    for root, group in groups.items():
+        pairs_sorted = sorted(group["pairs"], key=lambda m: (-m["score"], m["a"], m["b"]))
+        result.append({
+            # Оставить предлагается самую раннюю запись
+            "suggested_target": root,
+            "score": max(m["score"] for m in pairs_sorted),
+            "clients": [records[pk].as_dict() for pk in sorted(group["clients"])],
+            "pairs": pairs_sorted,
+        })
+    result.sort(key=lambda g: (-g["score"], -len(g["clients"]), g["suggested_target"]))
+    return result, len(pairs)
+
+
+def duplicates_report(queryset, threshold=DEFAULT_THRESHOLD, limit=50, scope=None):
+    """Отчет о дубликатах среди клиентов queryset; кэшируется до изменения клиентов"""
+    key = f"client_duplicates_{scope}_{threshold}_{limit}_{get_data_version(Client)}"
+    report = cache.get(key)
+    if report is not None:
+        return report
+
+    with primary_reads():
+        rows = list(queryset.order_by("id").values_list("id", "name", "email", "phone"))
+    groups, compared = find_duplicate_groups(rows, threshold)
+    report = {
+        "threshold": threshold,
+        "clients": len(rows),
+        "compared_pairs": compared,
+        "groups_total": len(groups),
+        "groups": groups[:limit],
+    }
+    cache.set(key, report, timeout=settings.API_CACHE_TIMEOUT)
+    return report
+
+
+def merge_clients(target, sources):
+    """Переносит билеты дубликатов на target, дополняет его пустые поля и удаляет дубликаты.
+
+    Возвращает число перенесенных билетов. Клиентов разных пользователей не объединяет:
+    билеты перешли бы к чужому владельцу.
+    """
+    sources = [source for source in sources if source.pk != target.pk]
+    if not sources:
+        return 0
+    if any(source.user_id != target.user_id for source in sources):
+        raise ValueError("Нельзя объединить клиентов разных пользователей")
+
+    with transaction.atomic():
+        moved = Ticket.objects.filter(client__in=sources).update(client=target)
+
+        changed = []
+        for field in ("name", "email", "phone"):
+            if not getattr(target, field):
+                value = next((getattr(s, field) for s in sources if getattr(s, field)), "")
+                if value:
+                    setattr(target, field, value)
+                    changed.append(field)
+        if not target.picture:
+            picture = next((s.picture.name for s in sources if s.picture), "")
+            if picture:
+                # Файл общий по содержимому, удаление дубликата его не затронет
+                target.picture = picture
+                changed += ["picture", "picture_variants"]
+        if changed:
+            target.save(update_fields=changed)
+
+        # Сигналы удаления обновят статистику, поисковый индекс и изображения
+        Client.objects.filter(pk__in=[source.pk for source in sources]).delete()
+    if moved:
+        # update() не отправляет сигналы, версию билетов меняем сами - после COMMIT,
+        # а во внешней транзакции bump_data_version повторит это в on_commit
+        bump_data_version(Ticket)
+    return moved
@@ -0,0 +1,89 @@
+from django.db.models import ForeignObjectRel
+from rest_framework import serializers
+
+
+# Планировщик жадной загрузки: по дереву сериализатора определяет,
+# какие связи нужно подтянуть через select_related / prefetch_related,
+# чтобы список сериализовался за фиксированное число запросов.
+
+def _resolve_relation(model, name):
+    """Возвращает (связанная модель, связь "ко многим") или None, если name не связь"""
+    for field in model._meta.get_fields():
+        if not field.is_relation or field.related_model is None:
+            continue
+        if isinstance(field, ForeignObjectRel):
+            accessor = field.get_accessor_name()
+        else:
+            accessor = field.name
+        if accessor == name:
+            return field.related_model, bool(field.one_to_many or field.many_to_many)
+    return None
+
+
+def _plan(serializer, model, prefix, in_prefetch, select, prefetch, models):
+    models.add(model)
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+
+        # Идем по цепочке source, пока атрибуты являются связями
+        path, current, many, depth = prefix, model, in_prefetch, 0
+        visited = []
+        for attr in field.source_attrs:
+            relation = _resolve_relation(current, attr)
+            if relation is None:
+                break
+            current, is_many = relation
+            visited.append(current)
+            path = f"{path}__{attr}" if path else attr
+            many = many or is_many
+            depth += 1
+
+        if depth == 0:
+            continue
+
+        # PrimaryKeyRelatedField по прямому FK берет значение из <fk>_id без запроса
+        if (
+            isinstance(field, serializers.PrimaryKeyRelatedField)
+            and depth == len(field.source_attrs) == 1
+            and not many
+        ):
+            continue
+
+        (prefetch if many else select).add(path)
+        models.update(visited)
+
+        if isinstance(nested, serializers.BaseSerializer):
+            _plan(nested, current, path, many, select, prefetch, models)
+
+
+def _walk(serializer):
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    select, prefetch, models = set(), set(), set()
+    _plan(serializer, serializer.Meta.model, "", False, select, prefetch, models)
+    return select, prefetch, models
+
+
+def get_eager_plan(serializer):
+    """Возвращает (пути для select_related, пути для prefetch_related)"""
+    select, prefetch, _ = _walk(serializer)
+    return sorted(select), sorted(prefetch)
+
+
+def get_serializer_models(serializer):
+    """Все модели, данные которых попадают в ответ сериализатора"""
+    _, _, models = _walk(serializer)
+    return models
+
+
+def eager_load(queryset, serializer):
+    """Добавляет к queryset жадную загрузку всех связей, нужных сериализатору"""
+    select, prefetch = get_eager_plan(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
@@ -0,0 +1,172 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+
+from transportation.models import Airplane, Client
+from transportation.storage import media_storage
+from transportation.thumbnails import VARIANTS, make_variants, variant_name
+from transportation.versions import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# Варианты изображений клиентов и самолетов (миниатюра, средний размер, WebP).
+# После сохранения новой картинки варианты строятся в пуле процессов, затем
+# их имена записываются в picture_variants, и сериализаторы отдают ссылки на них.
+# Пока вариантов нет, picture_variants пуст и клиенты используют оригинал.
+# Файлы лежат в хранилище по содержимому и могут быть общими у нескольких
+# записей, поэтому оригинал с вариантами удаляется, только когда ссылок на него не осталось.
+# Свежий файл (моложе MEDIA_GRACE_PERIOD) не удаляется: его могла переиспользовать
+# загрузка, чья запись еще не закоммичена. Такие файлы позже убирает
+# migrate_media --delete-orphans.
+
+IMAGE_MODELS = (Client, Airplane)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: рабочим процессам не нужен Django, а fork из многопоточного сервера небезопасен
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _executor
+
+
+def variant_names(name):
+    return {variant: variant_name(name, variant) for variant in VARIANTS}
+
+
+def _store_variants(model, pk, name, names):
+    # Картинку могли заменить, пока строились варианты: тогда результат уже не нужен
+    if model.objects.filter(pk=pk, picture=name).update(picture_variants=names):
+        bump_data_version(model)
+    else:
+        release_picture(name)
+
+
+def _on_done(model, pk, name, names, submitter, future):
+    # Обычно колбэк выполняется в служебном потоке пула; если задача уже завершилась,
+    # то в потоке запроса, и его соединение закрывать нельзя
+    in_pool_thread = threading.get_ident() != submitter
+    close_old_connections()
+    try:
+        future.result()
+    except Exception:
+        logger.exception("Не удалось построить варианты изображения %s", name)
+        return
+    else:
+        _store_variants(model, pk, name, names)
+    finally:
+        if in_pool_thread:
+            # Поток пула не обслуживает запросы, поэтому соединение закрываем сами
+            connection.close()
+
+
+def build_variants(name):
+    """Синхронно строит недостающие варианты и возвращает их имена"""
+    names = variant_names(name)
+    missing = {variant: path for variant, path in names.items() if not media_storage.exists(path)}
+    if missing:
+        make_variants(media_storage.path(name), {variant: media_storage.path(path) for variant, path in missing.items()})
+    return names
+
+
+def schedule_variants(model, pk, name):
+    names = variant_names(name)
+    if settings.IMAGE_VARIANTS_EAGER or all(media_storage.exists(path) for path in names.values()):
+        # Для повторной загрузки той же картинки варианты уже готовы
+        _store_variants(model, pk, name, build_variants(name))
+        return
+
+    source = media_storage.path(name)
+    targets = {variant: media_storage.path(path) for variant, path in names.items()}
+    future = get_executor().submit(make_variants, source, targets)
+    submitter = threading.get_ident()
+    future.add_done_callback(lambda done: _on_done(model, pk, name, names, submitter, done))
+
+
+def picture_references(name):
+    return sum(model.objects.filter(picture=name).count() for model in IMAGE_MODELS)
+
+
+def _is_settled(name):
+    return media_storage.is_settled(name, settings.MEDIA_GRACE_PERIOD)
+
+
+def release_picture(name):
+    """Удаляет файл и его варианты, если на них не ссылается ни одна запись; возвращает освобожденные байты"""
+    if not name:
+        return 0
+    # Та же блокировка, что и у ContentAddressedStorage._save: загрузка либо уже обновила mtime, либо запишет файл заново
+    with media_storage.content_lock(name):
+        if picture_references(name) or (media_storage.exists(name) and not _is_settled(name)):
+            return 0
+        freed = 0
+        for path in [name, *variant_names(name).values()]:
+            if media_storage.exists(path):
+                freed += media_storage.size(path)
+                media_storage.delete(path)
+    return freed
+
+
+def delete_orphan(name):
+    """Удаляет файл без ссылок, если он старше MEDIA_GRACE_PERIOD; возвращает освобожденные байты"""
+    with media_storage.content_lock(name):
+        if not media_storage.exists(name) or not _is_settled(name) or picture_references(name):
+            return 0
+        size = media_storage.size(name)
+        media_storage.delete(name)
+    return size
+
+
+def _picture_name(instance):
+    # Читаем сырое значение: обращение к отложенному полю стоило бы запроса
+    value = instance.__dict__.get("picture")
+    return getattr(value, "name", value) or ""
+
+
+def _remember_picture(sender, instance, **kwargs):
+    # Запоминаем только сохраненное имя, а не имя еще не записанной загрузки
+    value = instance.__dict__.get("picture")
+    instance._original_picture = value if isinstance(value, str) else ""
+
+
+def _reset_variants(sender, instance, **kwargs):
+    if _picture_name(instance) != getattr(instance, "_original_picture", ""):
+        instance.picture_variants = {}
+
+
+def _on_save(sender, instance, **kwargs):
+    name = _picture_name(instance)
+    old_name = getattr(instance, "_original_picture", "")
+    if name == old_name:
+        return
+    instance._original_picture = name
+
+    if old_name:
+        transaction.on_commit(lambda: release_picture(old_name))
+    if name:
+        transaction.on_commit(lambda: schedule_variants(sender, instance.pk, name))
+
+
+def _on_delete(sender, instance, **kwargs):
+    name = _picture_name(instance)
+    if name:
+        transaction.on_commit(lambda: release_picture(name))
+
+
+for image_model in IMAGE_MODELS:
+    post_init.connect(_remember_picture, sender=image_model, dispatch_uid=f"images_init_{image_model.__name__}")
+    pre_save.connect(_reset_variants, sender=image_model, dispatch_uid=f"images_pre_save_{image_model.__name__}")
+    post_save.connect(_on_save, sender=image_model, dispatch_uid=f"images_save_{image_model.__name__}")
+    post_delete.connect(_on_delete, sender=image_model, dispatch_uid=f"images_delete_{image_model.__name__}")
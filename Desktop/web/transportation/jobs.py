@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from transportation.db import primary_reads
+from transportation.exports import EXTENSIONS, stream_export, write_clients_docx
+from transportation.models import Client, ExportJob
+from transportation.versions import get_data_version
+
+logger = logging.getLogger(__name__)
+
+# Фоновые выгрузки клиентов. Задача выполняется в ограниченном пуле потоков,
+# статус хранится в таблице ExportJob (виден всем воркерам), а готовый файл
+# кладется в каталог EXPORT_CACHE_DIR под именем sha256 от содержимого.
+# Отпечаток (пользователь, формат, версия данных) связывает задачи с одним
+# результатом: пока клиенты не менялись, отдается уже собранный файл, а
+# одновременно собирается только одна выгрузка (уникальный индекс по
+# незавершенным задачам).
+
+# Незавершенная задача старше этого считается брошенной (воркер остановился)
+JOB_TIMEOUT = 60 * 60
+# Завершенные задачи хранятся сутки, потом удаляются
+JOB_RETENTION = 24 * 60 * 60
+IN_FLIGHT = ("pending", "running")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EXPORT_JOB_WORKERS,
+                thread_name_prefix="export",
+            )
+    return _executor
+
+
+def _job_data(job):
+    return {field.attname: getattr(job, field.attname) for field in ExportJob._meta.concrete_fields}
+
+
+def get_job(job_id):
+    return ExportJob.objects.filter(pk=job_id).values().first()
+
+
+def artifact_path(digest, file_type):
+    return Path(settings.EXPORT_CACHE_DIR) / f"{digest}.{EXTENSIONS[file_type]}"
+
+
+def _fingerprint(user, file_type):
+    scope = "all" if user.is_superuser else f"user{user.id}"
+    version = get_data_version(Client)
+    return hashlib.sha256(f"clients:{scope}:{file_type}:{version}".encode()).hexdigest()
+
+
+def _client_queryset(user):
+    queryset = Client.objects.order_by("id")
+    if not user.is_superuser:
+        queryset = queryset.filter(user=user)
+    return queryset
+
+
+def _write_artifact(queryset, file_type, columns, title):
+    cache_dir = Path(settings.EXPORT_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".part", delete=False) as tmp:
+        try:
+            if file_type == "word":
+                write_clients_docx(queryset, tmp)
+                tmp.flush()
+                tmp.seek(0)
+                for chunk in iter(lambda: tmp.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            else:
+                for chunk in stream_export(queryset, columns, file_type, title=title):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+        except Exception:
+            os.unlink(tmp.name)
+            raise
+
+    digest = digest.hexdigest()
+    os.replace(tmp.name, artifact_path(digest, file_type))
+    return digest
+
+
+def _ready_artifact(fingerprint, file_type):
+    """Хэш уже собранного файла с тем же отпечатком, если файл на месте"""
+    digest = (
+        ExportJob.objects.filter(fingerprint=fingerprint, status="done")
+        .order_by("-created_at").values_list("digest", flat=True).first()
+    )
+    return digest if digest and artifact_path(digest, file_type).exists() else None
+
+
+def _claim_job(job_id, user, file_type, fingerprint):
+    """(задача, создана ли она): новая задача или уже выполняющаяся с тем же отпечатком"""
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                job = ExportJob.objects.create(id=job_id, user=user, type=file_type, fingerprint=fingerprint)
+            return _job_data(job), True
+        except IntegrityError:
+            in_flight = ExportJob.objects.filter(fingerprint=fingerprint, status__in=IN_FLIGHT)
+            running = in_flight.first()
+            if running is not None and running.updated_at > timezone.now() - timedelta(seconds=JOB_TIMEOUT):
+                return _job_data(running), False
+            # Брошенная задача не должна блокировать новые выгрузки
+            in_flight.update(status="failed", error="Задача прервана", updated_at=timezone.now())
+    job = ExportJob.objects.create(id=job_id, user=user, type=file_type, fingerprint=fingerprint)
+    return _job_data(job), True
+
+
+def _delete_expired_jobs():
+    """Удаляет старые задачи и файлы, на которые больше не ссылается ни одна задача"""
+    cutoff = timezone.now() - timedelta(seconds=JOB_RETENTION)
+    expired = list(
+        ExportJob.objects.exclude(status__in=IN_FLIGHT).filter(updated_at__lt=cutoff).values_list("id", "digest", "type")
+    )
+    if not expired:
+        return
+    ExportJob.objects.filter(pk__in=[pk for pk, _, _ in expired]).delete()
+    artifacts = {(digest, file_type) for _, digest, file_type in expired if digest}
+    if not artifacts:
+        return
+    kept = set(ExportJob.objects.filter(digest__in={digest for digest, _ in artifacts}).values_list("digest", flat=True))
+    for digest, file_type in artifacts:
+        if digest not in kept:
+            artifact_path(digest, file_type).unlink(missing_ok=True)
+
+
+def _run_job(job_id, user, file_type, columns, title):
+    jobs = ExportJob.objects.filter(pk=job_id)
+    try:
+        if not jobs.update(status="running", updated_at=timezone.now()):
+            # Задачу удалили до запуска (например, вместе с пользователем)
+            logger.warning("Export job %s no longer exists", job_id)
+            return None
+        try:
+            # Файл кэшируется под версией данных, поэтому читаем с основной базы, а не с отстающей реплики
+            with primary_reads():
+                digest = _write_artifact(_client_queryset(user), file_type, columns, title)
+            jobs.update(status="done", digest=digest, updated_at=timezone.now())
+        except Exception as e:
+            logger.exception("Export job %s failed", job_id)
+            jobs.update(status="failed", error=str(e), updated_at=timezone.now())
+        _delete_expired_jobs()
+        return get_job(job_id)
+    finally:
+        if not settings.EXPORT_JOBS_EAGER:
+            # Поток пула не обслуживает запросы, поэтому соединение закрываем сами
+            connection.close()
+
+
+def submit_export_job(user, file_type, columns, title):
+    """Создает задачу выгрузки клиентов или возвращает уже готовую/выполняющуюся"""
+    fingerprint = _fingerprint(user, file_type)
+    job_id = uuid.uuid4().hex
+
+    digest = _ready_artifact(fingerprint, file_type)
+    if digest:
+        job = ExportJob.objects.create(
+            id=job_id, user=user, type=file_type, fingerprint=fingerprint,
+            status="done", digest=digest, reused=True,
+        )
+        return _job_data(job)
+
+    job, created = _claim_job(job_id, user, file_type, fingerprint)
+    if not created:
+        # Такая же выгрузка уже собирается - отдаем ее задачу
+        return job
+
+    if settings.EXPORT_JOBS_EAGER:
+        return _run_job(job_id, user, file_type, columns, title) or job
+    get_executor().submit(_run_job, job_id, user, file_type, columns, title)
+    return job
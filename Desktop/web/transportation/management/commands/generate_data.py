@@ -1,69 +1,149 @@
-from django.core.management.base import BaseCommand
-from faker import Faker
-from transportation.models import Client, Flight, Ticket, Baggage, Airplane
+import os
 import random
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pyotp
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from transportation import datagen
+from transportation.bulk import after_bulk_create
+from transportation.models import Client, Flight, Ticket, Baggage, Airplane, UserProfile
+from transportation.stats import create_user_rows
+
 
 class Command(BaseCommand):
+    help = "Генерирует тестовые данные: Faker в пуле процессов, вставка через bulk_create"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--flights', type=int, default=100)
+        parser.add_argument('--airplanes', type=int, default=50)
+        parser.add_argument('--tickets', type=int, default=1000)
+        parser.add_argument('--baggage', type=int, default=100)
+        parser.add_argument('--users', type=int, default=0,
+                            help="Создать столько новых пользователей; иначе данные делятся между существующими")
+        parser.add_argument('--seed', type=int, default=None, help="Одинаковый seed дает одинаковые данные")
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help="Число процессов для Faker; 0 - генерировать в текущем процессе")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
     def handle(self, *args, **options):
-        fake = Faker(['ru_RU'])
-        
-        # Генерация данных для клиентов (Client)
-        clients = []
-        for _ in range(1000):  # Генерируем 1000 записей
-            client = Client.objects.create(
-                name=fake.name(),
-                email=fake.email(),
-                phone=fake.phone_number(),
-                picture=None,  # Для простоты пропускаем изображения
-                user=random.choice(users)  # Присваиваем случайного пользователя
-            )
-            clients.append(client)
-
-        # Генерация данных для рейсов (Flight)
-        flights = []
-        for _ in range(100):  # Генерируем 100 рейсов
-            flight = Flight.objects.create(
-                flight_number=f"FL-{fake.unique.random_number(digits=5)}",
-                departure=fake.city(),
-                destination=fake.city(),
-                departure_time=fake.date_time_this_year(),
-                arrival_time=fake.date_time_this_year()
-            )
-            flights.append(flight)
-
-        # Генерация данных для самолетов (Airplane)
-        airplanes = []
-        for _ in range(50):  # Генерируем 50 самолетов
-            airplane = Airplane.objects.create(
-                tail_number=f"TN-{fake.unique.random_number(digits=6)}",
-                model=fake.word(),
-                capacity=random.randint(50, 300),
-                flight=random.choice(flights),
-                picture=None  # Пропускаем изображения
-            )
-            airplanes.append(airplane)
-
-        # Генерация данных для билетов (Ticket)
-        tickets = []
-        for _ in range(1000):  # Генерируем 1000 билетов
-            ticket = Ticket.objects.create(
-                client=random.choice(clients),
-                flight=random.choice(flights),
-                seat_number=f"{random.randint(1, 50)}A",
-                purchase_date=fake.date_time_this_year()
+        self.seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.batch_size = options['batch_size']
+        # Сколько порций может быть в работе или ждать записи одновременно
+        self.window = 2 * options['workers']
+        self.stdout.write(f"seed={self.seed}")
+
+        executor = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 0 else None
+        try:
+            self.executor = executor
+            started = time.perf_counter()
+
+            users = self.prepare_users(options['users'])
+            users_count = len(users)
+
+            # Генераторы возвращают индексы, здесь они переводятся в id
+            clients = self.generate(Client, 'clients', options['clients'], partial(datagen.make_clients, users_count=users_count),
+                                    lambda r: Client(name=r[0], email=r[1], phone=r[2], picture=None, user_id=self.pick(users, r[3])))
+            flights = self.generate(Flight, 'flights', options['flights'],
+                                    partial(datagen.make_flights, users_count=users_count,
+                                            offset=next_index(Flight, 'flight_number', 'FL-')),
+                                    lambda r: Flight(flight_number=r[0], departure=r[1], destination=r[2],
+                                                     departure_time=r[3], arrival_time=r[4], user_id=self.pick(users, r[5])))
+            if flights:
+                self.generate(Airplane, 'airplanes', options['airplanes'],
+                              partial(datagen.make_airplanes, users_count=users_count, flights_count=len(flights),
+                                      offset=next_index(Airplane, 'tail_number', 'TN-')),
+                              lambda r: Airplane(tail_number=r[0], model=r[1], capacity=r[2], flight_id=flights[r[3]],
+                                                 picture=None, user_id=self.pick(users, r[4])))
+            tickets = []
+            if clients and flights:
+                tickets = self.generate(Ticket, 'tickets', options['tickets'],
+                                        partial(datagen.make_tickets, users_count=users_count,
+                                                clients_count=len(clients), flights_count=len(flights)),
+                                        lambda r: Ticket(client_id=clients[r[0]], flight_id=flights[r[1]],
+                                                         seat_number=r[2], user_id=self.pick(users, r[3])))
+            if tickets:
+                self.generate(Baggage, 'baggage', options['baggage'],
+                              partial(datagen.make_baggage, users_count=users_count, tickets_count=len(tickets)),
+                              lambda r: Baggage(ticket_id=tickets[r[0]], weight=r[1], baggage_type=r[2],
+                                                user_id=self.pick(users, r[3])))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Данные сгенерированы за {time.perf_counter() - started:.1f} с!'))
+
+    def pick(self, users, index):
+        return None if index is None else users[index]
+
+    def prepare_users(self, count):
+        if count <= 0:
+            return list(User.objects.order_by('id').values_list('id', flat=True))
+
+        # У всех сгенерированных пользователей один пароль, хэшируем его один раз
+        password = make_password(f"generated-{self.seed}")
+        prefix = f"gen{self.seed}_"
+        # Повторный запуск с тем же seed продолжает нумерацию логинов
+        first = next_index(User, 'username', prefix)
+        users = [User(username=f"{prefix}{i}", password=password) for i in range(first, first + count)]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=self.batch_size)
+            # bulk_create не вызывает post_save, профили создаем сами
+            UserProfile.objects.bulk_create(
+                [UserProfile(user=user, otp_key=pyotp.random_base32()) for user in users], batch_size=self.batch_size
             )
-            tickets.append(ticket)
-
-        # Генерация данных для багажа (Baggage)
-        baggage_types = ["Ручная кладь", "Чемодан", "Спортинвентарь", "Музыкальный инструмент", "Сумка", "Рюкзак", "Спортивная сумка"]
-        baggages = []
-        for _ in range(100):  # Генерируем 100 багажей
-            baggage = Baggage.objects.create(
-            ticket=random.choice(tickets),
-            weight=round(random.uniform(5.0, 30.0), 2),
-            baggage_type=random.choice(baggage_types)  # Выбираем тип из заданного списка
-        )
-        baggages.append(baggage)
-        
-        self.stdout.write(self.style.SUCCESS('Данные сгенерированы!'))
+            create_user_rows([user.id for user in users])
+        self.stdout.write(f"users: {count} (логины {prefix}{first}..{prefix}{first + count - 1})")
+        return [user.id for user in users]
+
+    def chunks(self, entity, total, make):
+        starts = range(0, total, self.batch_size)
+        calls = [partial(make, datagen.chunk_seed(self.seed, entity, start), start, min(self.batch_size, total - start))
+                 for start in starts]
+        if self.executor is None:
+            return (call() for call in calls)
+        return self.submit_window(calls)
+
+    def submit_window(self, calls):
+        # В отличие от executor.map, отправляем не больше window порций вперед: готовые порции
+        # не копятся в памяти, пока пишутся предыдущие. Порядок сохраняется, поэтому результат детерминирован
+        calls = iter(calls)
+        pending = deque()
+        while True:
+            while len(pending) < self.window:
+                call = next(calls, None)
+                if call is None:
+                    break
+                pending.append(self.executor.submit(call))
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+    def generate(self, model, entity, total, make, build):
+        ids = []
+        started = time.perf_counter()
+        for rows in self.chunks(entity, total, make):
+            objects = [build(row) for row in rows]
+            with transaction.atomic():
+                model.objects.bulk_create(objects, batch_size=self.batch_size)
+                after_bulk_create(model, objects)
+            ids.extend(obj.pk for obj in objects)
+        self.stdout.write(f"{entity}: {len(ids)} за {time.perf_counter() - started:.1f} с")
+        return ids
+
+
+def next_index(model, field, prefix):
+    """Номер после наибольшего из значений вида <prefix><число>, уже занятых в базе"""
+    pattern = re.compile(rf"^{re.escape(prefix)}(\d+)$")
+    values = model.objects.filter(**{f"{field}__startswith": prefix}).values_list(field, flat=True)
+    return max((int(match.group(1)) + 1 for match in map(pattern.match, values) if match), default=0)
+
@@ -0,0 +1,104 @@
+import os
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from transportation.images import IMAGE_MODELS, build_variants, delete_orphan, release_picture, variant_names
+from transportation.storage import file_digest, is_content_name, media_storage
+from transportation.versions import bump_data_version
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.2f} МБ"
+
+
+class Command(BaseCommand):
+    help = "Переносит изображения в хранилище по содержимому, удаляет дубликаты и сообщает освобожденное место"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, ничего не меняя")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help="Удалить файлы, на которые не ссылается ни одна запись")
+
+    def upload_dirs(self):
+        return sorted({model._meta.get_field('picture').upload_to for model in IMAGE_MODELS})
+
+    def walk(self):
+        """Все файлы в каталогах загрузок: {имя в хранилище: размер}"""
+        files = {}
+        for directory in self.upload_dirs():
+            root = media_storage.path(directory)
+            for path, _, names in os.walk(root):
+                for file_name in names:
+                    full_path = os.path.join(path, file_name)
+                    name = os.path.relpath(full_path, media_storage.location).replace(os.sep, '/')
+                    files[name] = os.path.getsize(full_path)
+        return files
+
+    def referenced(self):
+        names = set()
+        for model in IMAGE_MODELS:
+            for name in model.objects.exclude(picture='').exclude(picture__isnull=True).values_list('picture', flat=True).distinct():
+                names.add(name)
+                names.update(variant_names(name).values())
+        return names
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        before = self.walk()
+        rows = moved = missing = 0
+        digests = defaultdict(list)
+
+        for model in IMAGE_MODELS:
+            names = model.objects.exclude(picture='').exclude(picture__isnull=True).values_list('picture', flat=True).distinct()
+            for name in list(names):
+                if is_content_name(name):
+                    continue
+                if not media_storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f"Нет файла: {name}")
+                    continue
+
+                if dry_run:
+                    # Дубликаты ищутся в пределах каталога загрузки, как и в хранилище
+                    with media_storage.open(name, 'rb') as fp:
+                        digests[(model._meta.get_field('picture').upload_to, file_digest(fp))].append(name)
+                    continue
+
+                new_name = media_storage.adopt(name)
+                with transaction.atomic():
+                    rows += model.objects.filter(picture=name).update(picture=new_name, picture_variants={})
+                release_picture(name)
+                model.objects.filter(picture=new_name).update(picture_variants=build_variants(new_name))
+                moved += 1
+            bump_data_version(model)
+
+        referenced = self.referenced()
+        orphans = {name: size for name, size in self.walk().items() if name not in referenced}
+        if options['delete_orphans'] and not dry_run:
+            # Свежие файлы пропускаются: на них может сослаться еще не закоммиченная запись
+            for name in orphans:
+                delete_orphan(name)
+
+        if dry_run:
+            duplicates = sum(before[name] for names in digests.values() for name in names[1:])
+            orphan_size = sum(orphans.values()) if options['delete_orphans'] else 0
+            self.stdout.write(
+                f"Файлов к переносу: {sum(len(n) for n in digests.values())}, уникальных: {len(digests)}, "
+                f"дубликаты: {_mb(duplicates)}, без ссылок: {len(orphans)} ({_mb(sum(orphans.values()))})"
+            )
+            self.stdout.write(self.style.SUCCESS(f"Можно освободить: {_mb(duplicates + orphan_size)}"))
+            return
+
+        after = self.walk()
+        # Новые варианты изображений не считаем: они заменяют загрузку оригиналов в списках
+        variants = sum(size for name, size in after.items() if name not in before and '/variants/' in name)
+        self.stdout.write(
+            f"Перенесено файлов: {moved}, обновлено записей: {rows}, нет на диске: {missing}, "
+            f"без ссылок: {len(orphans)} ({_mb(sum(orphans.values()))})"
+            + ("" if options['delete_orphans'] else " - удалить: --delete-orphans")
+        )
+        reclaimed = sum(before.values()) - (sum(after.values()) - variants)
+        self.stdout.write(f"Было {_mb(sum(before.values()))}, стало {_mb(sum(after.values()))}, из них варианты {_mb(variants)}")
+        self.stdout.write(self.style.SUCCESS(f"Освобождено: {_mb(reclaimed)}"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from transportation.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс клиентов для /api/clients/search/"
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Индекс поиска перестроен, клиентов: {count}'))
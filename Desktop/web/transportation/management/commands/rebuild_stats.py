@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from transportation.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает таблицу статистики для /api/*/stats/"
+
+    def handle(self, *args, **options):
+        rebuild_stats()
+        self.stdout.write(self.style.SUCCESS('Статистика пересчитана!'))
@@ -0,0 +1,27 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from transportation.db import PRIMARY, REPLICA
+
+
+class Command(BaseCommand):
+    help = "Копирует основную базу SQLite в реплику для чтения (онлайн-бэкап, без остановки записи)"
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.settings:
+            raise CommandError("Реплика не настроена: задайте DB_REPLICA_PATH")
+
+        primary = connections[PRIMARY]
+        primary.ensure_connection()
+        target = sqlite3.connect(connections.settings[REPLICA]['NAME'])
+        try:
+            # Онлайн-бэкап копирует страницы порциями и не блокирует запись в основную базу
+            primary.connection.backup(target, pages=1024)
+            target.execute("PRAGMA journal_mode = WAL")
+        finally:
+            target.close()
+        # Соединения реплики в этом процессе открываем заново
+        connections[REPLICA].close()
+        self.stdout.write(self.style.SUCCESS('Реплика обновлена!'))
@@ -0,0 +1,164 @@
+import bisect
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Метрики процесса в текстовом формате Prometheus (/metrics).
+# Счетчики хранятся в памяти процесса под одной блокировкой: запись метрики -
+# это несколько операций со словарем, поэтому их можно не выключать под нагрузкой.
+# При нескольких воркерах каждый процесс отдает свои значения.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # {(view, action, method, status): число}
+            self.requests = {}
+            self.errors = {}
+            # {(view, action): [счетчики по корзинам + +Inf, сумма]}
+            self.latency = {}
+            self.db_connections = {}
+            # {(cache, "hit"/"miss"): число}
+            self.cache = {}
+
+    def observe_request(self, view, action, method, status_code, duration):
+        status = f"{status_code // 100}xx"
+        bucket = bisect.bisect_left(self.buckets, duration)
+        with self.lock:
+            key = (view, action, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if status_code >= 500:
+                self.errors[(view, action)] = self.errors.get((view, action), 0) + 1
+            histogram = self.latency.get((view, action))
+            if histogram is None:
+                histogram = self.latency[(view, action)] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += duration
+
+    def count_connection(self, alias):
+        with self.lock:
+            self.db_connections[alias] = self.db_connections.get(alias, 0) + 1
+
+    def count_cache(self, name, hit):
+        key = (name, "hit" if hit else "miss")
+        with self.lock:
+            self.cache[key] = self.cache.get(key, 0) + 1
+
+    def render(self):
+        with self.lock:
+            requests, errors = dict(self.requests), dict(self.errors)
+            latency = {key: (list(counts), total) for key, (counts, total) in self.latency.items()}
+            db_connections, cache = dict(self.db_connections), dict(self.cache)
+
+        lines = []
+        _counter(lines, "http_requests_total", "Запросы по представлению, действию, методу и классу статуса",
+                 ("view", "action", "method", "status"), requests)
+        _counter(lines, "http_request_errors_total", "Ответы 5xx по представлению и действию",
+                 ("view", "action"), errors)
+
+        lines.append("# HELP http_request_duration_seconds Время обработки запроса")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for key, (counts, total) in sorted(latency.items()):
+            labels = _labels(("view", "action"), key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+        _counter(lines, "db_connections_total", "Открытые соединения с БД", ("alias",),
+                 {(alias,): count for alias, count in db_connections.items()})
+        _counter(lines, "cache_requests_total", "Обращения к кэшам приложения", ("cache", "result"), cache)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _counter(lines, name, help_text, label_names, values):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for key, count in sorted(values.items()):
+        lines.append(f"{name}{{{_labels(label_names, key)}}} {count}")
+
+
+registry = Registry()
+
+
+def count_cache(name, hit):
+    registry.count_cache(name, hit)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    registry.count_connection(connection.alias)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid="metrics_connection_created")
+
+
+def resolve_view(view_func, method):
+    """(представление, действие) для меток: для вьюсетов DRF - класс и action"""
+    initkwargs = getattr(view_func, "view_initkwargs", None) or {}
+    if "viewset" in initkwargs:
+        # Асинхронные представления (transportation/async_api.py) повторяют действия вьюсета
+        return initkwargs["viewset"].__name__, f"async_{initkwargs['action']}"
+    cls = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+    name = cls.__name__ if cls is not None else getattr(view_func, "__name__", "unknown")
+    actions = getattr(view_func, "actions", None) or {}
+    return name, actions.get(method.lower(), method.lower())
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started):
+        view, action = getattr(request, "_metrics_view", ("unmatched", "none"))
+        registry.observe_request(view, action, request.method, response.status_code, time.perf_counter() - started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = resolve_view(view_func, request.method)
+
+
+def metrics_view(request):
+    # Метрики отдаются только локально (например, агенту Prometheus на той же машине)
+    if request.META.get("REMOTE_ADDR") not in getattr(settings, "METRICS_ALLOWED_IPS", ("127.0.0.1", "::1")):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_stats(apps, schema_editor):
+    ModelStats = apps.get_model('transportation', 'ModelStats')
+    aggregates = dict(count=Count('id'), id_sum=Coalesce(Sum('id'), 0), max_id=Max('id'), min_id=Min('id'))
+    for name in ('Client', 'Flight', 'Ticket', 'Baggage', 'Airplane'):
+        model = apps.get_model('transportation', name)
+        label = f'transportation.{name.lower()}'
+        rows = [ModelStats(model=label, user=None, **model.objects.aggregate(**aggregates))]
+        for values in model.objects.filter(user__isnull=False).values('user_id').annotate(**aggregates):
+            rows.append(ModelStats(model=label, **values))
+        ModelStats.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transportation', '0014_cursor_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='Модель')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Количество')),
+                ('id_sum', models.BigIntegerField(default=0, verbose_name='Сумма id')),
+                ('min_id', models.BigIntegerField(null=True, verbose_name='Минимальный id')),
+                ('max_id', models.BigIntegerField(null=True, verbose_name='Максимальный id')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Статистика',
+                'verbose_name_plural': 'Статистика',
+                'constraints': [models.UniqueConstraint(fields=('model', 'user'), name='model_stats_user_unique'), models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('model',), name='model_stats_global_unique')],
+            },
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
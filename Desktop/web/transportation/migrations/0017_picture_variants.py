@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transportation', '0016_flight_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airplane',
+            name='picture_variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Варианты изображения'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='picture_variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Варианты изображения'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:04
+
+import transportation.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transportation', '0017_picture_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='airplane',
+            name='picture',
+            field=models.ImageField(null=True, storage=transportation.storage.ContentAddressedStorage(), upload_to='airplane', verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='client',
+            name='picture',
+            field=models.ImageField(null=True, storage=transportation.storage.ContentAddressedStorage(), upload_to='clients', verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:02
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    # Полнотекстовый индекс есть только у SQLite (см. transportation/search.py)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE transportation_client_fts USING fts5("
+        "name, email, phone, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    Client = apps.get_model('transportation', 'Client')
+    rows = []
+    for client in Client.objects.only('name', 'email', 'phone').iterator(2000):
+        phone = client.phone or ''
+        rows.append((
+            client.pk,
+            (client.name or '').replace('ё', 'е').replace('Ё', 'Е'),
+            (client.email or '').replace('ё', 'е').replace('Ё', 'Е'),
+            f"{phone} {''.join(ch for ch in phone if ch.isdigit())}",
+        ))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO transportation_client_fts (rowid, name, email, phone) VALUES (%s, %s, %s, %s)', rows
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS transportation_client_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transportation', '0018_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transportation', '0019_client_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='Идентификатор')),
+                ('type', models.CharField(max_length=10, verbose_name='Формат')),
+                ('fingerprint', models.CharField(db_index=True, max_length=64, verbose_name='Отпечаток')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('digest', models.CharField(max_length=64, null=True, verbose_name='Хэш файла')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('reused', models.BooleanField(default=False, verbose_name='Готовый файл')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменена')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка',
+                'verbose_name_plural': 'Выгрузки',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ('pending', 'running'))), fields=('fingerprint',), name='export_job_in_flight_unique')],
+            },
+        ),
+    ]
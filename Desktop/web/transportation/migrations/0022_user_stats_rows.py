@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Coalesce
+
+
+def create_user_rows(apps, schema_editor):
+    # Строки статистики для всех пользователей, в том числе без записей:
+    # иначе первая запись пользователя создавала бы строку сама
+    ModelStats = apps.get_model('transportation', 'ModelStats')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    aggregates = dict(count=Count('id'), id_sum=Coalesce(Sum('id'), 0), max_id=Max('id'), min_id=Min('id'))
+    user_ids = list(User.objects.values_list('id', flat=True))
+    for name in ('Client', 'Flight', 'Ticket', 'Baggage', 'Airplane'):
+        model = apps.get_model('transportation', name)
+        label = f'transportation.{name.lower()}'
+        existing = set(ModelStats.objects.filter(model=label, user__isnull=False).values_list('user_id', flat=True))
+        missing = [user_id for user_id in user_ids if user_id not in existing]
+        if not missing:
+            continue
+        per_user = {
+            values.pop('user_id'): values
+            for values in model.objects.filter(user__isnull=False).values('user_id').annotate(**aggregates)
+        }
+        ModelStats.objects.bulk_create(
+            [ModelStats(model=label, user_id=user_id, **per_user.get(user_id, {})) for user_id in missing]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transportation', '0021_flight_user_departure_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_rows, migrations.RunPython.noop),
+    ]
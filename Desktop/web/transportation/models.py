@@ -1,11 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from transportation.storage import media_storage
+from transportation.versions import bump_data_version
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -13,8 +13,14 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    # Сохраняем только уже загруженный профиль и не трогаем его при создании
+    # и частичных сохранениях пользователя (например, last_login при входе)
+    if created or update_fields is not None:
+        return
+    profile = instance._state.fields_cache.get("profile")
+    if profile is not None:
+        profile.save()
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
@@ -27,12 +33,35 @@ class UserProfile(models.Model):
             self.otp_key = pyotp.random_base32()
         super().save(*args, **kwargs)
 
+class BatchedDeleteQuerySet(models.QuerySet):
+    def delete(self):
+        from transportation.stats import batched_removals
+        with batched_removals():
+            return super().delete()
+
+
+class StatsTrackedModel(models.Model):
+    """Модель со счетчиками ModelStats: удаление вместе с каскадом учитывается
+    одним UPDATE на модель и пользователя, а не на каждую удаленную запись"""
+    objects = BatchedDeleteQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def delete(self, *args, **kwargs):
+        from transportation.stats import batched_removals
+        with batched_removals():
+            return super().delete(*args, **kwargs)
+
+
 # Create your models here.
-class Client(models.Model):
+class Client(StatsTrackedModel):
     name = models.TextField("ФИО")
     email = models.TextField("Электронная почта")
     phone = models.TextField("Номер телефона")
-    picture = models.ImageField("Изображение", null=True, upload_to="clients")
+    picture = models.ImageField("Изображение", null=True, upload_to="clients", storage=media_storage, db_index=True)
+    # Имена уменьшенных копий изображения {вариант: путь} (см. transportation/images.py)
+    picture_variants = models.JSONField("Варианты изображения", default=dict, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь", null=True)
     
     class Meta:
@@ -43,7 +72,7 @@ class Client(models.Model):
         return self.name
     
         
-class Flight(models.Model):
+class Flight(StatsTrackedModel):
     flight_number = models.CharField("Номер рейса", max_length=10)
     departure = models.CharField("Пункт отправления", max_length=100)
     destination = models.CharField("Пункт назначения", max_length=100)
@@ -54,11 +83,19 @@ class Flight(models.Model):
     class Meta:
         verbose_name = "Рейс"
         verbose_name_plural = "Рейсы"
+        indexes = [
+            models.Index(fields=["departure_time", "id"], name="flight_departure_time_idx"),
+            # Поиск рейсов по маршруту и по пункту назначения с диапазоном времени
+            models.Index(fields=["departure", "destination", "departure_time"], name="flight_route_idx"),
+            models.Index(fields=["destination", "departure_time"], name="flight_destination_idx"),
+            # Поиск и курсорный список рейсов одного пользователя (запросы с user_id = X)
+            models.Index(fields=["user", "departure_time", "id"], name="flight_user_departure_idx"),
+        ]
 
     def __str__(self) -> str:
         return self.flight_number
     
-class Ticket(models.Model):
+class Ticket(StatsTrackedModel):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name="Клиент")
     flight = models.ForeignKey(Flight, on_delete=models.CASCADE, verbose_name="Рейс")
     seat_number = models.CharField("Номер места", max_length=5)
@@ -68,11 +105,14 @@ class Ticket(models.Model):
     class Meta:
         verbose_name = "Билет"
         verbose_name_plural = "Билеты"
+        indexes = [
+            models.Index(fields=["purchase_date", "id"], name="ticket_purchase_date_idx"),
+        ]
 
     def __str__(self) -> str:
         return self.seat_number
     
-class Baggage(models.Model):
+class Baggage(StatsTrackedModel):
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, verbose_name="Билет")
     weight = models.DecimalField("Вес (кг)", max_digits=5, decimal_places=2)
     baggage_type = models.CharField("Тип багажа", max_length=50)
@@ -85,12 +125,13 @@ class Baggage(models.Model):
     def __str__(self) -> str:
         return self.baggage_type
     
-class Airplane(models.Model):
+class Airplane(StatsTrackedModel):
     tail_number = models.CharField("Бортовой номер", max_length=10, unique=True)
     model = models.CharField("Модель", max_length=50)
     capacity = models.IntegerField("Вместимость")
     flight = models.ForeignKey(Flight, on_delete=models.CASCADE, verbose_name="Рейс")
-    picture = models.ImageField("Изображение", null=True, upload_to="airplane")
+    picture = models.ImageField("Изображение", null=True, upload_to="airplane", storage=media_storage, db_index=True)
+    picture_variants = models.JSONField("Варианты изображения", default=dict, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь", null=True) 
     class Meta:
         verbose_name = "Самолет"
@@ -98,4 +139,73 @@ class Airplane(models.Model):
         
     def __str__(self) -> str:
         return self.tail_number    
-    
\ No newline at end of file
+    
+
+# Версии данных для инвалидации кэшей (см. transportation/versions.py)
+VERSIONED_MODELS = (Client, Flight, Ticket, Baggage, Airplane)
+
+def bump_model_data_version(sender, **kwargs):
+    bump_data_version(sender)
+
+for versioned_model in VERSIONED_MODELS:
+    post_save.connect(bump_model_data_version, sender=versioned_model, dispatch_uid=f"data_version_save_{versioned_model.__name__}")
+    post_delete.connect(bump_model_data_version, sender=versioned_model, dispatch_uid=f"data_version_delete_{versioned_model.__name__}")
+
+
+class ModelStats(models.Model):
+    """Счетчики для /api/*/stats/, обновляются сигналами (см. transportation/stats.py)"""
+    model = models.CharField("Модель", max_length=100)
+    # Пустой пользователь означает статистику по всем записям
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь", null=True)
+    count = models.BigIntegerField("Количество", default=0)
+    id_sum = models.BigIntegerField("Сумма id", default=0)
+    min_id = models.BigIntegerField("Минимальный id", null=True)
+    max_id = models.BigIntegerField("Максимальный id", null=True)
+
+    class Meta:
+        verbose_name = "Статистика"
+        verbose_name_plural = "Статистика"
+        constraints = [
+            models.UniqueConstraint(fields=["model", "user"], name="model_stats_user_unique"),
+            models.UniqueConstraint(
+                fields=["model"], condition=models.Q(user__isnull=True), name="model_stats_global_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return self.model
+
+
+class ExportJob(models.Model):
+    """Фоновая выгрузка клиентов (см. transportation/jobs.py)"""
+    STATUSES = (
+        ("pending", "В очереди"),
+        ("running", "Выполняется"),
+        ("done", "Готово"),
+        ("failed", "Ошибка"),
+    )
+
+    id = models.CharField("Идентификатор", max_length=32, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь", null=True)
+    type = models.CharField("Формат", max_length=10)
+    fingerprint = models.CharField("Отпечаток", max_length=64, db_index=True)
+    status = models.CharField("Статус", max_length=10, choices=STATUSES, default="pending")
+    digest = models.CharField("Хэш файла", max_length=64, null=True)
+    error = models.TextField("Ошибка", blank=True, default="")
+    reused = models.BooleanField("Готовый файл", default=False)
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+    updated_at = models.DateTimeField("Изменена", auto_now=True)
+
+    class Meta:
+        verbose_name = "Выгрузка"
+        verbose_name_plural = "Выгрузки"
+        constraints = [
+            # Незавершенная задача с таким же отпечатком может быть только одна
+            models.UniqueConstraint(
+                fields=["fingerprint"], condition=models.Q(status__in=("pending", "running")),
+                name="export_job_in_flight_unique",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return self.id
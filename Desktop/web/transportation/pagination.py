@@ -0,0 +1,27 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная (keyset) пагинация, включается только по запросу клиента.
+
+    Без параметров ?cursor= и ?page_size= список отдается целиком, как раньше.
+    Курсор хранит только позицию в сортировке, поэтому следующая страница
+    строится от queryset, уже отфильтрованного UserFilteredViewSet.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('id',)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # Вьюсет может задать свой ключ сортировки; id в конце делает порядок стабильным
+        return getattr(view, 'cursor_ordering', self.ordering)
@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger("transportation.profiling")
+
+_current = ContextVar("request_profile", default=None)
+
+
+# Профиль запроса: общее время, время и число SQL-запросов, время сериализации.
+# ProfilingMiddleware отдает их в заголовке Server-Timing и пишет в журнал
+# медленные запросы вместе с самыми долгими SQL. Для потоковых ответов
+# (выгрузок) учитывается только время до начала отдачи тела.
+# Запросы к БД перехватывает обертка, которая ставится на каждое соединение:
+# под ASGI соединения живут в потоках sync_to_async, а профиль текущего
+# запроса передается туда через ContextVar.
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.queries = []
+        self.spans = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    @property
+    def db_time(self):
+        return sum(duration for duration, _ in self.queries)
+
+    def top_queries(self, limit):
+        """Самые долгие SQL с учетом повторов: [(суммарное время, число вызовов, sql)]"""
+        grouped = defaultdict(lambda: [0.0, 0])
+        for duration, sql in self.queries:
+            grouped[sql][0] += duration
+            grouped[sql][1] += 1
+        ranked = sorted(grouped.items(), key=lambda item: item[1][0], reverse=True)
+        return [(duration, count, sql) for sql, (duration, count) in ranked[:limit]]
+
+    def server_timing(self):
+        metrics = [
+            f"total;dur={self.total * 1000:.2f}",
+            f'db;dur={self.db_time * 1000:.2f};desc="{len(self.queries)} queries"',
+        ]
+        for name, duration in self.spans.items():
+            metrics.append(f"{name};dur={duration * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    # Объект соединения переживает переподключения, обертку ставим один раз
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+connection_created.connect(_install_wrapper, dispatch_uid="profiling_execute_wrapper")
+# Соединения, открытые до импорта модуля (например, при создании тестовой базы)
+for existing in connections.all(initialized_only=True):
+    _install_wrapper(None, existing)
+
+
+@contextmanager
+def span(name):
+    """Добавляет время блока к метрике name текущего запроса (вне запроса ничего не делает)"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.spans[name] += time.perf_counter() - started
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        profile.finish()
+
+        if getattr(settings, "PROFILING_SERVER_TIMING", False):
+            response["Server-Timing"] = profile.server_timing()
+
+        threshold = getattr(settings, "PROFILING_SLOW_REQUEST_MS", None)
+        if threshold is not None and profile.total * 1000 >= threshold:
+            self.log_slow_request(request, response, profile)
+        return response
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после представления: это время тоже относим к сериализации
+        profile = _current.get()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def finish_render(rendered):
+                profile.spans["serialize"] += time.perf_counter() - started
+
+            response.add_post_render_callback(finish_render)
+        return response
+
+    def log_slow_request(self, request, response, profile):
+        lines = [
+            f"Медленный запрос {request.method} {request.get_full_path()} -> {response.status_code}: "
+            f"{profile.total * 1000:.1f} мс, БД {profile.db_time * 1000:.1f} мс, "
+            f"запросов {len(profile.queries)}, сериализация {profile.spans.get('serialize', 0) * 1000:.1f} мс"
+        ]
+        for duration, count, sql in profile.top_queries(getattr(settings, "PROFILING_SLOW_TOP_QUERIES", 5)):
+            lines.append(f"  {duration * 1000:8.2f} мс x{count}: {sql}")
+        logger.warning("\n".join(lines))
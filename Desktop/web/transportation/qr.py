@@ -0,0 +1,40 @@
+import hashlib
+from io import BytesIO
+
+import pyotp
+import qrcode
+from django.core.cache import cache
+
+from transportation.metrics import count_cache
+
+# QR-код OTP кэшируется по хэшу provisioning URI: URI содержит otp_key и имя
+# пользователя, поэтому при смене ключа меняется и ключ кэша, и ETag,
+# а старая картинка просто истекает.
+
+QR_CACHE_TIMEOUT = 24 * 60 * 60
+ISSUER_NAME = "Travel"
+
+
+def otp_uri(user):
+    return pyotp.TOTP(user.profile.otp_key).provisioning_uri(name=user.username, issuer_name=ISSUER_NAME)
+
+
+def qr_digest(user):
+    return hashlib.sha256(f"{user.pk}:{otp_uri(user)}".encode()).hexdigest()
+
+
+def render_qr_png(uri):
+    buffer = BytesIO()
+    qrcode.make(uri).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def get_qr_png(user, digest=None):
+    digest = digest or qr_digest(user)
+    key = f"otp_qr_{user.pk}_{digest}"
+    png = cache.get(key)
+    count_cache("otp_qr", png is not None)
+    if png is None:
+        png = render_qr_png(otp_uri(user))
+        cache.set(key, png, timeout=QR_CACHE_TIMEOUT)
+    return png
@@ -0,0 +1,156 @@
+import re
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+from transportation.models import Client
+
+# Полнотекстовый поиск клиентов по ФИО, email и телефону (SQLite FTS5).
+# Таблица transportation_client_fts хранит нормализованную копию полей с
+# rowid = id клиента; сигналы и after_bulk_* (transportation/bulk.py) обновляют
+# ее вместе с записью. Каждое слово запроса ищется по префиксу, результаты
+# ранжируются bm25: совпадение в ФИО весит больше, чем в email и телефоне.
+# На других СУБД поиск сводится к icontains по тем же полям.
+# search_flights - фильтры поиска рейсов (/api/flights/search/) по обычным индексам.
+
+FTS_TABLE = "transportation_client_fts"
+# Веса bm25 для столбцов name, email, phone
+WEIGHTS = (10.0, 4.0, 2.0)
+INDEXED_FIELDS = {"name", "email", "phone"}
+BATCH_SIZE = 2000
+# OR REPLACE заменяет прежнюю строку с тем же rowid одним запросом
+INSERT_SQL = f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, email, phone) VALUES (%s, %s, %s, %s)"
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(value):
+    # Токенизатор unicode61 приводит регистр, но не считает "ё" и "е" одной буквой
+    return (value or "").replace("ё", "е").replace("Ё", "Е")
+
+
+def index_values(pk, name, email, phone):
+    """(rowid, name, email, phone); к телефону добавляются одни цифры: +7 (912) 345 -> 7912345"""
+    phone = phone or ""
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    return pk, normalize(name), normalize(email), f"{phone} {digits}"
+
+
+def index_row(client):
+    return index_values(client.pk, client.name, client.email, client.phone)
+
+
+def query_words(query):
+    return _WORD.findall(normalize(query).lower())
+
+
+def match_expression(words):
+    # Слова в кавычках не разбираются как операторы FTS5, * включает поиск по префиксу
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _write_connection():
+    connection = connections[router.db_for_write(Client)]
+    return connection if connection.vendor == "sqlite" else None
+
+
+def index_clients(clients):
+    connection = _write_connection()
+    if connection is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(INSERT_SQL, [index_row(client) for client in clients])
+
+
+def remove_clients(ids):
+    connection = _write_connection()
+    if connection is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in ids])
+
+
+def rebuild_index():
+    """Полностью перестраивает индекс, возвращает число проиндексированных клиентов"""
+    connection = _write_connection()
+    if connection is None:
+        return 0
+    count = 0
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        batch = []
+        # Кортежи вместо экземпляров модели: для строки индекса нужны только значения
+        values = Client.objects.using(connection.alias).values_list("id", "name", "email", "phone")
+        for row in values.iterator(BATCH_SIZE):
+            batch.append(index_values(*row))
+            if len(batch) == BATCH_SIZE:
+                cursor.executemany(INSERT_SQL, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(INSERT_SQL, batch)
+            count += len(batch)
+        # Сливает сегменты индекса в один
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def search_client_ids(query, user_id=None, limit=20):
+    """id клиентов в порядке релевантности; user_id ограничивает поиск записями пользователя"""
+    words = query_words(query)
+    if not words:
+        return []
+
+    alias = router.db_for_read(Client)
+    if connections[alias].vendor != "sqlite":
+        queryset = Client.objects.using(alias)
+        for word in words:
+            queryset = queryset.filter(Q(name__icontains=word) | Q(email__icontains=word) | Q(phone__icontains=word))
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        return list(queryset.order_by("id").values_list("id", flat=True)[:limit])
+
+    client_table = Client._meta.db_table
+    sql = (
+        f"SELECT {client_table}.id FROM {FTS_TABLE} "
+        f"JOIN {client_table} ON {client_table}.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s"
+    )
+    params = [match_expression(words)]
+    if user_id is not None:
+        sql += f" AND {client_table}.user_id = %s"
+        params.append(user_id)
+    sql += f" ORDER BY bm25({FTS_TABLE}, {', '.join(map(str, WEIGHTS))}), {client_table}.id LIMIT %s"
+    params.append(limit)
+    with connections[alias].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not INDEXED_FIELDS & set(update_fields):
+        return
+    index_clients([instance])
+
+
+def _on_delete(sender, instance, **kwargs):
+    remove_clients([instance.pk])
+
+
+post_save.connect(_on_save, sender=Client, dispatch_uid="search_client_save")
+post_delete.connect(_on_delete, sender=Client, dispatch_uid="search_client_delete")
+
+
+def search_flights(queryset, origin=None, destination=None, departure_after=None, departure_before=None, **kwargs):
+    # Условия совпадают с индексами flight_route_idx / flight_destination_idx,
+    # запросы обычного пользователя по интервалу времени - с flight_user_departure_idx
+    if origin:
+        queryset = queryset.filter(departure=origin)
+    if destination:
+        queryset = queryset.filter(destination=destination)
+    if departure_after:
+        queryset = queryset.filter(departure_time__gte=departure_after)
+    if departure_before:
+        queryset = queryset.filter(departure_time__lte=departure_before)
+    return queryset.order_by("departure_time", "id")
@@ -0,0 +1,122 @@
+import base64
+import re
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_init, post_save
+
+from transportation.metrics import count_cache
+from transportation.models import Airplane, Ticket
+
+# Карта занятости мест рейса: бит i означает, что место с индексом i занято.
+# Место "12C" -> ряд 12, буква C -> индекс (12 - 1) * 6 + 2.
+# Карта хранится в кэше; сигналы билетов и самолетов сбрасывают ее,
+# а пересборка читает только номера мест билетов этого рейса.
+
+SEAT_LETTERS = "ABCDEF"
+SEAT_MAP_TIMEOUT = 60 * 60
+
+_SEAT_RE = re.compile(r"^\s*(\d+)\s*([A-Za-z])\s*$")
+
+
+def seat_index(seat_number):
+    match = _SEAT_RE.match(seat_number or "")
+    if match is None:
+        return None
+    row, letter = int(match.group(1)), match.group(2).upper()
+    if row < 1 or letter not in SEAT_LETTERS:
+        return None
+    return (row - 1) * len(SEAT_LETTERS) + SEAT_LETTERS.index(letter)
+
+
+def seat_label(index):
+    row, column = divmod(index, len(SEAT_LETTERS))
+    return f"{row + 1}{SEAT_LETTERS[column]}"
+
+
+class SeatMap:
+    def __init__(self, capacity, bits):
+        self.capacity = capacity
+        self.bits = bits
+
+    @classmethod
+    def build(cls, capacity, seat_numbers):
+        bits = bytearray((capacity + 7) // 8)
+        for seat_number in seat_numbers:
+            index = seat_index(seat_number)
+            if index is not None and index < capacity:
+                bits[index >> 3] |= 1 << (index & 7)
+        return cls(capacity, bytes(bits))
+
+    def is_occupied(self, index):
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def is_available(self, seat_number):
+        index = seat_index(seat_number)
+        if index is None or index >= self.capacity:
+            return False
+        return not self.is_occupied(index)
+
+    @property
+    def occupied_count(self):
+        return sum(bin(byte).count("1") for byte in self.bits)
+
+    def layout(self):
+        """Ряды вида "X..X.." (X - занято), для отрисовки схемы салона"""
+        width = len(SEAT_LETTERS)
+        marks = "".join("X" if self.is_occupied(i) else "." for i in range(self.capacity))
+        return [marks[start:start + width] for start in range(0, self.capacity, width)]
+
+    def as_dict(self):
+        return {
+            "capacity": self.capacity,
+            "letters": SEAT_LETTERS,
+            "occupied": self.occupied_count,
+            "free": self.capacity - self.occupied_count,
+            "bitmap": base64.b64encode(self.bits).decode(),
+            "layout": self.layout(),
+        }
+
+
+def _cache_key(flight_id):
+    return f"seat_map_{flight_id}"
+
+
+def get_seat_map(flight_id):
+    cached = cache.get(_cache_key(flight_id))
+    count_cache("seat_map", cached is not None)
+    if cached is not None:
+        return SeatMap(*cached)
+
+    capacity = Airplane.objects.filter(flight_id=flight_id).aggregate(capacity=Max("capacity"))["capacity"] or 0
+    seat_numbers = Ticket.objects.filter(flight_id=flight_id).values_list("seat_number", flat=True)
+    seat_map = SeatMap.build(capacity, seat_numbers.iterator())
+    cache.set(_cache_key(flight_id), (seat_map.capacity, seat_map.bits), timeout=SEAT_MAP_TIMEOUT)
+    return seat_map
+
+
+def invalidate_seat_map(*flight_ids):
+    keys = [_cache_key(flight_id) for flight_id in set(flight_ids) if flight_id is not None]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    if transaction.get_connection().in_atomic_block:
+        # Карта, пересобранная до COMMIT по старым билетам, удаляется еще раз после него
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _remember_flight(sender, instance, **kwargs):
+    # Отложенное поле не читаем: иначе .only()/.defer() давали бы запрос на каждую строку
+    instance._seat_flight_id = instance.__dict__.get("flight_id")
+
+
+def _on_change(sender, instance, **kwargs):
+    invalidate_seat_map(instance.flight_id, getattr(instance, "_seat_flight_id", None))
+    instance._seat_flight_id = instance.flight_id
+
+
+for seat_model in (Ticket, Airplane):
+    post_init.connect(_remember_flight, sender=seat_model, dispatch_uid=f"seats_init_{seat_model.__name__}")
+    post_save.connect(_on_change, sender=seat_model, dispatch_uid=f"seats_save_{seat_model.__name__}")
+    post_delete.connect(_on_change, sender=seat_model, dispatch_uid=f"seats_delete_{seat_model.__name__}")
@@ -1,7 +1,183 @@
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from transportation.models import Client, Ticket, Flight, Baggage, Airplane
+from transportation.bulk import after_bulk_create, after_bulk_update
+from transportation.profiling import span
+from transportation.storage import media_storage
 
-class FlightSerializer(serializers.ModelSerializer):
+BULK_MAX_ITEMS = 1000
+
+
+class TimedDataMixin:
+    """Время построения .data попадает в метрику serialize заголовка Server-Timing"""
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+def parse_field_paths(value):
+    """"id,flight_detail.flight_number" -> {"id": {}, "flight_detail": {"flight_number": {}}}"""
+    tree = {}
+    for path in value.split(","):
+        node = tree
+        for name in path.strip().split("."):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def sparse_fields_kwargs(request):
+    """Аргументы fields/expand сериализатора из ?fields= и ?expand= запроса на чтение"""
+    if request is None or request.method not in SAFE_METHODS:
+        # Запись всегда принимает и возвращает полный набор полей
+        return {}
+    return {
+        name: parse_field_paths(request.query_params[name])
+        for name in ("fields", "expand")
+        if name in request.query_params
+    }
+
+
+class DynamicFieldsMixin:
+    """Поля по запросу: ненужные удаляются из дерева сериализатора до построения queryset.
+
+    fields - дерево путей {имя: поддерево}: остаются только перечисленные поля,
+    вложенные сериализаторы обрезаются по поддереву. expand - вложенные объекты,
+    которые нужно развернуть: остальные вложенные сериализаторы заменяются на
+    id связанной записи (по <fk>_id, без запроса). Без параметров сериализатор
+    отдает все поля, как раньше.
+    """
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields or expand is not None:
+            self.prune_fields(fields, expand)
+
+    def prune_fields(self, fields=None, expand=None):
+        for name, field in list(self.fields.items()):
+            if fields and name not in fields:
+                self.fields.pop(name)
+                continue
+
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, DynamicFieldsMixin):
+                continue
+
+            sub_fields = fields.get(name) if fields else None
+            # Поле, у которого запрошены вложенные поля, разворачивается и без expand
+            if expand is not None and name not in expand and not sub_fields:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, many=many, source=field.source)
+                continue
+            nested.prune_fields(sub_fields, None if expand is None else expand.get(name, {}))
+
+
+class PictureVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии изображения {вариант: URL}; пусто, пока они не построены"""
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for variant, name in (value or {}).items():
+            url = media_storage.url(name)
+            urls[variant] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+
+class BatchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """При сохранении списка берет объекты из словаря, загруженного одним запросом"""
+    def to_internal_value(self, data):
+        batch = self.context.get('related_batch', {}).get(self.field_name)
+        if batch is None or isinstance(data, bool):
+            return super().to_internal_value(data)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except Exception:
+            return super().to_internal_value(data)
+        if pk not in batch:
+            self.fail('does_not_exist', pk_value=data)
+        return batch[pk]
+
+
+class BulkListSerializer(TimedListSerializer):
+    """Создание и частичное обновление списка объектов через bulk_create/bulk_update"""
+    def load_related(self, data):
+        # Все внешние ключи из запроса проверяются одним запросом на поле
+        batch = {}
+        for name, field in self.child.fields.items():
+            if not isinstance(field, BatchedPrimaryKeyRelatedField) or field.read_only:
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            ids = set()
+            for item in data:
+                if isinstance(item, dict) and item.get(name) is not None:
+                    try:
+                        ids.add(pk_field.to_python(item[name]))
+                    except Exception:
+                        pass
+            batch[name] = field.get_queryset().in_bulk(ids)
+        self._context['related_batch'] = batch
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.load_related(data)
+            if self.instance is not None:
+                self._instances_by_id = {obj.pk: obj for obj in self.instance}
+                self._ordered_instances = []
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return super().run_child_validation(data)
+
+        try:
+            instance = self._instances_by_id.get(int(data['id']))
+        except (KeyError, TypeError, ValueError):
+            instance = None
+        if instance is None:
+            raise serializers.ValidationError({'id': 'Объект не найден'})
+        self.child.instance = instance
+        self.child.initial_data = data
+        try:
+            validated = super().run_child_validation(data)
+        finally:
+            self.child.instance = None
+        self._ordered_instances.append(instance)
+        return validated
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        user = self.context['request'].user if 'request' in self.context else None
+        objects = []
+        for attrs in validated_data:
+            # Владелец - автор запроса, как при одиночном создании
+            attrs.pop('user', None)
+            objects.append(model(**attrs, user=user))
+        with transaction.atomic():
+            model.objects.bulk_create(objects, batch_size=500)
+            after_bulk_create(model, objects)
+        return objects
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        for instance, attrs in zip(self._ordered_instances, validated_data):
+            # Владельца записи массовое обновление не меняет
+            attrs.pop('user', None)
+            for name, value in attrs.items():
+                setattr(instance, name, value)
+                fields.add(name)
+        if fields:
+            with transaction.atomic():
+                model.objects.bulk_update(self._ordered_instances, sorted(fields), batch_size=500)
+                after_bulk_update(model, self._ordered_instances)
+        return self._ordered_instances
+
+class FlightSerializer(DynamicFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     airplane = serializers.StringRelatedField()
     def create(self, validated_data):
         if 'request' in self.context:
@@ -10,22 +186,25 @@ class FlightSerializer(serializers.ModelSerializer):
     class Meta:
         model = Flight
         fields = "__all__"
+        list_serializer_class = TimedListSerializer
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(DynamicFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     tickets = serializers.PrimaryKeyRelatedField(many=True, read_only=True, source='ticket_set')
     baggage = serializers.PrimaryKeyRelatedField(many=True, read_only=True, source='ticket__baggage_set')
+    picture_variants = PictureVariantsField()
     def create(self, validated_data): 
         if 'request' in self.context:
             validated_data['user'] = self.context['request'].user  
         return super().create(validated_data)
     class Meta:
         model = Client
-        fields = ['id', 'name', 'email', 'phone', 'tickets', 'baggage', 'picture', "user"]
+        fields = ['id', 'name', 'email', 'phone', 'tickets', 'baggage', 'picture', 'picture_variants', "user"]
+        list_serializer_class = TimedListSerializer
 
 
-class TicketSerializer(serializers.ModelSerializer):
-    flight = serializers.PrimaryKeyRelatedField(queryset=Flight.objects.all(), write_only=True)
-    client = serializers.PrimaryKeyRelatedField(queryset=Client.objects.all(), write_only=True)
+class TicketSerializer(DynamicFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
+    flight = BatchedPrimaryKeyRelatedField(queryset=Flight.objects.all(), write_only=True)
+    client = BatchedPrimaryKeyRelatedField(queryset=Client.objects.all(), write_only=True)
     flight_detail = FlightSerializer(source='flight', read_only=True)
     client_detail = ClientSerializer(source='client', read_only=True)
     def create(self, validated_data):
@@ -36,9 +215,10 @@ class TicketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = ['id', 'flight', 'client', 'seat_number', 'purchase_date', 'flight_detail', 'client_detail', "user"]
+        list_serializer_class = BulkListSerializer
 
-class BaggageSerializer(serializers.ModelSerializer):
-    ticket = serializers.PrimaryKeyRelatedField(queryset=Ticket.objects.all(), write_only=True)
+class BaggageSerializer(DynamicFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
+    ticket = BatchedPrimaryKeyRelatedField(queryset=Ticket.objects.all(), write_only=True)
     ticket_detail = TicketSerializer(source='ticket', read_only=True)
     def create(self, validated_data):
         if 'request' in self.context:
@@ -47,10 +227,12 @@ class BaggageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Baggage
         fields = ['id', 'ticket', 'weight', 'baggage_type', 'ticket_detail', "user"]
+        list_serializer_class = BulkListSerializer
         
 
-class AirplaneSerializer(serializers.ModelSerializer):
+class AirplaneSerializer(DynamicFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     flight = serializers.PrimaryKeyRelatedField(queryset=Flight.objects.all())
+    picture_variants = PictureVariantsField()
     def create(self, validated_data):
         if 'request' in self.context:
             validated_data['user'] = self.context['request'].user
@@ -58,9 +240,43 @@ class AirplaneSerializer(serializers.ModelSerializer):
     class Meta:
         model = Airplane
         fields = "__all__"
+        list_serializer_class = TimedListSerializer
 
 
 class UserLoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
-    
+
+
+class FlightSearchSerializer(serializers.Serializer):
+    origin = serializers.CharField(required=False)
+    destination = serializers.CharField(required=False)
+    departure_after = serializers.DateTimeField(required=False)
+    departure_before = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(required=False, default=100, min_value=1, max_value=1000)
+
+    def validate(self, attrs):
+        after, before = attrs.get('departure_after'), attrs.get('departure_before')
+        if after and before and after > before:
+            raise serializers.ValidationError("departure_after должен быть не позже departure_before")
+        return attrs
+
+
+class ClientSearchSerializer(serializers.Serializer):
+    q = serializers.CharField()
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+
+class DuplicatesQuerySerializer(serializers.Serializer):
+    threshold = serializers.FloatField(required=False, default=0.6, min_value=0.1, max_value=1.0)
+    limit = serializers.IntegerField(required=False, default=50, min_value=1, max_value=500)
+
+
+class ClientMergeSerializer(serializers.Serializer):
+    target = serializers.IntegerField()
+    sources = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=100)
+
+    def validate(self, attrs):
+        if attrs['target'] in attrs['sources']:
+            raise serializers.ValidationError("target не может входить в sources")
+        return attrs
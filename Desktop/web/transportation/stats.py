@@ -0,0 +1,225 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Max, Min, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+
+from transportation.models import Airplane, Baggage, Client, Flight, ModelStats, Ticket
+
+# Статистика по id (количество, среднее, максимум, минимум) хранится в
+# таблице ModelStats отдельно для каждого пользователя и по всем записям.
+# Сигналы меняют счетчики одним UPDATE с F-выражениями, поэтому
+# параллельные записи не теряют обновления. Строки создаются вместе с
+# пользователем (и миграцией 0022 для уже существующих), поэтому первая запись
+# пользователя обходится тем же одним UPDATE, что и последующие.
+
+STATS_MODELS = (Client, Flight, Ticket, Baggage, Airplane)
+
+# Значение scope для строки "по всем записям"
+GLOBAL = None
+
+# user_id не был загружен (.only()/.defer()): владельца узнаем только при необходимости
+_UNLOADED = object()
+
+# Удаления внутри batched_removals(): {(модель, scope): [id]}
+_pending_removals = ContextVar("stats_pending_removals", default=None)
+
+
+def _row(model, scope):
+    return ModelStats.objects.filter(model=model._meta.label_lower, user_id=scope)
+
+
+def create_user_rows(user_ids):
+    """Пустые строки статистики по всем моделям для новых пользователей"""
+    ModelStats.objects.bulk_create(
+        [ModelStats(model=model._meta.label_lower, user_id=user_id) for user_id in user_ids for model in STATS_MODELS],
+        ignore_conflicts=True,
+    )
+
+
+def _ensure_row(model, scope):
+    # Запасной путь для строк, удаленных вручную или вставленных в обход create_user_rows
+    if _row(model, scope).exists():
+        return
+    try:
+        with transaction.atomic():
+            ModelStats.objects.create(model=model._meta.label_lower, user_id=scope)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        pass
+
+
+def _edge_id(model, scope, descending):
+    """Подзапрос крайнего id в области scope (идет по индексу первичного ключа)"""
+    queryset = model.objects.all()
+    if scope is not GLOBAL:
+        queryset = queryset.filter(user_id=OuterRef("user_id"))
+    return Subquery(queryset.order_by("-pk" if descending else "pk").values("pk")[:1])
+
+
+def record_added(model, pk, scopes):
+    changes = dict(
+        count=F("count") + 1,
+        id_sum=F("id_sum") + pk,
+        max_id=Greatest(Coalesce(F("max_id"), pk), pk),
+        min_id=Least(Coalesce(F("min_id"), pk), pk),
+    )
+    for scope in scopes:
+        if not _row(model, scope).update(**changes):
+            _ensure_row(model, scope)
+            _row(model, scope).update(**changes)
+
+
+def record_many_added(model, objects):
+    """Учет объектов, созданных через bulk_create: один UPDATE на каждую область"""
+    groups = {}
+    for obj in objects:
+        for scope in _scopes(obj.user_id):
+            groups.setdefault(scope, []).append(obj.pk)
+
+    for scope, pks in groups.items():
+        low, high = min(pks), max(pks)
+        changes = dict(
+            count=F("count") + len(pks),
+            id_sum=F("id_sum") + sum(pks),
+            max_id=Greatest(Coalesce(F("max_id"), high), high),
+            min_id=Least(Coalesce(F("min_id"), low), low),
+        )
+        if not _row(model, scope).update(**changes):
+            _ensure_row(model, scope)
+            _row(model, scope).update(**changes)
+
+
+def record_removed(model, pk, scopes):
+    for scope in scopes:
+        record_many_removed(model, scope, [pk])
+
+
+def record_many_removed(model, scope, pks):
+    """Учет удаленных записей одним UPDATE; вызывается после удаления строк"""
+    low, high = min(pks), max(pks)
+    # Крайний id пересчитывается, только если он мог оказаться среди удаленных
+    _row(model, scope).update(
+        count=F("count") - len(pks),
+        id_sum=F("id_sum") - sum(pks),
+        max_id=Case(When(max_id__range=(low, high), then=_edge_id(model, scope, True)), default=F("max_id")),
+        min_id=Case(When(min_id__range=(low, high), then=_edge_id(model, scope, False)), default=F("min_id")),
+    )
+
+
+@contextmanager
+def batched_removals():
+    """Удаления в блоке (вместе с каскадом) учитываются по одному UPDATE на модель и область"""
+    if _pending_removals.get() is not None:
+        # Учтет внешний блок
+        yield
+        return
+    pending = {}
+    token = _pending_removals.set(pending)
+    try:
+        # Как у Collector.delete: без точки сохранения, ошибка откатывает внешнюю транзакцию
+        with transaction.atomic(savepoint=False):
+            yield
+            for (model, scope), pks in pending.items():
+                record_many_removed(model, scope, pks)
+    finally:
+        _pending_removals.reset(token)
+
+
+def _scopes(user_id):
+    return [GLOBAL] if user_id is None else [GLOBAL, user_id]
+
+
+def _stats_data(row):
+    if row is None or row.count == 0:
+        return {"count": 0, "avg": None, "max": None, "min": None}
+    return {
+        "count": row.count,
+        "avg": row.id_sum / row.count,
+        "max": row.max_id,
+        "min": row.min_id,
+    }
+
+
+def get_model_stats(model, user):
+    """Статистика в формате aggregate(count, avg, max, min) одним чтением"""
+    return _stats_data(_row(model, GLOBAL if user.is_superuser else user.id).first())
+
+
+async def aget_model_stats(model, user):
+    """То же для асинхронных представлений"""
+    return _stats_data(await _row(model, GLOBAL if user.is_superuser else user.id).afirst())
+
+
+def rebuild_stats(models=STATS_MODELS):
+    """Полный пересчет статистики, нужен после bulk-операций в обход сигналов"""
+    aggregates = dict(count=Count("id"), id_sum=Coalesce(Sum("id"), 0), max_id=Max("id"), min_id=Min("id"))
+    with transaction.atomic():
+        for model in models:
+            label = model._meta.label_lower
+            ModelStats.objects.filter(model=label).delete()
+
+            rows = [ModelStats(model=label, user=None, **model.objects.aggregate(**aggregates))]
+            per_user = {
+                values.pop("user_id"): values
+                for values in model.objects.filter(user__isnull=False).values("user_id").annotate(**aggregates)
+            }
+            # Пользователи без записей тоже получают строку, чтобы первая запись не создавала ее
+            for user_id in User.objects.values_list("id", flat=True):
+                rows.append(ModelStats(model=label, user_id=user_id, **per_user.get(user_id, {})))
+            ModelStats.objects.bulk_create(rows)
+
+
+def _remember_user(sender, instance, **kwargs):
+    # Отложенное поле не читаем: иначе .only()/.defer() давали бы запрос на каждую строку
+    instance._stats_user_id = instance.__dict__.get("user_id", _UNLOADED)
+
+
+def _load_previous_user(sender, instance, raw=False, **kwargs):
+    # Владельца назначили объекту, загруженному без user_id: прежнее значение берем из базы
+    if raw or instance.pk is None or "user_id" not in instance.__dict__:
+        return
+    if getattr(instance, "_stats_user_id", None) is _UNLOADED:
+        instance._stats_user_id = sender.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first()
+
+
+def _on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = instance.__dict__.get("user_id", _UNLOADED)
+    previous = getattr(instance, "_stats_user_id", _UNLOADED)
+    if created:
+        record_added(sender, instance.pk, _scopes(instance.user_id))
+    elif user_id is not _UNLOADED and previous is not _UNLOADED and previous != user_id:
+        # Запись перешла к другому пользователю, общая строка не меняется
+        if previous is not None:
+            record_removed(sender, instance.pk, [previous])
+        if user_id is not None:
+            record_added(sender, instance.pk, [user_id])
+    instance._stats_user_id = instance.__dict__.get("user_id", _UNLOADED)
+
+
+def _on_user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        create_user_rows([instance.pk])
+
+
+def _on_delete(sender, instance, **kwargs):
+    pending = _pending_removals.get()
+    if pending is None:
+        record_removed(sender, instance.pk, _scopes(instance.user_id))
+        return
+    for scope in _scopes(instance.user_id):
+        pending.setdefault((sender, scope), []).append(instance.pk)
+
+
+post_save.connect(_on_user_created, sender=User, dispatch_uid="stats_user_created")
+
+for stats_model in STATS_MODELS:
+    post_init.connect(_remember_user, sender=stats_model, dispatch_uid=f"stats_init_{stats_model.__name__}")
+    pre_save.connect(_load_previous_user, sender=stats_model, dispatch_uid=f"stats_pre_save_{stats_model.__name__}")
+    post_save.connect(_on_save, sender=stats_model, dispatch_uid=f"stats_save_{stats_model.__name__}")
+    post_delete.connect(_on_delete, sender=stats_model, dispatch_uid=f"stats_delete_{stats_model.__name__}")
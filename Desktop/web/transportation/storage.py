@@ -0,0 +1,118 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+import time
+import threading
+from contextlib import contextmanager
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только в пределах процесса
+    fcntl = None
+
+# Хранилище по содержимому: файл сохраняется как <upload_to>/<xx>/<sha256><.ext>,
+# поэтому одинаковые загрузки занимают место один раз. Удалять файл можно,
+# только когда на него не ссылается ни одна запись (см. transportation/images.py).
+# Проверка "файл уже есть" при загрузке и удаление файла выполняются под общей
+# блокировкой имени, а переиспользованный файл получает свежий mtime.
+
+CHUNK_SIZE = 1024 * 1024
+LOCK_DIR = ".locks"
+
+_local_lock = threading.Lock()
+
+
+def file_digest(fp):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_name(directory, digest, original_name):
+    extension = os.path.splitext(original_name)[1].lower()
+    return posixpath.join(directory, digest[:2], f"{digest}{extension}")
+
+
+def is_content_name(name):
+    base = posixpath.splitext(posixpath.basename(name))[0]
+    parent = posixpath.basename(posixpath.dirname(name))
+    return len(base) == 64 and parent == base[:2] and all(c in "0123456789abcdef" for c in base)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым, суффиксы для уникальности не нужны
+        return name
+
+    def _save(self, name, content):
+        content.seek(0)
+        digest = file_digest(content)
+        name = content_name(posixpath.dirname(name), digest, name)
+        full_path = self.path(name)
+        with self.content_lock(name):
+            if os.path.exists(full_path):
+                # Такое содержимое уже хранится. Запись со ссылкой еще не закоммичена,
+                # поэтому обновляем mtime: release_picture не удаляет свежие файлы
+                os.utime(full_path)
+                return name
+
+            directory = os.path.dirname(full_path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".part")
+            try:
+                content.seek(0)
+                with os.fdopen(fd, "wb") as out:
+                    for chunk in content.chunks():
+                        out.write(chunk)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp, self.file_permissions_mode)
+                try:
+                    # link не перезаписывает файл: при параллельной загрузке того же содержимого побеждает первый
+                    os.link(tmp, full_path)
+                except FileExistsError:
+                    pass
+            finally:
+                os.unlink(tmp)
+        return name
+
+    @contextmanager
+    def content_lock(self, name):
+        """Блокировка имени, общая для всех процессов: на каждый из 256 блокировочных файлов приходится часть имен"""
+        stripe = hashlib.sha256(name.encode()).hexdigest()[:2]
+        path = self.path(posixpath.join(LOCK_DIR, f"{stripe}.lock"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as lock_file:
+            if fcntl is None:
+                with _local_lock:
+                    yield
+                return
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def is_settled(self, name, grace_period):
+        """Файл не менялся дольше grace_period секунд"""
+        return time.time() - os.path.getmtime(self.path(name)) >= grace_period
+
+    def adopt(self, name):
+        """Переносит уже лежащий в хранилище файл под имя по содержимому и возвращает новое имя"""
+        with self.open(name, "rb") as fp:
+            digest = file_digest(fp)
+        new_name = content_name(posixpath.dirname(name), digest, name)
+        if new_name != name and not self.exists(new_name):
+            target = self.path(new_name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            file_move_safe(self.path(name), target)
+        return new_name
+
+
+media_storage = ContentAddressedStorage()
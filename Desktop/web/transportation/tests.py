@@ -4,6 +4,9 @@ from model_bakery import baker
 from django.urls import reverse
 import json
 from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from transportation.models import  Client, Flight, Ticket, Baggage, Airplane
 
 # Create your tests here.
@@ -329,4 +332,1670 @@ class AirplanesViewSetTestCase(TestCase):
         self.assertEqual(response.status_code, 204)
         
         airplanes = Airplane.objects.all()
-        self.assertEqual(len(airplanes), 0)    
\ No newline at end of file
+        self.assertEqual(len(airplanes), 0)
+
+class EagerLoadingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.user)
+
+    def count_list_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return len(queries)
+
+    def test_baggage_list_constant_queries(self):
+        baker.make(Baggage, _quantity=2)
+        small = self.count_list_queries('/api/baggage/')
+        baker.make(Baggage, _quantity=10)
+        self.assertEqual(small, self.count_list_queries('/api/baggage/'))
+
+    def test_ticket_list_constant_queries(self):
+        baker.make(Ticket, _quantity=2)
+        small = self.count_list_queries('/api/tickets/')
+        baker.make(Ticket, _quantity=10)
+        self.assertEqual(small, self.count_list_queries('/api/tickets/'))
+
+    def test_client_list_constant_queries(self):
+        baker.make(Ticket, _quantity=2)
+        small = self.count_list_queries('/api/clients/')
+        baker.make(Ticket, _quantity=10)
+        self.assertEqual(small, self.count_list_queries('/api/clients/'))
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def collect_pages(self, url):
+        ids = []
+        while url:
+            r = self.client.get(url)
+            self.assertEqual(r.status_code, 200)
+            data = r.json()
+            ids += [item['id'] for item in data['results']]
+            url = data['next']
+        return ids
+
+    def test_list_without_cursor_is_not_paginated(self):
+        baker.make(Flight, user=self.user, _quantity=3)
+        data = self.client.get('/api/flights/').json()
+        self.assertEqual(len(data), 3)
+
+    def test_flights_pages_follow_departure_time(self):
+        flights = baker.make(Flight, user=self.user, _quantity=7)
+        ids = self.collect_pages('/api/flights/?page_size=3')
+        expected = [f.id for f in sorted(flights, key=lambda f: (f.departure_time, f.id))]
+        self.assertEqual(ids, expected)
+
+    def test_cursor_respects_user_scoping(self):
+        own = baker.make(Client, user=self.user, _quantity=4)
+        baker.make(Client, user=baker.make(User), _quantity=4)
+        ids = self.collect_pages('/api/clients/?page_size=2')
+        self.assertEqual(ids, [c.id for c in own])
+
+class StreamingExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def test_csv_export_is_streamed_and_scoped(self):
+        baker.make(Client, name="Иван Иванов", email="ivanov@mail.com", phone="123", user=self.user)
+        baker.make(Client, name="Чужой Клиент", user=baker.make(User))
+
+        r = self.client.get('/api/clients/export/?type=csv')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.streaming)
+
+        content = b''.join(r.streaming_content).decode('utf-8-sig')
+        self.assertIn('Иван Иванов,ivanov@mail.com,123', content)
+        self.assertNotIn('Чужой Клиент', content)
+
+    def test_xlsx_export_is_valid_archive(self):
+        import zipfile
+        from io import BytesIO
+
+        baker.make(Flight, flight_number="SU100", user=self.user, _quantity=3)
+
+        r = self.client.get('/api/flights/export/')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r['Content-Disposition'], 'attachment; filename="flights.xlsx"')
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(r.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('SU100', sheet)
+
+class ExportJobsTestCase(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(EXPORT_JOBS_EAGER=True, EXPORT_CACHE_DIR=self.cache_dir.name)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.cache_dir.cleanup()
+
+    def test_job_completes_and_is_downloadable(self):
+        baker.make(Client, name="Иван Иванов", user=self.user)
+
+        r = self.client.post('/api/clients/export/jobs/', {'type': 'csv'})
+        self.assertEqual(r.status_code, 202)
+        job = r.json()
+        self.assertEqual(job['status'], 'done')
+
+        status_data = self.client.get(f"/api/clients/export/jobs/{job['id']}/").json()
+        self.assertEqual(status_data['status'], 'done')
+
+        r = self.client.get(f"/api/clients/export/jobs/{job['id']}/download/")
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('Иван Иванов', b''.join(r.streaming_content).decode('utf-8-sig'))
+
+    def test_artifact_reused_until_clients_change(self):
+        from transportation.jobs import get_job
+
+        baker.make(Client, user=self.user)
+        first = get_job(self.client.post('/api/clients/export/jobs/').json()['id'])
+        second = get_job(self.client.post('/api/clients/export/jobs/').json()['id'])
+        self.assertTrue(second['reused'])
+        self.assertEqual(first['digest'], second['digest'])
+
+        baker.make(Client, user=self.user)
+        third = get_job(self.client.post('/api/clients/export/jobs/').json()['id'])
+        self.assertFalse(third['reused'])
+        self.assertNotEqual(first['digest'], third['digest'])
+
+    def test_other_users_job_is_hidden(self):
+        job = self.client.post('/api/clients/export/jobs/').json()
+        self.client.force_authenticate(baker.make(User))
+        r = self.client.get(f"/api/clients/export/jobs/{job['id']}/")
+        self.assertEqual(r.status_code, 404)
+
+    def test_job_status_does_not_depend_on_cache(self):
+        from django.core.cache import cache
+
+        job = self.client.post('/api/clients/export/jobs/').json()
+        # Другой воркер с пустым локальным кэшем видит ту же задачу
+        cache.clear()
+        self.assertEqual(self.client.get(f"/api/clients/export/jobs/{job['id']}/").json()['status'], 'done')
+
+    def test_missing_job_is_not_run(self):
+        from transportation.jobs import _run_job
+
+        self.assertIsNone(_run_job('0' * 32, self.user, 'csv', (('name', 'ФИО'),), 'Клиенты'))
+
+    def test_abandoned_job_does_not_block_new_ones(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from transportation.jobs import JOB_TIMEOUT, _fingerprint
+        from transportation.models import ExportJob
+
+        stale = ExportJob.objects.create(id='f' * 32, user=self.user, type='csv', fingerprint=_fingerprint(self.user, 'csv'))
+        ExportJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(seconds=JOB_TIMEOUT + 1))
+
+        job = self.client.post('/api/clients/export/jobs/', {'type': 'csv'}).json()
+        self.assertNotEqual(job['id'], stale.id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(ExportJob.objects.get(pk=stale.pk).status, 'failed')
+
+    def test_expired_jobs_remove_unreferenced_artifacts(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from transportation.jobs import JOB_RETENTION, _delete_expired_jobs, artifact_path, get_job
+        from transportation.models import ExportJob
+
+        baker.make(Client, user=self.user)
+        old = get_job(self.client.post('/api/clients/export/jobs/', {'type': 'csv'}).json()['id'])
+        shared = get_job(self.client.post('/api/clients/export/jobs/', {'type': 'csv'}).json()['id'])
+        baker.make(Client, user=self.user)
+        orphan = get_job(self.client.post('/api/clients/export/jobs/', {'type': 'csv'}).json()['id'])
+        expired = timezone.now() - timedelta(seconds=JOB_RETENTION + 1)
+        ExportJob.objects.filter(pk__in=[old['id'], orphan['id']]).update(updated_at=expired)
+
+        _delete_expired_jobs()
+        # Файл старой задачи еще нужен повторно использовавшей его задаче
+        self.assertTrue(artifact_path(shared['digest'], 'csv').exists())
+        self.assertFalse(artifact_path(orphan['digest'], 'csv').exists())
+        self.assertEqual(list(ExportJob.objects.values_list('id', flat=True)), [shared['id']])
+
+    def test_running_job_is_shared(self):
+        from transportation.jobs import _fingerprint
+        from transportation.models import ExportJob
+
+        running = ExportJob.objects.create(id='e' * 32, user=self.user, type='csv',
+                                           fingerprint=_fingerprint(self.user, 'csv'), status='running')
+        self.assertEqual(self.client.post('/api/clients/export/jobs/', {'type': 'csv'}).json()['id'], running.id)
+
+class StatsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def expected(self, queryset):
+        from django.db.models import Count, Avg, Max, Min
+        return queryset.aggregate(count=Count("id"), avg=Avg("id"), max=Max("id"), min=Min("id"))
+
+    def test_stats_are_scoped_to_user(self):
+        baker.make(Flight, user=self.user, _quantity=3)
+        baker.make(Flight, user=baker.make(User), _quantity=2)
+
+        r = self.client.get('/api/flights/stats/')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), self.expected(Flight.objects.filter(user=self.user)))
+
+    def test_stats_follow_deletes(self):
+        clients = baker.make(Client, user=self.user, _quantity=4)
+        clients[-1].delete()
+        clients[0].delete()
+
+        data = self.client.get('/api/clients/stats/').json()
+        self.assertEqual(data, self.expected(Client.objects.filter(user=self.user)))
+
+    def test_superuser_sees_global_stats(self):
+        baker.make(Ticket, user=self.user, _quantity=2)
+        baker.make(Ticket, _quantity=2)
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='admin'))
+
+        data = self.client.get('/api/tickets/stats/').json()
+        self.assertEqual(data, self.expected(Ticket.objects.all()))
+
+    def test_deferred_user_is_not_loaded_per_row(self):
+        baker.make(Client, user=self.user, _quantity=5)
+        with CaptureQueriesContext(connection) as queries:
+            list(Client.objects.only('name'))
+        self.assertEqual(len(queries), 1)
+
+    def test_owner_change_of_deferred_instance(self):
+        other = baker.make(User)
+        client = baker.make(Client, user=self.user)
+        deferred = Client.objects.only('name').get(pk=client.pk)
+        deferred.user = other
+        deferred.save()
+        self.assertEqual(self.client.get('/api/clients/stats/').json()['count'], 0)
+
+    def test_cascade_delete_is_counted_in_batches(self):
+        def delete_cost(tickets):
+            client = baker.make(Client, user=self.user)
+            flight = baker.make(Flight, user=self.user)
+            for ticket in baker.make(Ticket, client=client, flight=flight, user=self.user, _quantity=tickets):
+                baker.make(Baggage, ticket=ticket, user=self.user)
+            with CaptureQueriesContext(connection) as queries:
+                client.delete()
+            return len(queries)
+
+        self.assertEqual(delete_cost(2), delete_cost(10))
+        for model, url in ((Client, 'clients'), (Ticket, 'tickets'), (Baggage, 'baggage')):
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.client.get(f'/api/{url}/stats/').json(),
+                                 self.expected(model.objects.filter(user=self.user)))
+
+    def test_queryset_delete_keeps_edges(self):
+        clients = baker.make(Client, user=self.user, _quantity=5)
+        Client.objects.filter(pk__in=[clients[0].pk, clients[-1].pk]).delete()
+        self.assertEqual(self.client.get('/api/clients/stats/').json(),
+                         self.expected(Client.objects.filter(user=self.user)))
+
+    def test_rebuild_matches_incremental(self):
+        from transportation.stats import rebuild_stats
+
+        baker.make(Baggage, user=self.user, _quantity=3)
+        before = self.client.get('/api/baggage/stats/').json()
+        rebuild_stats()
+        self.assertEqual(before, self.client.get('/api/baggage/stats/').json())
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def test_repeated_list_is_served_from_cache(self):
+        baker.make(Ticket, user=self.user, _quantity=3)
+        first = self.client.get('/api/tickets/').json()
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/tickets/').json()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(first, second)
+
+    def test_related_model_change_invalidates_cache(self):
+        ticket = baker.make(Ticket, user=self.user)
+        self.client.get(f'/api/tickets/{ticket.id}/')
+
+        ticket.flight.flight_number = 'NEW1'
+        ticket.flight.save()
+
+        data = self.client.get(f'/api/tickets/{ticket.id}/').json()
+        self.assertEqual(data['flight_detail']['flight_number'], 'NEW1')
+
+    def test_cache_is_per_user(self):
+        baker.make(Flight, user=self.user, _quantity=2)
+        self.assertEqual(len(self.client.get('/api/flights/').json()), 2)
+
+        self.client.force_authenticate(baker.make(User))
+        self.assertEqual(len(self.client.get('/api/flights/').json()), 0)
+
+    def test_version_is_bumped_again_after_commit(self):
+        from transportation.versions import get_data_version
+
+        flight = baker.make(Flight, user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            flight.flight_number = 'NEW2'
+            flight.save()
+            # Параллельный запрос до COMMIT закэшировал бы старые строки под этой версией
+            before_commit = get_data_version(Flight)
+        self.assertNotEqual(get_data_version(Flight), before_commit)
+
+    def test_shared_cache_check(self):
+        from django.test import override_settings
+        from transportation.checks import check_shared_cache
+
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['transportation.W001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_shared_cache(None), [])
+
+class FlightSearchTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def make_flight(self, departure, destination, departure_time, user=None):
+        return baker.make(
+            Flight, departure=departure, destination=destination,
+            departure_time=departure_time, user=user or self.user,
+        )
+
+    def test_search_by_route_and_time(self):
+        late = self.make_flight("Москва", "Казань", "2024-10-02T10:00:00Z")
+        early = self.make_flight("Москва", "Казань", "2024-10-01T10:00:00Z")
+        self.make_flight("Москва", "Казань", "2024-11-01T10:00:00Z")
+        self.make_flight("Москва", "Сочи", "2024-10-01T12:00:00Z")
+        self.make_flight("Москва", "Казань", "2024-10-01T11:00:00Z", user=baker.make(User))
+
+        r = self.client.get('/api/flights/search/', {
+            'origin': 'Москва', 'destination': 'Казань',
+            'departure_after': '2024-10-01T00:00:00Z', 'departure_before': '2024-10-31T00:00:00Z',
+        })
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([f['id'] for f in r.json()], [early.id, late.id])
+
+    def test_invalid_range_is_rejected(self):
+        r = self.client.get('/api/flights/search/', {
+            'departure_after': '2024-10-02T00:00:00Z', 'departure_before': '2024-10-01T00:00:00Z',
+        })
+        self.assertEqual(r.status_code, 400)
+
+class SeatMapTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+        self.flight = baker.make(Flight, user=self.user)
+        baker.make(Airplane, flight=self.flight, capacity=12)
+
+    def test_seat_map_marks_sold_seats(self):
+        baker.make(Ticket, flight=self.flight, seat_number="1B")
+        baker.make(Ticket, flight=self.flight, seat_number="2F")
+
+        data = self.client.get(f'/api/flights/{self.flight.id}/seats/').json()
+        self.assertEqual(data['capacity'], 12)
+        self.assertEqual(data['occupied'], 2)
+        self.assertEqual(data['layout'], ['.X....', '.....X'])
+
+    def test_seat_map_follows_ticket_changes(self):
+        ticket = baker.make(Ticket, flight=self.flight, seat_number="1A")
+        url = f'/api/flights/{self.flight.id}/seats/'
+        self.assertFalse(self.client.get(url, {'seat': '1A'}).json()['available'])
+
+        ticket.delete()
+        self.assertTrue(self.client.get(url, {'seat': '1A'}).json()['available'])
+
+        baker.make(Ticket, flight=self.flight, seat_number="1A")
+        self.assertFalse(self.client.get(url, {'seat': '1A'}).json()['available'])
+
+    def test_seat_outside_capacity_is_unavailable(self):
+        r = self.client.get(f'/api/flights/{self.flight.id}/seats/', {'seat': '3A'})
+        self.assertFalse(r.json()['available'])
+
+    def test_map_rebuilt_before_commit_is_dropped_after_commit(self):
+        from django.core.cache import cache
+        from transportation.seats import SEAT_MAP_TIMEOUT, _cache_key, get_seat_map
+
+        ticket = baker.make(Ticket, flight=self.flight, seat_number="1A")
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.delete()
+            # Параллельный запрос до COMMIT еще видит билет и кэширует старую карту
+            cache.set(_cache_key(self.flight.id), (12, b'\x01\x00'), timeout=SEAT_MAP_TIMEOUT)
+        self.assertEqual(get_seat_map(self.flight.id).occupied_count, 0)
+
+    def test_deferred_flight_is_not_loaded_per_row(self):
+        baker.make(Ticket, flight=self.flight, _quantity=3)
+        with CaptureQueriesContext(connection) as queries:
+            list(Ticket.objects.only('seat_number'))
+        self.assertEqual(len(queries), 1)
+
+class BulkTicketsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+        self.flight = baker.make(Flight, user=self.user)
+
+    def post_tickets(self, count):
+        clients = baker.make(Client, user=self.user, _quantity=count)
+        payload = [
+            {'client': c.id, 'flight': self.flight.id, 'seat_number': f'{i + 1}A'}
+            for i, c in enumerate(clients)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.post('/api/tickets/', payload, format='json')
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(len(r.json()), count)
+        return len(queries)
+
+    def test_bulk_create_query_count_does_not_grow(self):
+        # Первый запрос создает строки статистики, поэтому сравниваем следующие
+        self.post_tickets(1)
+        self.assertEqual(self.post_tickets(3), self.post_tickets(30))
+        self.assertEqual(Ticket.objects.filter(user=self.user).count(), 34)
+
+    def test_bulk_create_updates_stats(self):
+        self.post_tickets(4)
+        self.assertEqual(self.client.get('/api/tickets/stats/').json()['count'], 4)
+
+    def test_bulk_create_ignores_user_in_payload(self):
+        other = baker.make(User)
+        r = self.client.post('/api/tickets/', [
+            {'client': baker.make(Client, user=self.user).id, 'flight': self.flight.id,
+             'seat_number': '9Z', 'user': other.id},
+        ], format='json')
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(Ticket.objects.get(seat_number='9Z').user, self.user)
+
+    def test_bulk_create_invalidates_caches_after_commit(self):
+        from django.core.cache import cache
+        from transportation.seats import _cache_key, get_seat_map
+        from transportation.versions import get_data_version
+
+        baker.make(Airplane, flight=self.flight, capacity=12)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_tickets(2)
+            version = get_data_version(Ticket)
+            # Карта, собранная до COMMIT, не должна пережить его
+            get_seat_map(self.flight.id)
+        self.assertNotEqual(get_data_version(Ticket), version)
+        self.assertIsNone(cache.get(_cache_key(self.flight.id)))
+
+    def test_bulk_create_rejects_unknown_foreign_key(self):
+        r = self.client.post('/api/tickets/', [
+            {'client': 999999, 'flight': self.flight.id, 'seat_number': '1A'},
+        ], format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Ticket.objects.count(), 0)
+
+    def test_bulk_partial_update(self):
+        tickets = baker.make(Ticket, user=self.user, _quantity=3)
+        other = baker.make(Ticket, user=baker.make(User))
+
+        r = self.client.patch('/api/tickets/bulk/', [
+            {'id': t.id, 'seat_number': f'{i}C', 'flight': self.flight.id} for i, t in enumerate(tickets)
+        ], format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+        for i, t in enumerate(tickets):
+            t.refresh_from_db()
+            self.assertEqual((t.seat_number, t.flight_id), (f'{i}C', self.flight.id))
+
+        r = self.client.patch('/api/tickets/bulk/', [{'id': other.id, 'seat_number': '1A'}], format='json')
+        self.assertEqual(r.status_code, 400)
+
+    def test_single_create_still_works(self):
+        client_instance = baker.make(Client, user=self.user)
+        r = self.client.post('/api/baggage/', {
+            'ticket': baker.make(Ticket, client=client_instance, flight=self.flight).id,
+            'weight': 10, 'baggage_type': 'Сумка',
+        })
+        self.assertEqual(r.status_code, 201)
+
+class GenerateDataTestCase(TestCase):
+    def generate(self, **options):
+        from io import StringIO
+        from django.core.management import call_command
+
+        params = dict(clients=30, flights=5, airplanes=3, tickets=40, baggage=10, users=2,
+                      seed=11, workers=0, batch_size=7, stdout=StringIO())
+        params.update(options)
+        call_command('generate_data', **params)
+
+    def snapshot(self):
+        return (
+            list(Client.objects.order_by('id').values_list('name', 'email', 'phone')),
+            list(Ticket.objects.order_by('id').values_list('seat_number', flat=True)),
+        )
+
+    def test_counts_and_stats(self):
+        self.generate()
+        self.assertEqual(Client.objects.count(), 30)
+        self.assertEqual(Ticket.objects.count(), 40)
+        self.assertEqual(Baggage.objects.count(), 10)
+        self.assertEqual(Client.objects.filter(user__isnull=True).count(), 0)
+
+        from transportation.stats import get_model_stats
+        admin = User.objects.create_superuser(username='admin', password='admin')
+        self.assertEqual(get_model_stats(Ticket, admin)['count'], 40)
+
+    def test_same_seed_gives_same_data(self):
+        self.generate()
+        first = self.snapshot()
+        for model in (Baggage, Ticket, Airplane, Flight, Client, User):
+            model.objects.all().delete()
+        self.generate(batch_size=7)
+        self.assertEqual(first, self.snapshot())
+
+    def test_process_pool_keeps_chunk_order(self):
+        self.generate(batch_size=4)
+        first = self.snapshot()
+        for model in (Baggage, Ticket, Airplane, Flight, Client, User):
+            model.objects.all().delete()
+        # 30 клиентов порциями по 4 - больше порций, чем окно из 2 * workers
+        self.generate(workers=1, batch_size=4)
+        self.assertEqual(first, self.snapshot())
+
+    def test_second_run_on_same_database(self):
+        self.generate()
+        self.generate()
+        self.assertEqual(Airplane.objects.count(), 6)
+        self.assertEqual(Airplane.objects.values('tail_number').distinct().count(), 6)
+        self.assertEqual(User.objects.filter(username__startswith='gen11_').count(), 4)
+        self.assertEqual(Flight.objects.values('flight_number').distinct().count(), 10)
+
+class QueryBudgetTestCase(TestCase):
+    """Каждое действие вьюсета укладывается в свой бюджет SQL-запросов"""
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+        # По несколько связанных объектов, чтобы N+1 сразу выходил за бюджет
+        self.clients = baker.make(Client, user=self.user, _quantity=3)
+        self.flights = baker.make(Flight, user=self.user, _quantity=3)
+        self.tickets = [
+            baker.make(Ticket, client=c, flight=f, seat_number=f'{i + 1}A', user=self.user)
+            for i, (c, f) in enumerate(zip(self.clients * 2, self.flights * 2))
+        ]
+        self.baggage = [baker.make(Baggage, ticket=t, weight=Decimal('10.00'), user=self.user) for t in self.tickets]
+        self.airplanes = [baker.make(Airplane, flight=f, capacity=60, user=self.user) for f in self.flights]
+
+    def budget_requests(self, basename):
+        """action -> (метод, URL, данные); destroy идет последним"""
+        objects = {
+            'clients': self.clients, 'flights': self.flights, 'tickets': self.tickets,
+            'baggage': self.baggage, 'airplanes': self.airplanes,
+        }[basename]
+        payload = {
+            'clients': {'name': 'Иван', 'email': 'ivan@mail.com', 'phone': '123'},
+            'flights': {'flight_number': 'SU1', 'departure': 'Москва', 'destination': 'Сочи',
+                        'departure_time': '2025-05-01T10:00:00Z', 'arrival_time': '2025-05-01T12:00:00Z'},
+            'tickets': {'client': self.clients[0].id, 'flight': self.flights[0].id, 'seat_number': '9F'},
+            'baggage': {'ticket': self.tickets[0].id, 'weight': '12.00', 'baggage_type': 'Сумка'},
+            'airplanes': {'tail_number': 'RA-BUDGET', 'model': 'A320', 'capacity': 150, 'flight': self.flights[0].id},
+        }[basename]
+        url, detail = f'/api/{basename}/', f'/api/{basename}/{objects[0].id}/'
+
+        requests = {
+            'list': ('get', url, None),
+            'retrieve': ('get', detail, None),
+            'create': ('post', url, payload),
+            'update': ('put', detail, dict(payload, tail_number='RA-PUT') if basename == 'airplanes' else payload),
+            'partial_update': ('patch', detail, {}),
+            'get_stats': ('get', f'{url}stats/', None),
+            f'export_{basename}': ('get', f'{url}export/?type=csv', None),
+        }
+        if basename == 'clients':
+            requests['create_export_job'] = ('post', f'{url}export/jobs/', {'type': 'csv'})
+            requests['search'] = ('get', f'{url}search/?q={self.clients[0].name[:3]}', None)
+            requests['duplicates'] = ('get', f'{url}duplicates/', None)
+            requests['merge'] = ('post', f'{url}merge/', {'target': self.clients[1].id, 'sources': [self.clients[2].id]})
+        if basename == 'flights':
+            requests['search'] = ('get', f'{url}search/', None)
+            requests['seats'] = ('get', f'{detail}seats/', None)
+        if basename in ('tickets', 'baggage'):
+            requests['bulk_update'] = ('patch', f'{url}bulk/', [{'id': obj.id} for obj in objects])
+        requests['destroy'] = ('delete', detail, None)
+        return requests
+
+    def check_budgets(self, basename):
+        import tempfile
+        from django.core.cache import cache
+        from django.test import override_settings
+        from app.urls import router
+
+        viewset = next(v for _, v, b in router.registry if b == basename)
+        requests = self.budget_requests(basename)
+        self.assertEqual(set(viewset.query_budgets), set(requests), 'у каждого действия должен быть бюджет')
+
+        for action, (method, url, data) in requests.items():
+            cache.clear()
+            with self.subTest(action=action), \
+                    override_settings(EXPORT_CACHE_DIR=tempfile.mkdtemp(), EXPORT_JOBS_EAGER=True), \
+                    CaptureQueriesContext(connection) as queries:
+                r = getattr(self.client, method)(url, data, format='json')
+                if r.streaming:
+                    b''.join(r.streaming_content)
+                self.assertLess(r.status_code, 400, '' if r.streaming else r.content)
+                self.assertLessEqual(
+                    len(queries), viewset.query_budgets[action],
+                    '\n'.join(q['sql'] for q in queries.captured_queries),
+                )
+
+    def test_clients_budgets(self):
+        self.check_budgets('clients')
+
+    def test_flights_budgets(self):
+        self.check_budgets('flights')
+
+    def test_tickets_budgets(self):
+        self.check_budgets('tickets')
+
+    def test_baggage_budgets(self):
+        self.check_budgets('baggage')
+
+    def test_airplanes_budgets(self):
+        self.check_budgets('airplanes')
+
+    def test_first_writes_of_new_user_stay_within_budget(self):
+        from app.urls import router
+
+        # Новый пользователь без единой записи и строки статистики, созданные при регистрации
+        self.client.force_authenticate(User.objects.create_user(username='fresh', password='fresh'))
+        budgets = {b: v.query_budgets['create'] for _, v, b in router.registry if b in (
+            'clients', 'flights', 'tickets', 'baggage', 'airplanes')}
+        created = {}
+        payloads = [
+            ('clients', lambda: {'name': 'Иван', 'email': 'ivan@mail.com', 'phone': '123'}),
+            ('flights', lambda: {'flight_number': 'SU2', 'departure': 'Москва', 'destination': 'Сочи',
+                                 'departure_time': '2025-05-01T10:00:00Z', 'arrival_time': '2025-05-01T12:00:00Z'}),
+            ('tickets', lambda: {'client': created['clients'], 'flight': created['flights'], 'seat_number': '1A'}),
+            ('baggage', lambda: {'ticket': created['tickets'], 'weight': '12.00', 'baggage_type': 'Сумка'}),
+            ('airplanes', lambda: {'tail_number': 'RA-FRESH', 'model': 'A320', 'capacity': 150,
+                                   'flight': created['flights']}),
+        ]
+        for basename, payload in payloads:
+            with self.subTest(basename=basename), CaptureQueriesContext(connection) as queries:
+                r = self.client.post(f'/api/{basename}/', payload(), format='json')
+                self.assertEqual(r.status_code, 201, r.content)
+                created[basename] = r.json()['id']
+                self.assertLessEqual(len(queries), budgets[basename],
+                                     '\n'.join(q['sql'] for q in queries.captured_queries))
+
+    def test_every_budgeted_viewset_is_checked(self):
+        from app.urls import router
+        from transportation.budgets import QueryBudgetMixin
+
+        budgeted = {b for _, v, b in router.registry if issubclass(v, QueryBudgetMixin)}
+        checked = {name[len('test_'):-len('_budgets')] for name in dir(self)
+                   if name.startswith('test_') and name.endswith('_budgets')}
+        self.assertEqual(budgeted, checked)
+
+    def test_exceeded_budget_is_logged(self):
+        from unittest import mock
+        from django.test import override_settings
+        from transportation.api import ClientViewSet
+
+        with override_settings(QUERY_BUDGET_LOGGING=True), \
+                mock.patch.object(ClientViewSet, 'query_budgets', {'list': 0}), \
+                self.assertLogs('transportation.budgets', level='WARNING') as logs:
+            self.client.get('/api/clients/')
+        self.assertIn('ClientViewSet.list', logs.output[0])
+
+    def test_budget_counts_queries_on_every_database(self):
+        from unittest import mock
+        from django.db import connections
+        from django.test import override_settings
+
+        replica = mock.MagicMock()
+        with override_settings(QUERY_BUDGET_LOGGING=True), \
+                mock.patch.object(connections, 'all', return_value=[connection, replica]):
+            self.client.get('/api/clients/')
+        # На реплику ставится тот же счетчик, что посчитал запросы к основной базе
+        counter = replica.execute_wrapper.call_args.args[0]
+        self.assertGreater(counter.count, 0)
+
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+        baker.make(Client, user=self.user, _quantity=3)
+
+    def timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing_header(self):
+        from django.test import override_settings
+
+        with override_settings(PROFILING_SERVER_TIMING=True), CaptureQueriesContext(connection) as queries:
+            r = self.client.get('/api/clients/')
+        self.assertEqual(r.status_code, 200)
+
+        metrics = self.timing(r)
+        self.assertEqual(set(metrics), {'total', 'db', 'serialize'})
+        self.assertEqual(metrics['db']['desc'], f'"{len(queries)} queries"')
+        self.assertLessEqual(float(metrics['serialize']['dur']), float(metrics['total']['dur']))
+
+    def test_header_can_be_disabled(self):
+        from django.test import override_settings
+
+        with override_settings(PROFILING_SERVER_TIMING=False):
+            r = self.client.get('/api/clients/')
+        self.assertNotIn('Server-Timing', r)
+
+    def test_slow_request_is_logged_with_top_queries(self):
+        from django.test import override_settings
+
+        with override_settings(PROFILING_SLOW_REQUEST_MS=0, PROFILING_SLOW_TOP_QUERIES=1), \
+                self.assertLogs('transportation.profiling', level='WARNING') as logs:
+            self.client.get('/api/clients/')
+        message = logs.output[0]
+        self.assertIn('GET /api/clients/ -> 200', message)
+        self.assertEqual(message.count('SELECT'), 1)
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from transportation.metrics import registry
+
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def metrics(self):
+        r = self.client.get('/metrics')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return r.content.decode()
+
+    def test_requests_are_counted_per_action(self):
+        self.client.get('/api/clients/')
+        self.client.get('/api/clients/')
+        self.client.get('/api/clients/stats/')
+
+        text = self.metrics()
+        self.assertIn('http_requests_total{view="ClientViewSet",action="list",method="GET",status="2xx"} 2', text)
+        self.assertIn('http_requests_total{view="ClientViewSet",action="get_stats",method="GET",status="2xx"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="ClientViewSet",action="list",le="+Inf"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{view="ClientViewSet",action="get_stats"} 1', text)
+
+    def test_response_cache_hits_and_misses(self):
+        self.client.get('/api/clients/')
+        self.client.get('/api/clients/')
+
+        text = self.metrics()
+        self.assertIn('cache_requests_total{cache="response",result="miss"} 1', text)
+        self.assertIn('cache_requests_total{cache="response",result="hit"} 1', text)
+
+    def test_server_errors_are_counted(self):
+        from unittest import mock
+        from transportation.api import ClientViewSet
+
+        self.client.raise_request_exception = False
+        with mock.patch.object(ClientViewSet, 'list', side_effect=RuntimeError):
+            r = self.client.get('/api/clients/')
+        self.assertEqual(r.status_code, 500)
+        self.assertIn('http_request_errors_total{view="ClientViewSet",action="list"} 1', self.metrics())
+
+    def test_histogram_buckets_are_cumulative(self):
+        from transportation.metrics import Registry
+
+        registry = Registry(buckets=(0.1, 1.0))
+        for duration in (0.05, 0.5, 5):
+            registry.observe_request('View', 'list', 'GET', 200, duration)
+        text = registry.render()
+        self.assertIn('http_request_duration_seconds_bucket{view="View",action="list",le="0.1"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="View",action="list",le="1.0"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="View",action="list",le="+Inf"} 3', text)
+
+    def test_only_local_access(self):
+        r = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(r.status_code, 403)
+
+class AuthHotPathTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+
+    def login(self):
+        import base64
+
+        # Вход доступен только аутентифицированным, поэтому сам запрос входа идет с Basic
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'user:user').decode())
+        r = self.client.post('/api/user/login/', {'username': 'user', 'password': 'user'}, format='json')
+        self.client.credentials()
+        self.assertEqual(r.status_code, 200)
+
+    def otp_login(self):
+        import pyotp
+
+        self.user.profile.refresh_from_db()
+        key = pyotp.TOTP(self.user.profile.otp_key).now()
+        return self.client.post('/api/auth/otp-login/', {'key': key}, format='json')
+
+    def test_login_does_not_rewrite_profile(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.login()
+        self.assertFalse([q for q in queries.captured_queries if 'UPDATE "transportation_userprofile"' in q['sql']])
+
+    def test_session_requests_use_cached_principal(self):
+        self.login()
+        self.client.get('/api/clients/stats/')
+
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.post('/api/user/info/')
+        self.assertEqual(r.json()['user_id'], self.user.id)
+        self.assertEqual(len(queries), 0, [q['sql'] for q in queries.captured_queries])
+
+    def test_principal_is_refreshed_after_user_change(self):
+        self.login()
+        self.client.post('/api/user/info/')
+
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.post('/api/user/info/').json()['username'], 'renamed')
+
+    def test_otp_claim_needs_no_cache_lookup(self):
+        from unittest import mock
+        from transportation.api import SecuredModelViewSet
+
+        self.login()
+        self.assertFalse(self.client.get('/api/auth/otp-status/').json()['otp_good'])
+        r = self.otp_login()
+        self.assertTrue(r.json()['success'])
+
+        session = mock.Mock(session_key=self.client.session.session_key)
+        request = mock.Mock(META={'HTTP_X_OTP_CLAIM': r.json()['otp_claim']}, COOKIES={}, user=self.user, session=session)
+        with mock.patch('django.core.cache.cache.get', side_effect=AssertionError('кэш не нужен')):
+            self.assertTrue(SecuredModelViewSet.OTPRequired().has_permission(request, None))
+        self.assertTrue(self.client.get('/api/auth/otp-status/').json()['otp_good'])
+
+    def test_otp_claim_is_revoked_by_password_change_and_logout(self):
+        self.login()
+        claim = self.otp_login().json()['otp_claim']
+
+        self.assertTrue(self.client.get('/api/auth/otp-status/', HTTP_X_OTP_CLAIM=claim).json()['otp_good'])
+        self.client.post('/api/user/logout/')
+        self.login()
+        self.assertFalse(self.client.get('/api/auth/otp-status/').json()['otp_good'])
+        self.assertFalse(self.client.get('/api/auth/otp-status/', HTTP_X_OTP_CLAIM=claim).json()['otp_good'])
+
+        claim = self.otp_login().json()['otp_claim']
+        self.user.set_password('new')
+        self.user.save()
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        self.assertFalse(self.client.get('/api/auth/otp-status/', HTTP_X_OTP_CLAIM=claim).json()['otp_good'])
+
+    def test_bulk_deactivation_expires_with_principal_cache(self):
+        from django.core.cache import cache
+        from transportation.auth import _principal_key
+
+        self.login()
+        self.assertEqual(self.client.post('/api/user/info/').status_code, 200)
+        # update() не отправляет сигналы, кэш сбрасывается только по таймауту
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.delete(_principal_key(self.user.pk))
+        self.assertEqual(self.client.post('/api/user/info/').status_code, 403)
+
+    def test_principal_cache_timeout_is_short(self):
+        from unittest import mock
+        from django.conf import settings
+        from transportation.auth import load_principal
+
+        with mock.patch('transportation.auth.cache.set') as cache_set:
+            load_principal(self.user.pk)
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], settings.AUTH_PRINCIPAL_CACHE_TIMEOUT)
+        self.assertLess(settings.AUTH_PRINCIPAL_CACHE_TIMEOUT, settings.SESSION_COOKIE_AGE)
+
+class OTPQRCodeTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def test_qr_is_rendered_once_and_revalidated(self):
+        from unittest import mock
+        from transportation import qr
+
+        with mock.patch.object(qr, 'render_qr_png', wraps=qr.render_qr_png) as render:
+            first = self.client.get('/api/auth/otp-qr-code/')
+            second = self.client.get('/api/auth/otp-qr-code/')
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertTrue(first.content.startswith(b'\x89PNG'))
+        self.assertIn('no-cache', first['Cache-Control'])
+        self.assertIn('private', first['Cache-Control'])
+
+        r = self.client.get('/api/auth/otp-qr-code/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, b'')
+
+    def test_key_rotation_changes_etag(self):
+        import pyotp
+
+        etag = self.client.get('/api/auth/otp-qr-code/')['ETag']
+        self.user.profile.otp_key = pyotp.random_base32()
+        self.user.profile.save()
+
+        r = self.client.get('/api/auth/otp-qr-code/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+class ImageVariantsTestCase(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test import override_settings
+
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media, IMAGE_VARIANTS_EAGER=True, MEDIA_GRACE_PERIOD=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, size=(1600, 1200), mode='RGBA', name='photo.png'):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, format='PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def create_client(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post('/api/clients/', {
+                'name': 'Иван', 'email': 'ivan@mail.com', 'phone': '123', 'picture': self.upload(),
+            }, format='multipart')
+        self.assertEqual(r.status_code, 201, r.content)
+        return Client.objects.get(pk=r.json()['id'])
+
+    def test_variants_are_built_and_exposed(self):
+        from PIL import Image
+        from transportation.storage import media_storage
+
+        client_instance = self.create_client()
+        self.assertEqual(set(client_instance.picture_variants), {'thumb', 'medium', 'webp'})
+
+        expected = {'thumb': (160, 'JPEG'), 'medium': (640, 'JPEG'), 'webp': (640, 'WEBP')}
+        for variant, (size, image_format) in expected.items():
+            with Image.open(media_storage.path(client_instance.picture_variants[variant])) as image:
+                self.assertEqual((max(image.size), image.format), (size, image_format))
+
+        data = self.client.get(f'/api/clients/{client_instance.id}/').json()
+        self.assertTrue(data['picture_variants']['thumb'].startswith('http://testserver/media/clients/'))
+
+    def test_replacing_picture_removes_old_variants(self):
+        from transportation.storage import media_storage
+
+        client_instance = self.create_client()
+        old = client_instance.picture_variants
+
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.patch(f'/api/clients/{client_instance.id}/',
+                                  {'picture': self.upload(size=(800, 600), name='new.png')}, format='multipart')
+        self.assertEqual(r.status_code, 200, r.content)
+
+        client_instance.refresh_from_db()
+        self.assertNotEqual(client_instance.picture_variants, old)
+        self.assertFalse(any(media_storage.exists(name) for name in old.values()))
+        self.assertTrue(all(media_storage.exists(name) for name in client_instance.picture_variants.values()))
+
+    def test_pool_callback_closes_its_connection(self):
+        import threading
+        from concurrent.futures import Future
+        from unittest import mock
+        from transportation.images import _on_done
+
+        future = Future()
+        future.set_result({})
+        with mock.patch('transportation.images.connection') as pool_connection, \
+                mock.patch('transportation.images._store_variants'):
+            # В потоке запроса соединение остается открытым
+            _on_done(Client, 1, 'clients/a.png', {}, threading.get_ident(), future)
+            pool_connection.close.assert_not_called()
+
+            worker = threading.Thread(target=_on_done, args=(Client, 1, 'clients/a.png', {}, threading.get_ident(), future))
+            worker.start()
+            worker.join()
+            pool_connection.close.assert_called_once()
+
+    def test_variants_build_in_process_pool(self):
+        import os
+        import tempfile
+        from transportation.images import get_executor
+        from transportation.thumbnails import make_variants
+
+        directory = tempfile.mkdtemp()
+        source = os.path.join(directory, 'plane.png')
+        with open(source, 'wb') as f:
+            f.write(self.upload(size=(300, 200), mode='RGB').read())
+
+        sizes = get_executor().submit(make_variants, source, {'thumb': os.path.join(directory, 'thumb.jpg')}).result()
+        self.assertGreater(sizes['thumb'], 0)
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test import override_settings
+
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media, IMAGE_VARIANTS_EAGER=True, MEDIA_GRACE_PERIOD=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def image_bytes(self, color=(10, 120, 200)):
+        from io import BytesIO
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), color).save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def make_client(self, content, name='волк.jpg'):
+        from django.core.files.base import ContentFile
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client_instance = Client(name='Иван', email='ivan@mail.com', phone='123')
+            client_instance.picture.save(name, ContentFile(content))
+        return client_instance
+
+    def test_identical_uploads_share_one_file(self):
+        import hashlib
+        from transportation.storage import media_storage
+
+        content = self.image_bytes()
+        first, second = self.make_client(content), self.make_client(content, name='волк_copy.JPG')
+
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(first.picture.name, f'clients/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertEqual(media_storage.listdir(f'clients/{digest[:2]}')[1], [f'{digest}.jpg'])
+
+    def test_file_is_deleted_with_last_reference(self):
+        from transportation.storage import media_storage
+
+        first, second = self.make_client(self.image_bytes()), self.make_client(self.image_bytes())
+        name = first.picture.name
+        variants = list(Client.objects.get(pk=first.pk).picture_variants.values())
+        self.assertTrue(variants)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(media_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(media_storage.exists(name))
+        self.assertFalse(any(media_storage.exists(variant) for variant in variants))
+
+    def test_reused_file_survives_release_until_grace_period(self):
+        import os
+        from django.core.files.base import ContentFile
+        from django.test import override_settings
+        from transportation.images import release_picture
+        from transportation.storage import media_storage
+
+        content = self.image_bytes()
+        first = self.make_client(content)
+        name = first.picture.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertFalse(media_storage.exists(name))
+
+        # Старый файл без ссылок, который переиспользует загрузка с еще не закоммиченной записью
+        name = media_storage.save('clients/волк.jpg', ContentFile(content))
+        os.utime(media_storage.path(name), (0, 0))
+        self.assertEqual(media_storage.save('clients/волк.jpg', ContentFile(content)), name)
+
+        with override_settings(MEDIA_GRACE_PERIOD=3600):
+            self.assertEqual(release_picture(name), 0)
+        self.assertTrue(media_storage.exists(name))
+        self.assertGreater(release_picture(name), 0)
+        self.assertFalse(media_storage.exists(name))
+
+    def test_migrate_media_command(self):
+        import os
+        from io import StringIO
+        from django.core.management import call_command
+        from transportation.storage import is_content_name, media_storage
+
+        # Старые файлы с суффиксами: две копии одной картинки и одна без ссылок
+        os.makedirs(os.path.join(self.media, 'clients'))
+        content = self.image_bytes()
+        for file_name in ('волк.jpg', 'волк_3BWKyeu.jpg', 'волк_TRletzE.jpg'):
+            with open(os.path.join(self.media, 'clients', file_name), 'wb') as f:
+                f.write(content)
+        Client.objects.bulk_create([
+            Client(name='A', picture='clients/волк.jpg'), Client(name='B', picture='clients/волк_3BWKyeu.jpg'),
+        ])
+
+        out = StringIO()
+        call_command('migrate_media', '--delete-orphans', stdout=out)
+
+        names = set(Client.objects.values_list('picture', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_content_name(name))
+        self.assertEqual(sorted(media_storage.listdir('clients')[1]), [])
+        self.assertIn(f'Освобождено: {2 * len(content) / 1024 / 1024:.2f} МБ', out.getvalue())
+        self.assertTrue(all(Client.objects.values_list('picture_variants', flat=True)))
+
+class HTMLPagesTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import Client as HTTPClient
+
+        cache.clear()
+        self.http = HTTPClient()
+        flight = baker.make(Flight, flight_number='SU100')
+        self.tickets = [
+            baker.make(Ticket, client=baker.make(Client, name=f'Клиент {i}'), flight=flight, seat_number=f'{i}A')
+            for i in range(1, 8)
+        ]
+
+    def test_pages_are_paginated_with_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            r = self.http.get('/ticket/', {'page_size': 2})
+        self.assertContains(r, 'Клиент 1')
+        self.assertNotContains(r, 'Клиент 3')
+        self.assertContains(r, 'Страница 1 из 4')
+
+        r = self.http.get('/ticket/', {'page_size': 2, 'page': 2})
+        self.assertContains(r, 'Клиент 3')
+
+        with CaptureQueriesContext(connection) as large:
+            self.http.get('/ticket/', {'page_size': 7})
+        self.assertEqual(len(small), len(large))
+
+    def test_streaming_mode_renders_all_rows(self):
+        from transportation.views import ShowTicketsView
+
+        ShowTicketsView.stream_chunk_size, original = 3, ShowTicketsView.stream_chunk_size
+        self.addCleanup(setattr, ShowTicketsView, 'stream_chunk_size', original)
+
+        r = self.http.get('/ticket/', {'stream': '1'})
+        self.assertTrue(r.streaming)
+        chunks = [chunk.decode() for chunk in r.streaming_content]
+        # шапка, три порции строк, подвал
+        self.assertEqual(len(chunks), 5)
+        page = ''.join(chunks)
+        self.assertEqual(page.count('<li>'), 7)
+        self.assertIn('<title>Билеты</title>', page)
+        self.assertTrue(page.rstrip().endswith('</html>'))
+
+    def test_baggage_page_lists_baggage(self):
+        baker.make(Baggage, ticket=self.tickets[0], baggage_type='Чемодан', weight=Decimal('10.00'))
+        self.assertContains(self.http.get('/baggage/'), 'Тип багажа: Чемодан')
+
+    def test_repeat_views_are_served_from_fragment_cache(self):
+        self.http.get('/ticket/', {'page_size': 3})
+        with CaptureQueriesContext(connection) as queries:
+            r = self.http.get('/ticket/', {'page_size': 3})
+        self.assertEqual(len(queries), 0)
+        self.assertContains(r, 'Клиент 1')
+        self.assertContains(r, 'Страница 1 из 3')
+
+    def test_related_changes_invalidate_fragment(self):
+        self.http.get('/ticket/')
+        ticket_client = self.tickets[0].client
+        ticket_client.name = 'Переименованный'
+        ticket_client.save()
+
+        r = self.http.get('/ticket/')
+        self.assertContains(r, 'Переименованный')
+        self.assertNotContains(r, 'Клиент 1<br>')
+
+class DatabaseLayerTestCase(TestCase):
+    def test_sqlite_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def router(self):
+        from unittest import mock
+        from transportation.db import PrimaryReplicaRouter, unpin
+
+        unpin()
+        self.addCleanup(unpin)
+        patcher = mock.patch.object(PrimaryReplicaRouter, 'has_replica', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return PrimaryReplicaRouter()
+
+    def test_reads_go_to_replica_until_first_write(self):
+        from transportation.db import unpin
+
+        router = self.router()
+        # TestCase оборачивает тест в транзакцию, поэтому выходим из нее на время проверки
+        connection.in_atomic_block, atomic = False, connection.in_atomic_block
+        try:
+            self.assertEqual(router.db_for_read(Client), 'replica')
+            self.assertEqual(router.db_for_write(Client), 'default')
+            self.assertEqual(router.db_for_read(Client), 'default')
+
+            unpin()
+            self.assertEqual(router.db_for_read(Client), 'replica')
+        finally:
+            connection.in_atomic_block = atomic
+
+    def test_write_pins_client_to_primary(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from transportation.db import PIN_COOKIE, PrimaryPinMiddleware, primary_reads, unpin
+
+        router = self.router()
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Client))
+            if request.method == 'POST':
+                router.db_for_write(Client)
+            return HttpResponse()
+
+        middleware = PrimaryPinMiddleware(view)
+        factory = RequestFactory()
+        connection.in_atomic_block, atomic = False, connection.in_atomic_block
+        try:
+            response = middleware(factory.get('/'))
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+            unpin()
+            response = middleware(factory.post('/'))
+            self.assertIn(PIN_COOKIE, response.cookies)
+
+            # Следующий запрос того же клиента читает с основной базы, но срок не продлевает
+            unpin()
+            request = factory.get('/')
+            request.COOKIES[PIN_COOKIE] = '1'
+            response = middleware(request)
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+            self.assertEqual(seen, ['replica', 'replica', 'default'])
+
+            unpin()
+            with primary_reads():
+                self.assertEqual(router.db_for_read(Client), 'default')
+            self.assertEqual(router.db_for_read(Client), 'replica')
+        finally:
+            connection.in_atomic_block = atomic
+
+    def test_reads_inside_transaction_use_primary(self):
+        self.assertEqual(self.router().db_for_read(Client), 'default')
+
+    def test_no_replica_configured(self):
+        from transportation.db import PrimaryReplicaRouter
+
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(Client), 'default')
+        self.assertFalse(PrimaryReplicaRouter().allow_migrate('replica', 'transportation'))
+
+class AsyncAPITestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import Client as HTTPClient
+
+        cache.clear()
+        self.user = User.objects.create_user(username='async', password='pass')
+        flight = baker.make(Flight, flight_number='SU200', user=self.user)
+        self.clients = [baker.make(Client, name=f'Клиент {i}', user=self.user) for i in range(3)]
+        for i, client in enumerate(self.clients):
+            baker.make(Ticket, client=client, flight=flight, seat_number=f'{i}A', user=self.user)
+        self.other = baker.make(Client, name='Чужой', user=baker.make(User))
+        self.http = HTTPClient()
+        self.http.force_login(self.user)
+
+    def test_responses_match_sync_api(self):
+        for url in ('clients/', 'tickets/', f'clients/{self.clients[0].id}/', 'clients/stats/'):
+            with self.subTest(url=url):
+                sync = self.http.get(f'/api/{url}')
+                response = self.http.get(f'/api/async/{url}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), sync.json())
+
+    def test_keyset_pagination(self):
+        sync = self.http.get('/api/tickets/', {'page_size': 2}).json()
+        page = self.http.get('/api/async/tickets/', {'page_size': 2}).json()
+        self.assertEqual(page['results'], sync['results'])
+        self.assertIn('/api/async/tickets/?cursor=', page['next'])
+        self.assertEqual(len(self.http.get(page['next']).json()['results']), 1)
+
+    def test_other_users_objects_are_hidden(self):
+        self.assertEqual(self.http.get(f'/api/async/clients/{self.other.id}/').status_code, 404)
+        names = [item['name'] for item in self.http.get('/api/async/clients/').json()]
+        self.assertNotIn('Чужой', names)
+
+    def test_requires_authentication(self):
+        from django.test import Client as HTTPClient
+
+        self.assertEqual(HTTPClient().get('/api/async/clients/').status_code, 403)
+
+    def test_repeat_list_is_served_from_cache(self):
+        self.http.get('/api/async/tickets/')
+        with CaptureQueriesContext(connection) as queries:
+            self.http.get('/api/async/tickets/')
+        # Остаются только запросы сессии и пользователя
+        self.assertFalse([q for q in queries if 'transportation_ticket' in q['sql']])
+
+    async def test_served_by_asgi_handler(self):
+        from django.test import override_settings
+
+        await self.async_client.aforce_login(self.user)
+        with override_settings(PROFILING_SERVER_TIMING=True):
+            response = await self.async_client.get('/api/async/tickets/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        # Запросы из потоков sync_to_async попадают в профиль запроса
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+
+    async def test_cache_is_not_called_on_event_loop(self):
+        import asyncio
+        from contextlib import ExitStack
+        from unittest import mock
+        from django.core.cache import cache
+
+        def off_loop(method):
+            def wrapper(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    return method(*args, **kwargs)
+                raise AssertionError(f'cache.{method.__name__} блокирует цикл событий')
+            return wrapper
+
+        await self.async_client.aforce_login(self.user)
+        with ExitStack() as stack:
+            for name in ('get', 'get_many', 'set', 'add'):
+                stack.enter_context(mock.patch.object(cache, name, off_loop(getattr(cache, name))))
+            for _ in range(2):
+                response = await self.async_client.get('/api/async/tickets/')
+                self.assertEqual(response.status_code, 200)
+
+class ClientSearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='search', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.petr = baker.make(Client, name='Ёлкин Пётр', email='elkin@mail.ru', phone='+7 (912) 345-67-89', user=self.user)
+        self.ivan = baker.make(Client, name='Иванов Иван', email='petrov@mail.ru', phone='8 800 1000', user=self.user)
+        baker.make(Client, name='Ёлкина Анна', email='anna@mail.ru', phone='1', user=baker.make(User))
+
+    def search(self, q, **params):
+        r = self.client.get('/api/clients/search/', {'q': q, **params})
+        self.assertEqual(r.status_code, 200, r.content)
+        return [item['id'] for item in r.json()]
+
+    def test_cyrillic_prefix_search_ignores_case_and_yo(self):
+        self.assertEqual(self.search('елк'), [self.petr.id])
+        self.assertEqual(self.search('ЁЛКИН пет'), [self.petr.id])
+        self.assertEqual(self.search('ив'), [self.ivan.id])
+
+    def test_name_matches_rank_above_email(self):
+        by_email = baker.make(Client, name='Bob', email='smith@mail.ru', phone='2', user=self.user)
+        by_name = baker.make(Client, name='Anna Smith', email='anna@mail.ru', phone='3', user=self.user)
+        self.assertEqual(self.search('smith'), [by_name.id, by_email.id])
+
+    def test_email_and_phone_digits(self):
+        self.assertEqual(self.search('elkin@mail'), [self.petr.id])
+        self.assertEqual(self.search('+7912'), [self.petr.id])
+        self.assertEqual(self.search('345'), [self.petr.id])
+
+    def test_other_users_clients_are_hidden_from_regular_users(self):
+        self.assertEqual(self.search('анна'), [])
+        admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(admin)
+        self.assertEqual(len(self.search('анна')), 1)
+
+    def test_index_follows_changes(self):
+        self.petr.name = 'Соколов Петр'
+        self.petr.save()
+        self.assertEqual(self.search('елк'), [])
+        self.assertEqual(self.search('сокол'), [self.petr.id])
+
+        self.petr.delete()
+        self.assertEqual(self.search('сокол'), [])
+
+    def test_bulk_created_clients_are_indexed(self):
+        from transportation.bulk import after_bulk_create
+
+        clients = Client.objects.bulk_create([Client(name='Массовый Клиент', email='m@m.ru', phone='5', user=self.user)])
+        after_bulk_create(Client, clients)
+        self.assertEqual(self.search('массов'), [clients[0].id])
+
+    def test_limit_and_validation(self):
+        self.assertEqual(len(self.search('mail', limit=1)), 1)
+        self.assertEqual(self.client.get('/api/clients/search/').status_code, 400)
+        self.assertEqual(self.search('"*)('), [])
+
+    def test_rebuild_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM transportation_client_fts')
+        self.assertEqual(self.search('елк'), [])
+
+        out = StringIO()
+        call_command('rebuild_client_search', stdout=out)
+        self.assertIn('клиентов: 3', out.getvalue())
+        self.assertEqual(self.search('елк'), [self.petr.id])
+
+    def test_admin_search_uses_index(self):
+        from django.test import Client as HTTPClient
+
+        http = HTTPClient()
+        http.force_login(User.objects.create_superuser(username='admin', password='admin'))
+        r = http.get('/admin/transportation/client/', {'q': 'елк'})
+        self.assertContains(r, 'Ёлкин Пётр')
+        self.assertContains(r, 'Ёлкина Анна')
+        self.assertNotContains(r, 'Иванов Иван')
+
+class DuplicateClientsTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = User.objects.create_user(username='dedup', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make(self, name, email, phone, user=None):
+        return baker.make(Client, name=name, email=email, phone=phone, user=user or self.user)
+
+    def test_normalization(self):
+        from transportation.dedup import normalize_email, normalize_name, normalize_phone
+
+        for phone in ('+7 (912) 345-67-89', '8 912 345 6789', '9123456789', '+79123456789'):
+            self.assertEqual(normalize_phone(phone), '79123456789')
+        self.assertEqual(normalize_phone('12'), '')
+        self.assertEqual(normalize_email(' Ivan.Petrov+shop@Mail.RU '), 'ivan.petrov@mail.ru')
+        self.assertEqual(normalize_email('не email'), '')
+        self.assertEqual(normalize_name('Пётр Ёлкин'), normalize_name('ЕЛКИН  петр'))
+
+    def test_blocking_skips_unrelated_pairs(self):
+        from transportation.dedup import Record, candidate_pairs
+
+        records = [
+            Record(1, 'Иван Петров', 'a@x.ru', '+7 912 000 00 01'),
+            Record(2, 'Петров Иван', 'b@x.ru', '8 999 000 00 02'),
+            Record(3, 'Мария Соколова', 'c@x.ru', '+7 (912) 000-00-01'),
+            Record(4, 'Олег Смирнов', 'd@x.ru', '8 800 000 00 04'),
+        ]
+        # 1-2: одинаковое ФИО, 1-3: один телефон; клиента 4 ни с кем не сравниваем
+        self.assertEqual(candidate_pairs(records), {(1, 2), (1, 3)})
+
+    def test_groups_reformatted_duplicates(self):
+        from transportation.dedup import find_duplicate_groups
+
+        rows = [
+            (1, 'Ульяна Матвеевна Рыбакова', 'ulyana@example.org', '+7 (914) 177-76-31'),
+            (2, 'Рыбакова Ульяна Матвеевна', 'Ulyana@Example.org', '8 914 177 7631'),
+            (3, 'Рыбакова Ульяна', 'ulyana+shop@example.org', '89141777631'),
+            (4, 'Ольга Михайловна Ермакова', 'olga@example.net', '8 812 415 86 83'),
+            # Тезка без общих контактов - не дубликат
+            (5, 'Ульяна Матвеевна Рыбакова', 'other@example.com', '8 000 806 3608'),
+        ]
+        groups, _ = find_duplicate_groups(rows)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual([c['id'] for c in groups[0]['clients']], [1, 2, 3])
+        self.assertEqual(groups[0]['suggested_target'], 1)
+        self.assertEqual(groups[0]['pairs'][0]['reasons'], ['name', 'phone', 'email'])
+
+    def test_oversized_exact_block_is_not_quadratic(self):
+        from transportation.dedup import NEIGHBOR_WINDOW, find_duplicate_groups
+
+        letters = 'абвгдежзиклмнопрстуф'
+        # 500 разных клиентов с одним email-заглушкой и одна настоящая пара дубликатов
+        rows = [(i, f"Иван {''.join(letters[int(d)] for d in f'{i:03d}')}ов", 'test@example.com', f'+7 900 {i:07d}')
+                for i in range(1, 501)]
+        rows += [(501, 'Петров Иван', 'test@example.com', '+7 912 345 67 89'),
+                 (502, 'Иван Петров', 'test@example.com', '8 912 345 6789')]
+
+        groups, compared = find_duplicate_groups(rows)
+        self.assertLessEqual(compared, len(rows) * NEIGHBOR_WINDOW)
+        self.assertEqual([[c['id'] for c in group['clients']] for group in groups], [[501, 502]])
+
+    def test_report_endpoint_is_scoped_and_cached(self):
+        first = self.make('Иван Петров', 'ivan@mail.ru', '+7 912 345 67 89')
+        second = self.make('Петров Иван', 'IVAN@mail.ru', '89123456789')
+        self.make('Иван Петров', 'ivan@mail.ru', '+7 912 345 67 89', user=baker.make(User))
+
+        report = self.client.get('/api/clients/duplicates/').json()
+        self.assertEqual(report['clients'], 2)
+        self.assertEqual(report['groups_total'], 1)
+        self.assertEqual([c['id'] for c in report['groups'][0]['clients']], [first.id, second.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/clients/duplicates/')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(self.client.get('/api/clients/duplicates/', {'threshold': 5}).status_code, 400)
+
+    def test_merge_moves_tickets_and_removes_duplicates(self):
+        from transportation.search import search_client_ids
+        from transportation.stats import get_model_stats
+
+        target = self.make('Иван Петров', '', '+7 912 345 67 89')
+        source = self.make('Петров Иван', 'ivan@mail.ru', '89123456789')
+        flight = baker.make(Flight, user=self.user)
+        tickets = [baker.make(Ticket, client=c, flight=flight, seat_number=f'{i}A', user=self.user)
+                   for i, c in enumerate([target, source, source])]
+        self.client.get('/api/tickets/')
+        self.client.get('/api/clients/duplicates/')
+
+        r = self.client.post('/api/clients/merge/', {'target': target.id, 'sources': [source.id]}, format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(r.json()['moved_tickets'], 2)
+        self.assertEqual(sorted(r.json()['client']['tickets']), sorted(t.id for t in tickets))
+        self.assertEqual(r.json()['client']['email'], 'ivan@mail.ru')
+
+        self.assertFalse(Client.objects.filter(pk=source.id).exists())
+        self.assertEqual(Ticket.objects.filter(client=target).count(), 3)
+        self.assertEqual(get_model_stats(Client, self.user)['count'], 1)
+        self.assertEqual(search_client_ids('петров'), [target.id])
+        # Кэши списков и отчета сбрасываются
+        self.assertEqual({t['client_detail']['id'] for t in self.client.get('/api/tickets/').json()}, {target.id})
+        self.assertEqual(self.client.get('/api/clients/duplicates/').json()['groups_total'], 0)
+
+    def test_merge_validation(self):
+        mine = self.make('Иван', 'a@a.ru', '1')
+        foreign = self.make('Иван', 'a@a.ru', '1', user=baker.make(User))
+
+        r = self.client.post('/api/clients/merge/', {'target': mine.id, 'sources': [foreign.id]}, format='json')
+        self.assertEqual(r.status_code, 404)
+        self.assertTrue(Client.objects.filter(pk=foreign.id).exists())
+        r = self.client.post('/api/clients/merge/', {'target': mine.id, 'sources': [mine.id]}, format='json')
+        self.assertEqual(r.status_code, 400)
+
+    def test_merge_rejects_clients_of_different_users(self):
+        admin = User.objects.create_superuser(username='merge_admin', password='pass')
+        self.client.force_authenticate(admin)
+        mine = self.make('Иван', 'a@a.ru', '1')
+        other_user = baker.make(User)
+        foreign = self.make('Иван', 'a@a.ru', '1', user=other_user)
+        ticket = baker.make(Ticket, client=foreign, flight=baker.make(Flight, user=other_user), user=other_user)
+
+        r = self.client.post('/api/clients/merge/', {'target': mine.id, 'sources': [foreign.id]}, format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertTrue(Client.objects.filter(pk=foreign.id).exists())
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.client_id, foreign.id)
+
+
+class SparseFieldsTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = User.objects.create_user(username='sparse', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.flight = baker.make(Flight, flight_number='SU300', user=self.user)
+        self.passenger = baker.make(Client, name='Пассажир', user=self.user)
+        self.ticket = baker.make(Ticket, flight=self.flight, client=self.passenger, seat_number='1A', user=self.user)
+        self.baggage = baker.make(Baggage, ticket=self.ticket, weight=Decimal('10.00'), user=self.user)
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_parse_field_paths(self):
+        from transportation.serializers import parse_field_paths
+
+        self.assertEqual(parse_field_paths('id, flight_detail.flight_number,flight_detail.id,,'),
+                         {'id': {}, 'flight_detail': {'flight_number': {}, 'id': {}}})
+        self.assertEqual(parse_field_paths(''), {})
+
+    def test_default_response_is_unchanged(self):
+        data, _ = self.get('/api/tickets/')
+        self.assertEqual(data[0]['flight_detail']['flight_number'], 'SU300')
+        self.assertEqual(data[0]['client_detail']['tickets'], [self.ticket.id])
+
+    def test_fields_limit_keys_and_queries(self):
+        _, full = self.get('/api/tickets/')
+        data, lean = self.get('/api/tickets/', {'fields': 'id,seat_number'})
+        self.assertEqual(data, [{'id': self.ticket.id, 'seat_number': '1A'}])
+        # Без вложенных клиента и рейса не нужны ни JOIN, ни prefetch билетов клиента
+        self.assertEqual(lean, 1)
+        self.assertLess(lean, full)
+
+    def test_nested_fields(self):
+        data, _ = self.get('/api/baggage/', {'fields': 'id,ticket_detail.seat_number,ticket_detail.flight_detail.flight_number'})
+        self.assertEqual(data, [{
+            'id': self.baggage.id,
+            'ticket_detail': {'seat_number': '1A', 'flight_detail': {'flight_number': 'SU300'}},
+        }])
+
+    def test_expand_collapses_other_nested_objects_to_ids(self):
+        data, queries = self.get('/api/tickets/', {'expand': ''})
+        self.assertEqual(data[0]['flight_detail'], self.flight.id)
+        self.assertEqual(data[0]['client_detail'], self.passenger.id)
+        self.assertEqual(queries, 1)
+
+        data, _ = self.get('/api/baggage/', {'expand': 'ticket_detail.flight_detail'})
+        ticket = data[0]['ticket_detail']
+        self.assertEqual(ticket['flight_detail']['flight_number'], 'SU300')
+        self.assertEqual(ticket['client_detail'], self.passenger.id)
+
+    def test_retrieve_and_async_api(self):
+        from django.test import Client as HTTPClient
+
+        data, _ = self.get(f'/api/clients/{self.passenger.id}/', {'fields': 'id,name'})
+        self.assertEqual(data, {'id': self.passenger.id, 'name': 'Пассажир'})
+        http = HTTPClient()
+        http.force_login(self.user)
+        params = {'fields': 'id,seat_number,client_detail.name'}
+        self.assertEqual(http.get('/api/async/tickets/', params).json(), self.get('/api/tickets/', params)[0])
+
+    def test_cached_responses_depend_on_fields(self):
+        self.get('/api/tickets/')
+        data, _ = self.get('/api/tickets/', {'fields': 'id'})
+        self.assertEqual(data, [{'id': self.ticket.id}])
+
+    def test_writes_ignore_fields(self):
+        response = self.client.post('/api/clients/?fields=id', {'name': 'Новый', 'email': 'new@example.org', 'phone': '1'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'Новый')
@@ -0,0 +1,53 @@
+import os
+
+from PIL import Image, ImageOps
+
+# Построение уменьшенных копий изображений. Модуль не импортирует Django,
+# поэтому функции выполняются в пуле процессов (см. transportation/images.py).
+
+# имя варианта -> (наибольшая сторона, формат, расширение, качество)
+VARIANTS = {
+    "thumb": (160, "JPEG", "jpg", 80),
+    "medium": (640, "JPEG", "jpg", 82),
+    "webp": (640, "WEBP", "webp", 80),
+}
+
+
+def variant_name(name, variant):
+    """clients/photo.png -> clients/variants/photo_thumb.jpg"""
+    directory, base = os.path.split(os.path.splitext(name)[0])
+    extension = VARIANTS[variant][2]
+    return os.path.join(directory, "variants", f"{base}_{variant}.{extension}")
+
+
+def _prepare(image, image_format):
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        # У JPEG нет прозрачности: накладываем изображение на белый фон
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image
+
+
+def make_variants(source, targets):
+    """Сохраняет варианты изображения source в пути targets {вариант: путь}, возвращает их размеры в байтах"""
+    sizes = {}
+    with Image.open(source) as image:
+        # JPEG можно сразу декодировать в уменьшенном масштабе
+        largest = max(VARIANTS[variant][0] for variant in targets)
+        image.draft("RGB", (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image)
+
+        for variant, target in targets.items():
+            size, image_format, _, quality = VARIANTS[variant]
+            copy = image.copy()
+            copy.thumbnail((size, size), reducing_gap=2.0)
+            copy = _prepare(copy, image_format)
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f"{target}.part"
+            copy.save(tmp, format=image_format, quality=quality, optimize=True)
+            os.replace(tmp, target)
+            sizes[variant] = os.path.getsize(target)
+    return sizes
@@ -0,0 +1,71 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Версия данных модели: число в кэше, которое увеличивается при каждом
+# сохранении/удалении объекта. Любой кэш, в ключ которого входит версия,
+# автоматически становится неактуальным после изменения данных.
+# Версии должны быть общими для всех процессов, поэтому при нескольких
+# воркерах нужен общий кэш (REDIS_URL в настройках, см. transportation/checks.py).
+
+def _version_key(model):
+    return f"data_version_{model._meta.label_lower}"
+
+
+def get_data_version(model):
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        # Начинаем со времени, чтобы после вытеснения ключа не повторить старую версию
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_data_versions(models):
+    """Версии нескольких моделей одним обращением к кэшу"""
+    keys = {_version_key(model): model for model in models}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, model in keys.items():
+        versions[model] = found[key] if key in found else get_data_version(model)
+    return versions
+
+
+async def aget_data_version(model):
+    """То же для асинхронных представлений: кэш может быть сетевым и не должен блокировать цикл событий"""
+    key = _version_key(model)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_data_versions(models):
+    keys = {_version_key(model): model for model in models}
+    found = await cache.aget_many(list(keys))
+    versions = {}
+    for key, model in keys.items():
+        versions[model] = found[key] if key in found else await aget_data_version(model)
+    return versions
+
+
+def bump_data_version(model):
+    version = _increment(model)
+    if transaction.get_connection().in_atomic_block:
+        # До COMMIT параллельный запрос еще видит старые строки и может закэшировать
+        # их под новой версией; второй сдвиг после COMMIT делает такую запись недостижимой
+        transaction.on_commit(lambda: _increment(model))
+    return version
+
+
+def _increment(model):
+    key = _version_key(model)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
@@ -1,49 +1,128 @@
-import base64
-import logging
+import hashlib
 from typing import Any
-from django.views.generic import TemplateView
 
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.template import engines
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.views.generic import ListView
+
+from transportation.db import primary_reads
+from transportation.metrics import count_cache
 from transportation.models import Client, Flight, Ticket, Baggage, Airplane
+from transportation.versions import get_data_versions
+
+ROWS_MARKER = "<!--rows-->"
+
+
+# Список объектов на HTML-странице: постранично (?page=, ?page_size=) или
+# потоком (?stream=1), когда строки отдаются клиенту порциями по мере выборки.
+# Таблица страницы с навигацией кэшируется; ключ включает версии данных
+# моделей из cache_models, которые сигналы сохранения/удаления увеличивают.
+class ShowListView(ListView):
+    paginate_by = 100
+    max_paginate_by = 1000
+    stream_chunk_size = 500
+    row_template_name = None
+    rows_template_name = "clients/list_rows.html"
+    cache_models = ()
+
+    def get_paginate_by(self, queryset):
+        try:
+            size = int(self.request.GET.get("page_size", self.paginate_by))
+        except ValueError:
+            size = self.paginate_by
+        return max(1, min(size, self.max_paginate_by))
+
+    def get_rows_cache_key(self):
+        versions = get_data_versions(self.cache_models)
+        raw = "|".join([
+            type(self).__name__,
+            self.request.GET.get("page", "1"),
+            str(self.get_paginate_by(None)),
+            *(f"{model._meta.label_lower}={versions[model]}" for model in self.cache_models),
+        ])
+        return "html_rows_" + hashlib.sha256(raw.encode()).hexdigest()
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        key = self.get_rows_cache_key()
+        rows_html = cache.get(key)
+        count_cache("html_rows", rows_html is not None)
+        if rows_html is None:
+            # Запросы (count и строки страницы) выполняются только при промахе, с основной базы
+            with primary_reads():
+                context = super().get_context_data(**kwargs)
+                context["row_template"] = self.row_template_name
+                context["page_size"] = self.get_paginate_by(self.object_list)
+                rows_html = render_to_string(self.rows_template_name, context, request=self.request)
+            cache.set(key, rows_html, timeout=settings.HTML_CACHE_TIMEOUT)
+        return {"view": self, "rows_html": mark_safe(rows_html)}
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("stream") == "1":
+            self.object_list = self.get_queryset()
+            return StreamingHttpResponse(self.stream(), content_type="text/html; charset=utf-8")
+        return super().get(request, *args, **kwargs)
+
+    def stream(self):
+        # Шапка и подвал - та же страница без строк, разрезанная по месту списка
+        page = render_to_string(
+            self.get_template_names(),
+            {"streaming": True, "object_list": [], self.context_object_name: []},
+            request=self.request,
+        )
+        head, tail = page.split(ROWS_MARKER, 1)
+        yield head
+
+        rows = engines["django"].from_string('{% for object in rows %}{% include row_template %}{% endfor %}')
+        chunk = []
+        for obj in self.object_list.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(obj)
+            if len(chunk) == self.stream_chunk_size:
+                yield rows.render({"rows": chunk, "row_template": self.row_template_name})
+                chunk = []
+        if chunk:
+            yield rows.render({"rows": chunk, "row_template": self.row_template_name})
+        yield tail
 
-# Create your views here.
-class ShowClientsView(TemplateView):
+
+class ShowClientsView(ShowListView):
     template_name = "clients/show_clients.html"
-    
-    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:  
-        context = super().get_context_data(**kwargs)
-        context['clients'] = Client.objects.all()
-       
-        return context
-      
-class ShowFlightsView(TemplateView):
+    row_template_name = "clients/rows/client.html"
+    context_object_name = "clients"
+    queryset = Client.objects.order_by("id")
+    cache_models = (Client,)
+
+
+class ShowFlightsView(ShowListView):
     template_name = "clients/show_flights.html"
+    row_template_name = "clients/rows/flight.html"
+    context_object_name = "flights"
+    queryset = Flight.objects.order_by("id")
+    cache_models = (Flight,)
 
-    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
-        context = super().get_context_data(**kwargs)
-        context['flights'] = Flight.objects.all()
-        return context
- 
-class ShowBaggagesView(TemplateView):
+
+class ShowBaggagesView(ShowListView):
     template_name = "clients/show_baggages.html"
+    row_template_name = "clients/rows/baggage.html"
+    context_object_name = "baggages"
+    queryset = Baggage.objects.select_related("ticket__client").order_by("id")
+    cache_models = (Baggage, Ticket, Client)
 
-    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
-        context = super().get_context_data(**kwargs)
-        context['baggage'] = Baggage.objects.all()
-        return context
 
-class ShowTicketsView(TemplateView):
+class ShowTicketsView(ShowListView):
     template_name = "clients/show_tickets.html"
+    row_template_name = "clients/rows/ticket.html"
+    context_object_name = "tickets"
+    queryset = Ticket.objects.select_related("client", "flight").order_by("id")
+    cache_models = (Ticket, Client, Flight)
 
-    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
-        context = super().get_context_data(**kwargs)
-        context['tickets'] = Ticket.objects.all()
-        return context   
-    
-class ShowAirplanesView(TemplateView):
-    template_name = "clients/show_airplanes.html"
-
-    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
-        context = super().get_context_data(**kwargs)
-        context['airplanes'] = Airplane.objects.all()
-        return context     
 
+class ShowAirplanesView(ShowListView):
+    template_name = "clients/show_airplanes.html"
+    row_template_name = "clients/rows/airplane.html"
+    context_object_name = "airplanes"
+    queryset = Airplane.objects.select_related("flight").order_by("id")
+    cache_models = (Airplane, Flight)